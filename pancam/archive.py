@@ -0,0 +1,744 @@
+# -*- coding: utf-8 -*-
+"""Creates and unpacks compressed session archives using multiple processes.
+
+bz2 and xz both allow a file to be made up of several independently
+compressed streams one after the other, which the standard tools and the
+python tarfile module read as one. The tar stream is therefore split into
+blocks which are compressed in parallel and written in order, giving a
+normal .tar.bz2 or .tar.xz.
+
+When unpacking, the file is split at the start of each compressed stream and
+the streams are decompressed in parallel. Should the file not split cleanly,
+such as one written by a single threaded tool, it is decompressed serially.
+
+SessionArchive allows a session to be processed without unpacking it. The
+source type is found from the member names and only the members read by the
+extractors are written out, to be removed again once processed.
+
+:copyright: (c) 2020 by Barry J Whiteside. Mullard Space Science Laboratory - UCL
+
+:license: GPLv3, see LICENSE for more details.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import bisect
+import bz2
+import contextlib
+import fnmatch
+import io
+import json
+import logging
+import lzma
+import mmap
+import os
+import re
+import shutil
+import tarfile
+
+import pancam_fns
+
+logger = logging.getLogger(__name__)
+status = logging.getLogger('status')
+
+# Global parameters
+# Suffix, uncompressed block size and stream start signature of each codec
+CODECS = {
+    'bz2': {'Suffix': '.tar.bz2',
+            'Block': 8*1024*1024,
+            'Magic': re.compile(rb'BZh[1-9]\x31\x41\x59\x26\x53\x59')},
+    'xz': {'Suffix': '.tar.xz',
+           'Block': 8*1024*1024,
+           'Magic': re.compile(rb'\xfd7zXZ\x00')},
+}
+
+IndexVer = 1
+INDEX_SUFFIX = '.idx'
+
+# Members read by each extractor, as (wildcard, recursive), staged just
+# before it runs and removed once it completes
+EXTRACTOR_MEMBERS = {
+    'swis.create_instances': [('*.txt', False), ('*_SC.bin', False)],
+    'labview.hk_extract': [('RMAP_HK*.txt', False)],
+    'labview.hs_extract': [('RMAP_H&S*.txt', False)],
+    'labview.tc_extract': [('RMAP_CMD_*.txt', True)],
+    'labview.sci_extract': [('RMAP_Sci*.txt', False)],
+    'labview.bin_move': [('*.bin', True), ('*.pci_spw', True)],
+    'labview.psu_extract': [('PSU_Log_*.txt', True)],
+    'rover.TM_extract': [('STDRawOcds*.csv', True)],
+    'rover.TC_extract': [('STDChrono*.csv', True)],
+    'rover_ha.HaScan': [('*.ha', True)],
+    'rover.NavCamBrowse': [('*.pgm', True)],
+    'swis.nsvf_parse': [('Router_A_packet.log', True), ('logbook.log', True)],
+    'swis.nsvf_lb_extract': [('logbook.log', True)],
+}
+# Member identifying each source, in the order of the checks in main.py
+SOURCE_MEMBERS = {
+    'SWIS': ('*HK.txt', False),
+    'LabView': ('RMAP_HK*.txt', False),
+    'Rover': ('STDRawOcds*.csv', True),
+    'Single SWIS': ('Router_A_packet.log', True),
+}
+STAGE_IGNORE_DIRS = ('PROC/',)
+
+
+class ArchiveError(Exception):
+    """error for unexpected things"""
+    pass
+
+
+def codec_of(archive_file):
+    """Returns the codec name from the archive suffix"""
+    for codec, info in CODECS.items():
+        if Path(archive_file).name.endswith(info['Suffix']):
+            return codec
+    raise ArchiveError("Not a valid archive format: " + str(archive_file))
+
+
+def create_archive(src_dir, archive_file=None, codec='bz2', workers=None):
+    """Creates a compressed tar archive of the contents of src_dir.
+
+    Arguments:
+        src_dir {Path} -- Folder to be archived.
+
+    Keyword Arguments:
+        archive_file {Path} -- Archive to create, None for src_dir with the codec suffix (default: {None})
+        codec {str} -- 'bz2' or 'xz' (default: {'bz2'})
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+
+    Returns:
+        Path -- The archive created.
+    """
+
+    if codec not in CODECS:
+        raise ArchiveError("Unknown archive codec: " + str(codec))
+
+    src_dir = Path(src_dir)
+    if archive_file is None:
+        archive_file = src_dir.with_name(src_dir.name + CODECS[codec]['Suffix'])
+
+    logger.info("Creating %s archive %s", codec, archive_file)
+
+    tmp_file = archive_file.with_name(archive_file.name + '.partial')
+    with open(tmp_file, 'wb') as f, \
+            BlockCompressor(f, codec, workers) as blocks, \
+            tarfile.open(fileobj=blocks, mode='w|') as tar:
+        tar.add(src_dir, arcname='.')
+
+    os.replace(tmp_file, archive_file)
+    logger.info("Archive created, %d bytes", archive_file.stat().st_size)
+
+    return archive_file
+
+
+def extract_archive(archive_file, dest_dir, workers=None):
+    """Unpacks a .tar.bz2 or .tar.xz archive into dest_dir.
+
+    Arguments:
+        archive_file {Path} -- Archive to unpack.
+        dest_dir {Path} -- Folder to unpack into.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+    """
+
+    logger.info("Unpacking archive %s to: %s", archive_file, dest_dir)
+
+    with open_stream(archive_file, workers) as stream, \
+            tarfile.open(fileobj=stream, mode='r|') as tar:
+        for member in tar:
+            tar.extract(member, dest_dir, **_extract_filter())
+
+
+def open_stream(archive_file, workers=None):
+    """Returns a binary file object of the decompressed archive contents.
+
+    Arguments:
+        archive_file {Path} -- .tar.bz2 or .tar.xz archive.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+    """
+
+    codec = codec_of(archive_file)
+
+    with open(archive_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ArchiveError("Empty archive: " + str(archive_file))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            starts = [match.start()
+                      for match in CODECS[codec]['Magic'].finditer(mm)]
+        size = os.fstat(f.fileno()).st_size
+
+    if (len(starts) < 2) or (starts[0] != 0):
+        logger.info("Single compressed stream, decompressing serially")
+        return _serial_stream(archive_file, codec)
+
+    logger.info("Decompressing %d streams in parallel", len(starts))
+    spans = list(zip(starts, starts[1:] + [size]))
+    return io.BufferedReader(
+        _ParallelStream(archive_file, codec, spans, workers), 1024*1024)
+
+
+def _serial_stream(archive_file, codec):
+    if codec == 'bz2':
+        return bz2.open(archive_file, 'rb')
+    return lzma.open(archive_file, 'rb')
+
+
+def _compress(codec, data):
+    if codec == 'bz2':
+        return bz2.compress(data, 9)
+    # Low preset as xz is selected for speed, mainly when unpacking
+    return lzma.compress(data, preset=1)
+
+
+def _decompress(archive_file, codec, start, end):
+    """Decompresses a single stream, returns None if not exactly one stream"""
+
+    with open(archive_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    if codec == 'bz2':
+        dec = bz2.BZ2Decompressor()
+    else:
+        dec = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+    try:
+        out = dec.decompress(data)
+    except (OSError, EOFError, lzma.LZMAError):
+        return None
+
+    if not dec.eof or dec.unused_data:
+        return None
+
+    return out
+
+
+def _extract_filter():
+    # Python 3.12 and later warn unless an extraction filter is given
+    if hasattr(tarfile, 'data_filter'):
+        return {'filter': 'data'}
+    return {}
+
+
+class BlockCompressor(io.RawIOBase):
+    """Write only file object that compresses each block in a process pool.
+
+    Each block is compressed as an independent stream and written to fileobj
+    in order, with at most twice the number of workers blocks in memory.
+
+    Arguments:
+        fileobj -- Binary file object to write the compressed streams to.
+        codec {str} -- 'bz2' or 'xz'.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+    """
+
+    def __init__(self, fileobj, codec, workers=None):
+        super().__init__()
+        self.fileobj = fileobj
+        self.codec = codec
+        self.block = CODECS[codec]['Block']
+        self.workers = workers or os.cpu_count() or 1
+        self._buf = bytearray()
+        self._pending = deque()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        while len(self._buf) >= self.block:
+            self._submit(bytes(self._buf[:self.block]))
+            del self._buf[:self.block]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buf:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._pool.shutdown()
+            super().close()
+
+    def _submit(self, data):
+        if len(self._pending) >= 2 * self.workers:
+            self._write_next()
+        self._pending.append(self._pool.submit(_compress, self.codec, data))
+
+    def _write_next(self):
+        self.fileobj.write(self._pending.popleft().result())
+
+
+class _ParallelStream(io.RawIOBase):
+    """Read only file object of streams decompressed in a process pool.
+
+    The compressed span and decompressed offset and length of each stream
+    read are recorded in blocks, or blocks is None if it fell back to serial.
+    """
+
+    def __init__(self, archive_file, codec, spans, workers=None):
+        super().__init__()
+        self.archive_file = archive_file
+        self.codec = codec
+        self.workers = workers or os.cpu_count() or 1
+        self._spans = deque(spans)
+        self._pending = deque()
+        self._data = memoryview(b'')
+        self._serial = None
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._offset = 0
+        self._decoded = 0
+        self.blocks = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._data:
+            if self._serial is not None:
+                return self._serial.readinto(b)
+            if not self._fill():
+                return 0
+
+        num = min(len(b), len(self._data))
+        b[:num] = self._data[:num]
+        self._data = self._data[num:]
+        self._offset += num
+        return num
+
+    def close(self):
+        if self.closed:
+            return
+        for pending in self._pending:
+            pending[2].cancel()
+        self._pool.shutdown()
+        if self._serial is not None:
+            self._serial.close()
+        super().close()
+
+    def _fill(self):
+        while self._spans and len(self._pending) < 2 * self.workers:
+            start, end = self._spans.popleft()
+            self._pending.append((start, end, self._pool.submit(
+                _decompress, self.archive_file, self.codec, start, end)))
+
+        if not self._pending:
+            return False
+
+        start, end, future = self._pending.popleft()
+        out = future.result()
+        if out is None:
+            # Not a clean split, continue serially from the current position
+            logger.info("Streams not split cleanly, decompressing serially")
+            self._serial = _serial_stream(self.archive_file, self.codec)
+            self._serial.seek(self._offset)
+            self._data = memoryview(b'')
+            self.blocks = None
+            return True
+
+        self.blocks.append([start, end, self._decoded, len(out)])
+        self._decoded += len(out)
+        self._data = memoryview(out)
+        return True
+
+
+class SessionArchive(object):
+    """Index of a session archive allowing members to be read in place.
+
+    The tar headers are read once and the member names, offsets and sizes
+    stored in a sidecar file next to the archive, which is reused while the
+    archive size and mtime are unchanged. For archives written by
+    create_archive the decompressed offset of every compressed stream is also
+    recorded so a member is read by decompressing only the streams it spans.
+
+    Arguments:
+        archive_file {Path} -- .tar.bz2 or .tar.xz session archive.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+        use_sidecar {bool} -- Read and write the index sidecar file (default: {True})
+
+    Usage:
+        with SessionArchive(archive_file) as arch:
+            with arch.staging(session_dir, EXTRACTOR_MEMBERS['rover.TM_extract']):
+                rover.TM_extract(session_dir)
+    """
+
+    def __init__(self, archive_file, workers=None, use_sidecar=True):
+        self.file = Path(archive_file)
+        self.codec = codec_of(self.file)
+        self.sidecar = self.file.with_name(self.file.name + INDEX_SUFFIX)
+        self.workers = workers
+        self.use_sidecar = use_sidecar
+        self.members = None
+        self.blocks = None
+        self.block_starts = None
+        self.staged = []
+        self._prefix = ''
+        self._tar = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """Loads or builds the member index"""
+
+        stat = self.file.stat()
+        if self.use_sidecar:
+            self._load_sidecar(stat)
+
+        if self.members is None:
+            logger.info("Indexing %s", self.file.name)
+            self._build_index()
+            if self.use_sidecar:
+                self._write_sidecar(stat)
+        else:
+            logger.info("Using existing index for %s", self.file.name)
+
+        # Decompressed offset of each stream, for finding those a member spans
+        if self.blocks is not None:
+            self.block_starts = [block[2] for block in self.blocks]
+
+        logger.info("%d files within archive", len(self.members))
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+
+    def find(self, pattern, recursive=True):
+        """Returns the member names matching the wildcard pattern.
+
+        Arguments:
+            pattern {str} -- Wildcard matched against the file name.
+
+        Keyword Arguments:
+            recursive {bool} -- Include members within sub folders (default: {True})
+        """
+        return [name for name in self.members
+                if (recursive or '/' not in name)
+                and fnmatch.fnmatchcase(name.rsplit('/', 1)[-1], pattern)]
+
+    def classify(self):
+        """Returns the source type of the session from the index alone.
+
+        The Source within an archived config.json is used if present, else the
+        same order of checks as main.py is applied to the member names.
+
+        Returns:
+            str -- 'SWIS', 'LabView', 'Rover', 'Single SWIS' or None.
+        """
+
+        if 'config.json' in self.members:
+            with self.open_member('config.json') as f:
+                try:
+                    config = json.load(f)
+                except ValueError:
+                    config = {}
+            if config.get('Source') in SOURCE_MEMBERS:
+                return config['Source']
+
+        for source, (pattern, recursive) in SOURCE_MEMBERS.items():
+            if self.find(pattern, recursive):
+                logger.info("Archive identified as %s", source)
+                return source
+
+        logger.warning("No source type could be determined from archive")
+        return None
+
+    def open_member(self, name):
+        """Returns a binary file object reading the member in place"""
+
+        if self.blocks is not None:
+            return io.BufferedReader(_MemberReader(self, name), 1024*1024)
+
+        # Without a stream index rely on tarfile seeking the decompressor
+        if self._tar is None:
+            self._tar = tarfile.open(self.file, 'r:' + self.codec)
+        try:
+            return self._tar.extractfile(self._prefix + name)
+        except KeyError:
+            return self._tar.extractfile('./' + self._prefix + name)
+
+    def stage(self, session_dir, members):
+        """Writes the members matching any of the wildcards into session_dir.
+
+        The members are written to the same relative path as within the
+        archive and recorded so they can be removed by cleanup.
+
+        Arguments:
+            session_dir {Path} -- Folder that the products are produced within.
+            members {list} -- (wildcard, recursive) of the members to write.
+
+        Returns:
+            int -- Number of members written.
+        """
+
+        names = set()
+        for pattern, recursive in members:
+            names.update(self.find(pattern, recursive))
+
+        # Ignore products of previous processing
+        names = {name for name in names
+                 if not name.startswith(STAGE_IGNORE_DIRS)}
+        if not names:
+            return 0
+
+        total = sum(self.members[name][1] for name in names)
+        status.info("Reading %d of %d files, %.1f MB, from archive",
+                    len(names), len(self.members), total / 1e6)
+
+        wanted = sorted(names, key=lambda name: self.members[name][0])
+        if self.blocks is not None:
+            self._stage_blocks(session_dir, wanted)
+        else:
+            self._stage_stream(session_dir, set(wanted))
+
+        return len(wanted)
+
+    @contextlib.contextmanager
+    def staging(self, session_dir, members):
+        """Stages the members for the duration of a with block.
+
+        Only the members staged by the block are removed at its end, so at
+        most the inputs of one extractor are on disk at a time.
+
+        Arguments:
+            session_dir {Path} -- Folder that the products are produced within.
+            members {list} -- (wildcard, recursive) of the members to write.
+        """
+
+        first = len(self.staged)
+        try:
+            self.stage(session_dir, members)
+            yield
+        finally:
+            self.cleanup(first)
+
+    def adopt(self, paths):
+        """Records files moved from the staged members so cleanup removes them"""
+        self.staged.extend(paths)
+
+    def cleanup(self, first=0):
+        """Removes the staged members, leaving only the products
+
+        Keyword Arguments:
+            first {int} -- Only those staged after this many are removed (default: {0})
+        """
+
+        removed = self.staged[first:]
+        for path in removed:
+            if path.name != 'config.json':
+                pancam_fns.exist_unlink(path, logging.DEBUG)
+
+        # Remove any folders emptied, deepest first
+        for folder in sorted({path.parent for path in removed},
+                             key=lambda p: len(p.parts), reverse=True):
+            try:
+                folder.rmdir()
+            except OSError:
+                pass
+
+        if removed:
+            logger.info("Removed %d files staged from archive", len(removed))
+        self.staged = self.staged[:first]
+
+    def _stage_file(self, session_dir, name):
+        dest = session_dir / name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        self.staged.append(dest)
+        return dest
+
+    def _stage_done(self, dest, name):
+        mtime = self.members[name][2]
+        os.utime(dest, (mtime, mtime))
+
+    def _stage_blocks(self, session_dir, wanted):
+        # Only the streams spanned by the wanted members are decompressed
+        needed = sorted({idx for name in wanted
+                         for idx in self._block_range(name)})
+        blocks = self._iter_blocks(needed)
+        cur_idx, cur_data = -1, b''
+
+        for name in wanted:
+            offset, size, _ = self.members[name]
+            dest = self._stage_file(session_dir, name)
+            with open(dest, 'wb') as f:
+                for idx in self._block_range(name):
+                    while cur_idx < idx:
+                        cur_idx, cur_data = next(blocks)
+                    _, _, block_off, block_len = self.blocks[idx]
+                    start = max(offset - block_off, 0)
+                    end = min(offset + size - block_off, block_len)
+                    f.write(memoryview(cur_data)[start:end])
+            self._stage_done(dest, name)
+
+    def _stage_stream(self, session_dir, wanted):
+        with open_stream(self.file, self.workers) as stream, \
+                tarfile.open(fileobj=stream, mode='r|') as tar:
+            for info in tar:
+                name = self._member_name(info.name)
+                if not info.isreg() or name not in wanted:
+                    continue
+                dest = self._stage_file(session_dir, name)
+                with tar.extractfile(info) as src, open(dest, 'wb') as f:
+                    shutil.copyfileobj(src, f, 1024*1024)
+                self._stage_done(dest, name)
+
+    def _iter_blocks(self, indices):
+        """Generates (index, data) for the streams in order, decompressed in parallel"""
+        workers = self.workers or os.cpu_count() or 1
+        pending = deque()
+        indices = deque(indices)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while indices or pending:
+                while indices and len(pending) < 2 * workers:
+                    idx = indices.popleft()
+                    start, end = self.blocks[idx][:2]
+                    pending.append((idx, pool.submit(
+                        _decompress, self.file, self.codec, start, end)))
+                idx, future = pending.popleft()
+                data = future.result()
+                if data is None or len(data) != self.blocks[idx][3]:
+                    raise ArchiveError(
+                        "Archive changed since indexed: " + str(self.file))
+                yield idx, data
+
+    def _block_range(self, name):
+        """Returns the indices of the streams holding the member data"""
+        offset, size, _ = self.members[name]
+        first = bisect.bisect_right(self.block_starts, offset) - 1
+        last = bisect.bisect_right(
+            self.block_starts, offset + max(size, 1) - 1) - 1
+        return range(first, last + 1) if size else range(0)
+
+    def _member_name(self, name):
+        name = name[2:] if name.startswith('./') else name
+        if self._prefix and name.startswith(self._prefix):
+            name = name[len(self._prefix):]
+        return name
+
+    def _build_index(self):
+        infos = []
+        with open_stream(self.file, self.workers) as stream, \
+                tarfile.open(fileobj=stream, mode='r|') as tar:
+            for info in tar:
+                if info.isreg():
+                    infos.append(info)
+
+            raw = getattr(stream, 'raw', None)
+            self.blocks = getattr(raw, 'blocks', None)
+
+        # Archives of a session folder hold a single top level folder
+        self._prefix = ''
+        names = [self._member_name(info.name) for info in infos]
+        tops = {name.split('/', 1)[0] for name in names}
+        if len(tops) == 1 and all('/' in name for name in names):
+            self._prefix = tops.pop() + '/'
+
+        self.members = {
+            self._member_name(info.name):
+                (info.offset_data, info.size, int(info.mtime))
+            for info in infos}
+
+    def _load_sidecar(self, stat):
+        if not self.sidecar.exists():
+            return
+
+        try:
+            with open(self.sidecar, 'r') as f:
+                idx = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Unable to read index %s", self.sidecar.name)
+            return
+
+        if (idx.get('Index Version') != IndexVer) \
+                or (idx.get('Size') != stat.st_size) \
+                or (idx.get('MTime_ns') != stat.st_mtime_ns):
+            logger.info("Index out of date for %s", self.file.name)
+            return
+
+        self._prefix = idx['Prefix']
+        self.blocks = idx['Blocks']
+        self.members = {name: tuple(entry)
+                        for name, entry in idx['Members'].items()}
+
+    def _write_sidecar(self, stat):
+        idx = {'Index Version': IndexVer,
+               'Source': self.file.name,
+               'Size': stat.st_size,
+               'MTime_ns': stat.st_mtime_ns,
+               'Prefix': self._prefix,
+               'Blocks': self.blocks,
+               'Members': {name: list(entry)
+                           for name, entry in self.members.items()}}
+
+        try:
+            with open(self.sidecar, 'w') as f:
+                json.dump(idx, f)
+        except OSError:
+            logger.warning("Unable to write index %s", self.sidecar.name)
+
+
+class _MemberReader(io.RawIOBase):
+    """Seekable read only file object of a member, decompressing only the streams it spans"""
+
+    def __init__(self, arch, name):
+        super().__init__()
+        self.arch = arch
+        self.offset, self.size, _ = arch.members[name]
+        self._pos = 0
+        self._block = (-1, b'')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.size
+        self._pos = max(pos, 0)
+        return self._pos
+
+    def readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+
+        abs_pos = self.offset + self._pos
+        idx = bisect.bisect_right(self.arch.block_starts, abs_pos) - 1
+        if self._block[0] != idx:
+            start, end, _, _ = self.arch.blocks[idx]
+            data = _decompress(self.arch.file, self.arch.codec, start, end)
+            if data is None:
+                raise ArchiveError(
+                    "Archive changed since indexed: " + str(self.arch.file))
+            self._block = (idx, data)
+
+        _, _, block_off, block_len = self.arch.blocks[idx]
+        start = abs_pos - block_off
+        num = min(len(b), block_len - start, self.size - self._pos)
+        b[:num] = self._block[1][start:start + num]
+        self._pos += num
+        return num
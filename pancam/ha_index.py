@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Byte-offset packet index for Rover .ha files.
+
+A .ha file is a text dump of every packet received by the Rover, with a 4 line
+header for each packet followed by the packet contents as 32 byte hex lines.
+Only a handful of the packets are of interest to PanCam so rather than
+tokenising the whole file every time, this module memory maps the file once
+and records where each packet lives. The index is stored in a sidecar file
+within the processing folder and is reused while the .ha size and mtime are
+unchanged.
+
+:copyright: (c) 2020 by Barry J Whiteside. Mullard Space Science Laboratory - UCL
+
+:license: GPLv3, see LICENSE for more details.
+"""
+
+from collections import namedtuple
+from pathlib import Path
+import json
+import logging
+import mmap
+
+logger = logging.getLogger(__name__)
+
+# Global parameters
+IndexVer = 2
+INDEX_SUFFIX = '.idx'
+HA_HDR_LINES = 5
+PKT_HDR_LINES = 4
+HA_LINE_BYTES = 32
+
+# Single entry of the index
+#   PKT_ID     -- packet identifier e.g. AB.TM.MRSS0697
+#   Offset     -- byte offset of the first line of the packet header
+#   Length     -- packet length in bytes given by <LENGTH>
+#   Data_Start -- byte offset of the first hex data line
+#   Data_End   -- byte offset after the last hex data line
+#   Lines      -- number of hex data lines
+HaPacket = namedtuple(
+    'HaPacket', ['PKT_ID', 'Offset', 'Length', 'Data_Start', 'Data_End', 'Lines'])
+
+
+class HaReadError(Exception):
+    """error for unexpected things"""
+    pass
+
+
+class HaIndex(object):
+    """Memory mapped view of a .ha file and the packets it contains.
+
+    Arguments:
+        ha_file {Path} -- .ha file to be indexed.
+
+    Keyword Arguments:
+        use_sidecar {bool} -- Read and write the index sidecar file (default: {True})
+        index_dir {Path} -- Folder for the sidecar, None for next to the .ha (default: {None})
+
+    Usage:
+        with HaIndex(ha_file, index_dir=proc_dir) as idx:
+            for pkt in idx.select(LDT_IDs):
+                pkt_bin = idx.read(pkt)
+    """
+
+    def __init__(self, ha_file, use_sidecar=True, index_dir=None):
+        self.file = Path(ha_file)
+        index_dir = self.file.parent if index_dir is None else Path(index_dir)
+        self.sidecar = index_dir / (self.file.name + INDEX_SUFFIX)
+        self.use_sidecar = use_sidecar
+        self._fh = None
+        self._mm = None
+        self.packets = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """Maps the file and loads or builds the packet index"""
+
+        stat = self.file.stat()
+        if stat.st_size == 0:
+            raise HaReadError("Empty .ha file: " + self.file.name)
+
+        self._fh = open(self.file, 'rb')
+        try:
+            self._mm = mmap.mmap(
+                self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+            if self.use_sidecar:
+                self.packets = self._load_sidecar(stat)
+
+            if self.packets is None:
+                logger.info("Indexing %s", self.file.name)
+                self.packets = build_index(self._mm)
+                if self.use_sidecar:
+                    self._write_sidecar(stat)
+            else:
+                logger.info("Using existing index for %s", self.file.name)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def select(self, pkt_ids):
+        """Returns the index entries with a packet ID within pkt_ids"""
+        return [pkt for pkt in self.packets if pkt.PKT_ID in pkt_ids]
+
+    def read(self, pkt):
+        """Returns the binary contents of the packet given by the index entry"""
+        return decode_lines(self._mm[pkt.Data_Start:pkt.Data_End])
+
+    def header(self, pkt):
+        """Returns the 4 header lines of the packet as a list of strings"""
+        raw = self._mm[pkt.Offset:pkt.Data_Start].decode('ascii')
+        return raw.splitlines(keepends=True)
+
+    def _load_sidecar(self, stat):
+        if not self.sidecar.exists():
+            return None
+
+        try:
+            with open(self.sidecar, 'r') as f:
+                idx = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Unable to read index %s", self.sidecar.name)
+            return None
+
+        if (idx.get('Index Version') != IndexVer) \
+                or (idx.get('Source') != str(self.file)) \
+                or (idx.get('Size') != stat.st_size) \
+                or (idx.get('MTime_ns') != stat.st_mtime_ns):
+            logger.info("Index out of date for %s", self.file.name)
+            return None
+
+        return [HaPacket(*entry) for entry in idx['Packets']]
+
+    def _write_sidecar(self, stat):
+        idx = {'Index Version': IndexVer,
+               'Source': str(self.file),
+               'Size': stat.st_size,
+               'MTime_ns': stat.st_mtime_ns,
+               'Packets': [list(pkt) for pkt in self.packets]}
+
+        try:
+            with open(self.sidecar, 'w') as f:
+                json.dump(idx, f)
+        except OSError:
+            logger.warning("Unable to write index %s", self.sidecar.name)
+
+
+def decode_lines(data):
+    """Converts hex data lines into bytes, line endings are ignored"""
+    return bytes.fromhex(data.decode('ascii'))
+
+
+def build_index(mm):
+    """Scans a memory mapped .ha file and returns a list of HaPacket entries.
+
+    Only the packet headers are read, the data lines are stepped over using
+    the length given in the header. Should the data lines not be the expected
+    width the lines are instead stepped through individually.
+
+    Arguments:
+        mm {mmap} -- Memory map of the .ha file.
+
+    Returns:
+        list -- HaPacket for every packet within the data block.
+    """
+
+    packets = []
+
+    # Read ha header and perform basic check
+    pos = 0
+    for _ in range(HA_HDR_LINES):
+        line, pos = _next_line(mm, pos)
+    if line.rstrip(b'\r\n') != b'<BEGIN_DATA_BLOCK>':
+        raise HaReadError("<BEGIN_DATA_BLOCK>: Line not found")
+
+    # Determine line ending used so data lines can be stepped over
+    eol_len = len(line) - len(line.rstrip(b'\r\n'))
+
+    while True:
+        offset = pos
+        line, pos = _next_line(mm, pos)
+        if line.rstrip(b'\r\n') == b'<END_DATA_BLOCK>':
+            break
+
+        pkt_hd = [line]
+        for _ in range(PKT_HDR_LINES - 1):
+            line, pos = _next_line(mm, pos)
+            pkt_hd.append(line)
+
+        if pkt_hd[3][0:8] != b"<LENGTH>":
+            raise HaReadError("<LENGTH>: Line not found")
+
+        pkt_id = pkt_hd[2].rstrip(b'\r\n')[12:].decode('ascii')
+        pkt_len = int(pkt_hd[3].rstrip(b'\r\n')[8:])
+        pkt_lines = -(-pkt_len // HA_LINE_BYTES)
+
+        # Expected end of data assuming full width lines
+        data_start = pos
+        data_end = data_start + 2*pkt_len + pkt_lines*eol_len
+        first_end = data_start + 2*min(pkt_len, HA_LINE_BYTES) + eol_len
+        if (data_end > len(mm)) \
+                or (mm[data_end-1:data_end] != b'\n') \
+                or (mm.find(b'\n', data_start) != first_end - 1):
+            for _ in range(pkt_lines):
+                _, pos = _next_line(mm, pos)
+            data_end = pos
+
+        pos = data_end
+        packets.append(HaPacket(pkt_id, offset, pkt_len,
+                                data_start, data_end, pkt_lines))
+
+    return packets
+
+
+def _next_line(mm, pos):
+    """Returns the line starting at pos and the position of the next line"""
+    end = mm.find(b'\n', pos)
+    if end < 0:
+        raise HaReadError("Unexpected end of .ha file")
+    return mm[pos:end+1], end + 1
@@ -8,28 +8,43 @@ Created on Thu Nov 14 12:01:04 2019
 # Convert pci_raw to viewable 8-bit .png and create appropriate label
 
 from pathlib import Path
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import imageio
 import json
 import logging
-import bitstruct
+import logging.handlers
+import multiprocessing
+import os
+import time
 
 import pancam_fns
-from image_hdr_raw import decodeRAW_ImgHDR
+from pci_raw import PciRaw
 
 logger = logging.getLogger(__name__)
 status = logging.getLogger('status')
 
+# Global parameters
+browseProcVer = {'BrowseProcVer': '1.1.0'}
+
 
 class ImgRawBrError(Exception):
     """error for unexpected things"""
     pass
 
 
-def Img_RAW_Browse(PROC_DIR):
+def Img_RAW_Browse(PROC_DIR, workers=None, force=False):
+    """Creates a .png and .json browse product for each pci_raw image.
+
+    Images whose browse products are newer than the pci_raw and its JSON,
+    and were made by the same browse version, are skipped.
 
-    # Constants
-    BIN_RES = [1024, 512, 256, 128]
+    Arguments:
+        PROC_DIR {Path} -- Processing directory containing IMG_RAW.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+        force {bool} -- Recreate all browse products (default: {False})
+    """
 
     logger.info("Generating Image Browse Products from RAW Images")
 
@@ -39,91 +54,171 @@ def Img_RAW_Browse(PROC_DIR):
         logger.warning("No files found - ABORTING")
         return
 
-    # Create for loop here
-    for curFile in RAW_FILES:
-        logger.info("Reading %s", curFile.name)
-        with open(curFile, 'rb') as file:
-            img_rawheader = decodeRAW_ImgHDR(file.read(48))
-            BrowseProps = {'RAW_Source': curFile.name}
-            BrowseProps.update({'PNG Bit-Depth': "8"})
-
-            # Determine resolution
-            if img_rawheader['Cam'] != 3:
-                res = BIN_RES[img_rawheader['W_Bin']]
-                pad = img_rawheader['W_Pad_F']
-            else:
-                res = 1024
-                pad = True
-
-            if res != 1024:
-                status.info("Non default image size: %s", res)
-
-            if pad:
-                raw_data = np.fromfile(file, dtype='>u2')
-            else:
-                status.info("Non padded image")
-                read_data = []
-                data = file.read(5)
-                while len(data) == 5:
-                    updata = bitstruct.unpack('u10u10u10u10', data)
-                    read_data.extend([*updata])
-                    data = file.read(5)
-                raw_data = np.asarray(read_data)
-
-            ig = raw_data.reshape(res, res)
-            img = ig >> 2
-
-            # Determine image rotation for preview
-            if img_rawheader['Cam'] == 1:
-                Br_img = np.rot90(img, k=3)
-                BrowseProps.update({'Browse_Rotation': '-90'})
-            elif img_rawheader['Cam'] == 2:
-                Br_img = np.rot90(img, k=1)
-                BrowseProps.update({'Browse_Rotation': '+90'})
-            elif img_rawheader['Cam'] == 3:
-                Br_img = np.fliplr(img)
-                BrowseProps.update({'Browse_Transpose': "Left_Right"})
-            else:
-                Br_img = img
-                BrowseProps.update({'Browse_Transform': 'None'})
-                ImgRawBrError("Warning invalid CAM number")
-
-            # Create directory for Browse images
-            BRW_DIR = PROC_DIR / "IMG_Browse"
-            if not BRW_DIR.is_dir():
-                logger.info("Generating 'Processing' directory")
-                BRW_DIR.mkdir()
-
-            # Create 8-bit .png thumbnail
-            write_filename = curFile.stem
-            write_file = BRW_DIR / (write_filename + ".png")
-            pancam_fns.exist_unlink(write_file)
-
-            imageio.imwrite(write_file, Br_img)
-            logger.info("Creating .png: %s", write_file.stem)
-
-            # Read existing JSON file associated with RAW
-            RAWJsonFile = curFile.with_suffix(".JSON")
-            if not RAWJsonFile.exists():
-                ImgRawBrError("Warning RAW JSon does not exist", RAWJsonFile)
-            with open(RAWJsonFile, 'r') as read_file:
-                RAWJson = json.load(read_file)
-
-            # Append Browse Header information into dictionary for JSON file
-            RAWJson.update({"Image Header RAW": img_rawheader})
-            RAWJson['Processing Info'].update(
-                {"Browse Properties": BrowseProps})
-
-            write_file = BRW_DIR / (write_filename + ".json")
-
-            pancam_fns.exist_unlink(write_file)
-
-            with open(write_file, 'w') as f:
-                json.dump(RAWJson, f,  indent=4)
+    # Create directory for Browse images
+    BRW_DIR = PROC_DIR / "IMG_Browse"
+    if not BRW_DIR.is_dir():
+        logger.info("Generating 'Processing' directory")
+        BRW_DIR.mkdir()
+
+    jobs = [(browse_raw, curFile, BRW_DIR) for curFile in RAW_FILES
+            if force or not raw_browse_current(curFile, BRW_DIR)]
+
+    browse_pool(jobs, len(RAW_FILES), workers)
 
     logger.info("Generating Image Browse Products from RAW Images Completed")
 
 
+def raw_browse_current(curFile, BRW_DIR):
+    """Returns True if the browse products of curFile are up to date"""
+
+    sources = [curFile, curFile.with_suffix(".JSON")]
+    outputs = [BRW_DIR / (curFile.stem + ".png"),
+               BRW_DIR / (curFile.stem + ".json")]
+    if not is_newer(outputs, sources):
+        return False
+
+    try:
+        with open(outputs[1], 'r') as f:
+            props = json.load(f)['Processing Info']['Browse Properties']
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+    return all(props.get(key) == val for key, val in browseProcVer.items())
+
+
+def is_newer(outputs, sources):
+    """Returns True if every output exists and is newer than every source"""
+    try:
+        oldest = min(output.stat().st_mtime_ns for output in outputs)
+    except OSError:
+        return False
+    newest = max(source.stat().st_mtime_ns for source in sources
+                 if source.exists())
+    return oldest >= newest
+
+
+def browse_pool(jobs, total, workers=None):
+    """Runs the browse jobs in a process pool and reports the rate.
+
+    Arguments:
+        jobs {list} -- (function, file, *args) for each image to convert.
+        total {int} -- Number of images found, including those skipped.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+
+    Returns:
+        int -- Number of images converted.
+    """
+
+    skipped = total - len(jobs)
+    if skipped:
+        logger.info("%d browse images already up to date", skipped)
+    if not jobs:
+        status.info("All %d browse images up to date", total)
+        return 0
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+
+    start = time.monotonic()
+    converted = 0
+    if workers == 1:
+        for func, curFile, *args in jobs:
+            converted += _browse_job(func, curFile, *args)
+    else:
+        # Worker log records are passed back through a queue
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(
+            log_queue, pancam_fns.LogDispatch())
+        listener.start()
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=pancam_fns.worker_logging,
+                                     initargs=(log_queue,)) as pool:
+                futures = [pool.submit(_browse_job, func, curFile, *args)
+                           for func, curFile, *args in jobs]
+                for future in futures:
+                    converted += future.result()
+        finally:
+            listener.stop()
+
+    elapsed = time.monotonic() - start
+    status.info("%d browse images converted in %.1f s, %.1f images/s, %d up to date",
+                converted, elapsed, converted / max(elapsed, 1e-6), skipped)
+    return converted
+
+
+def _browse_job(func, curFile, *args):
+    # Failures are logged so one bad image does not stop the others
+    try:
+        func(curFile, *args)
+    except Exception:
+        logger.exception("Unable to create browse for %s", curFile.name)
+        return 0
+    return 1
+
+
+def browse_raw(curFile, BRW_DIR):
+    """Creates the 8-bit .png and .json browse products of a pci_raw image.
+
+    Arguments:
+        curFile {Path} -- pci_raw image.
+        BRW_DIR {Path} -- IMG_Browse directory to write to.
+
+    Returns:
+        str -- Name of the image converted.
+    """
+
+    logger.info("Reading %s", curFile.name)
+    with PciRaw(curFile) as raw:
+        img_rawheader = raw.header
+        BrowseProps = {'RAW_Source': curFile.name}
+        BrowseProps.update({'PNG Bit-Depth': "8"})
+        BrowseProps.update(browseProcVer)
+
+        res = raw.res
+        if res != 1024:
+            status.info("Non default image size: %s", res)
+
+        if not raw.padded:
+            status.info("Non padded image")
+
+        # Determine image rotation for preview
+        Br_img, transform = raw.oriented(raw.pixels >> 2)
+        BrowseProps.update(transform)
+
+        # Create 8-bit .png thumbnail
+        write_filename = curFile.stem
+        write_file = BRW_DIR / (write_filename + ".png")
+        pancam_fns.exist_unlink(write_file)
+
+        imageio.imwrite(write_file, Br_img)
+        logger.info("Creating .png: %s", write_file.stem)
+
+        # Read existing JSON file associated with RAW
+        RAWJsonFile = curFile.with_suffix(".JSON")
+        if not RAWJsonFile.exists():
+            ImgRawBrError("Warning RAW JSon does not exist", RAWJsonFile)
+        with open(RAWJsonFile, 'r') as read_file:
+            RAWJson = json.load(read_file)
+
+        # Append Browse Header information into dictionary for JSON file
+        RAWJson.update({"Image Header RAW": img_rawheader})
+        RAWJson['Processing Info'].update(
+            {"Browse Properties": BrowseProps})
+
+        write_file = BRW_DIR / (write_filename + ".json")
+
+        pancam_fns.exist_unlink(write_file)
+
+        with open(write_file, 'w') as f:
+            json.dump(RAWJson, f,  indent=4)
+
+    return curFile.name
+
+
 if __name__ == "__main__":
     proc_dir = Path(
         input("Type the path to the folder where the PROC folder is located: "))
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Catalogue of the image headers of every .pci_raw below a folder.
+
+Finding images by task, camera, filter or temperature would otherwise mean
+decoding the header of every .pci_raw or reading every browse .json. update()
+reads only the 48 byte header of each image, never the pixels, and stores the
+decoded values in an SQLite database at the top of the folder. Images already
+catalogued are skipped while their size and mtime are unchanged, and entries
+for deleted images are removed.
+
+Usage:
+    img_catalogue.update(top_dir)
+    hrc = img_catalogue.query(top_dir, Cam=3, Task_ID=42)
+    hot = img_catalogue.query(top_dir, where="Cam = 1 AND FW = 7 AND Temp > ?",
+                              params=(2000,))
+
+or from the command line:
+    python img_catalogue.py update TOP_DIR
+    python img_catalogue.py query TOP_DIR --cam 3 --task 42
+
+:copyright: (c) 2020 by Barry J Whiteside. Mullard Space Science Laboratory - UCL
+
+:license: GPLv3, see LICENSE for more details.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+import pancam_fns
+import pci_raw
+
+logger = logging.getLogger(__name__)
+status = logging.getLogger('status')
+
+# Global parameters
+CatalogueVer = 1
+CATALOGUE_FILE = 'IMG_Catalogue.sqlite'
+PARALLEL_MIN = 500
+
+# Catalogue columns and the header entries they are taken from, WAC then HRC
+COLUMNS = {
+    'SOL': ['SOL'],
+    'Task_ID': ['Task_ID'],
+    'Task_RNO': ['Task_RNO'],
+    'Cam': ['Cam'],
+    'FW': ['FW'],
+    'Img_No': ['Img_No'],
+    'Image_ID': ['Image_ID'],
+    'Pkt_CUC': ['Pkt_CUC'],
+    'PIU_Time': ['PIU_Time'],
+    'Bin': ['W_Bin'],
+    'Pad': ['W_Pad_F'],
+    'Int_Time': ['W_Int_Time', 'H_Int_Time'],
+    'Temp': ['W_End_Temp', 'H_Temp'],
+    'Gain': ['W_Gain', 'H_Gain'],
+    'Img_CRC': ['W_IMG_CRC'],
+    'Pkt_CRC': ['W_PKT_CRC'],
+}
+TEXT_COLUMNS = {'Image_ID', 'Pkt_CUC', 'PIU_Time'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    Path TEXT PRIMARY KEY,
+    Session TEXT,
+    Size INTEGER,
+    MTime_ns INTEGER,
+    {columns},
+    Header TEXT,
+    Error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_task ON images (Task_ID, Task_RNO);
+CREATE INDEX IF NOT EXISTS idx_cam ON images (Cam, FW);
+CREATE INDEX IF NOT EXISTS idx_sol ON images (SOL);
+CREATE INDEX IF NOT EXISTS idx_session ON images (Session);
+CREATE TABLE IF NOT EXISTS info (Key TEXT PRIMARY KEY, Value TEXT);
+""".format(columns=',\n    '.join(
+    name + (' TEXT' if name in TEXT_COLUMNS else ' INTEGER') for name in COLUMNS))
+
+
+class CatalogueError(Exception):
+    """error for unexpected things"""
+    pass
+
+
+def catalogue_file(top_dir):
+    """Returns the path of the catalogue database within top_dir"""
+    return Path(top_dir) / CATALOGUE_FILE
+
+
+def connect(db_file):
+    """Returns a connection to the catalogue, creating the tables if needed"""
+
+    con = sqlite3.connect(str(db_file))
+    con.executescript(SCHEMA)
+
+    ver = con.execute(
+        "SELECT Value FROM info WHERE Key = 'Catalogue Version'").fetchone()
+    if ver is None:
+        con.execute("INSERT INTO info VALUES ('Catalogue Version', ?)",
+                    (str(CatalogueVer),))
+    elif int(ver[0]) != CatalogueVer:
+        con.close()
+        raise CatalogueError(
+            f"Catalogue version {ver[0]} not {CatalogueVer}, delete {db_file} to rebuild")
+
+    con.commit()
+    return con
+
+
+def update(top_dir, db_file=None, workers=None):
+    """Adds new and changed .pci_raw headers to the catalogue and removes deleted ones.
+
+    Arguments:
+        top_dir {Path} -- Folder searched for .pci_raw files, usually holding many sessions.
+
+    Keyword Arguments:
+        db_file {Path} -- Catalogue database, None for IMG_Catalogue.sqlite in top_dir (default: {None})
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+
+    Returns:
+        dict -- Number of images Added, Updated, Removed and Unchanged.
+    """
+
+    top_dir = Path(top_dir)
+    if db_file is None:
+        db_file = catalogue_file(top_dir)
+
+    logger.info("Updating image catalogue %s", db_file)
+    start = time.monotonic()
+
+    # Stat every image, no file contents are read
+    found = {}
+    for root, _, files in os.walk(top_dir):
+        for name in files:
+            if name.endswith('.pci_raw'):
+                path = Path(root) / name
+                stat = path.stat()
+                found[path.relative_to(top_dir).as_posix()] = \
+                    (stat.st_size, stat.st_mtime_ns)
+
+    con = connect(db_file)
+    try:
+        known = {row[0]: (row[1], row[2]) for row in
+                 con.execute("SELECT Path, Size, MTime_ns FROM images")}
+
+        new = [path for path in found if path not in known]
+        changed = [path for path in found
+                   if path in known and known[path] != found[path]]
+        removed = [path for path in known if path not in found]
+
+        todo = new + changed
+        rows = [catalogue_row(top_dir, path, *found[path])
+                for path in todo] if len(todo) < PARALLEL_MIN \
+            else _parallel_rows(top_dir, todo, found, workers)
+
+        with con:
+            con.executemany("DELETE FROM images WHERE Path = ?",
+                            [(path,) for path in removed])
+            con.executemany(
+                "INSERT OR REPLACE INTO images VALUES ({})".format(
+                    ','.join('?' * (len(COLUMNS) + 6))), rows)
+
+    finally:
+        con.close()
+
+    counts = {'Added': len(new), 'Updated': len(changed),
+              'Removed': len(removed),
+              'Unchanged': len(found) - len(todo)}
+    errors = sum(1 for row in rows if row[-1])
+    if errors:
+        logger.warning("%d image headers could not be decoded", errors)
+
+    status.info("Image catalogue: %d added, %d updated, %d removed, %d unchanged in %.1f s",
+                counts['Added'], counts['Updated'], counts['Removed'],
+                counts['Unchanged'], time.monotonic() - start)
+    return counts
+
+
+def catalogue_row(top_dir, path, size, mtime_ns):
+    """Returns the catalogue row of an image, reading only the header.
+
+    Arguments:
+        top_dir {Path} -- Folder the catalogue paths are relative to.
+        path {str} -- Relative path of the .pci_raw file.
+        size {int} -- File size in bytes.
+        mtime_ns {int} -- File modification time in ns.
+
+    Returns:
+        tuple -- Values in the order of the images table.
+    """
+
+    try:
+        header = pci_raw.read_header(Path(top_dir) / path)
+        error = None
+    except Exception as err:
+        header = {}
+        error = f"{type(err).__name__}: {err}"
+
+    values = []
+    for keys in COLUMNS.values():
+        values.append(next((header[key] for key in keys if key in header), None))
+
+    return (path, session_of(path), size, mtime_ns, *values,
+            json.dumps(header) if header else None, error)
+
+
+def session_of(path):
+    """Returns the session folder of a relative image path, the folder holding PROC"""
+    parts = Path(path).parts
+    if 'PROC' in parts:
+        return Path(*parts[:parts.index('PROC')]).as_posix()
+    return Path(path).parent.as_posix()
+
+
+def _parallel_rows(top_dir, todo, found, workers):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunksize = max(1, len(todo) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(
+            catalogue_row, [top_dir] * len(todo), todo,
+            [found[path][0] for path in todo],
+            [found[path][1] for path in todo], chunksize=chunksize))
+
+
+def query(top_dir=None, db_file=None, where=None, params=(), **equals):
+    """Returns the catalogue entries matching the conditions as a DataFrame.
+
+    Keyword Arguments:
+        top_dir {Path} -- Folder containing the catalogue (default: {None})
+        db_file {Path} -- Catalogue database, used instead of top_dir (default: {None})
+        where {str} -- Extra SQL condition, e.g. "Temp > ?" (default: {None})
+        params {tuple} -- Values for the ? within where (default: {()})
+        **equals -- Column values to match, e.g. Cam=3, Task_ID=42.
+
+    Returns:
+        pd.DataFrame -- Matching entries with a Path column relative to top_dir.
+    """
+
+    if db_file is None:
+        if top_dir is None:
+            raise CatalogueError("top_dir or db_file required")
+        db_file = catalogue_file(top_dir)
+    if not Path(db_file).exists():
+        raise CatalogueError(f"No catalogue found at {db_file}, run update first")
+
+    allowed = {'Path', 'Session', 'Size', 'MTime_ns', 'Error', *COLUMNS}
+    conds = []
+    values = []
+    for col, val in equals.items():
+        if col not in allowed:
+            raise CatalogueError(f"Unknown catalogue column: {col}")
+        conds.append(f"{col} = ?")
+        values.append(val)
+    if where:
+        conds.append(f"({where})")
+        values.extend(params)
+
+    sql = "SELECT * FROM images"
+    if conds:
+        sql += " WHERE " + " AND ".join(conds)
+    sql += " ORDER BY Session, SOL, Task_ID, Task_RNO, Img_No"
+
+    con = connect(db_file)
+    try:
+        return pd.read_sql_query(sql, con, params=values)
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Catalogue of the .pci_raw image headers below a folder")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    upd = sub.add_parser('update', help="Add new and changed images")
+    upd.add_argument('top_dir', type=Path)
+    upd.add_argument('--workers', type=int, default=None)
+
+    qry = sub.add_parser('query', help="List matching images")
+    qry.add_argument('top_dir', type=Path)
+    qry.add_argument('--cam', type=int, help="1 WACL, 2 WACR, 3 HRC")
+    qry.add_argument('--fw', type=int, help="Filter wheel position")
+    qry.add_argument('--sol', type=int)
+    qry.add_argument('--task', type=int, help="Task ID")
+    qry.add_argument('--session')
+    qry.add_argument('--where', help="Extra SQL condition e.g. 'Temp > 2000'")
+    qry.add_argument('--columns', default='Path,Cam,FW,SOL,Task_ID,Task_RNO,Img_No,Int_Time,Temp',
+                     help="Comma separated columns to print")
+    qry.add_argument('--csv', type=Path, help="Write all columns to a .csv")
+
+    args = parser.parse_args()
+
+    logger, status = pancam_fns.setup_logging()
+
+    if args.command == 'update':
+        update(args.top_dir, workers=args.workers)
+
+    else:
+        equals = {col: val for col, val in
+                  [('Cam', args.cam), ('FW', args.fw), ('SOL', args.sol),
+                   ('Task_ID', args.task), ('Session', args.session)]
+                  if val is not None}
+        found = query(args.top_dir, where=args.where, **equals)
+
+        if args.csv:
+            found.to_csv(args.csv, index=False)
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(found[args.columns.split(',')].to_string(index=False))
+        print(f"{len(found)} images")
@@ -11,15 +11,19 @@ Created 24 Feb 2020
 """
 
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import pandas as pd
-import filecmp
-from shutil import copyfile
+import hashlib
+import os
 import json
 import shutil
 import numpy as np
 
 import pancam_fns
+import pci_raw
+import archive as session_archive
 import hs
 
 logger = logging.getLogger(__name__)
@@ -27,14 +31,20 @@ status = logging.getLogger('status')
 
 # Global parameters
 labviewProcVer = {'LVProcVer': '1.1.0'}
+IMG_BYTES = pci_raw.IMG_BYTES
+SCI_PREFETCH = 32
 
 
-def hk_extract(lv_dir, archive=False):
+def hk_extract(lv_dir, archive=False, cache=None):
     """Generates a Unproc_HKTM.pickle from the found HK txt files
 
     Arguments:
         lv_dir {Path} -- Dir containing .txt files with LabView generated files.
 
+    Keyword Arguments:
+        archive {bool} -- If True moves RMAP_HK*.txt to archive folder (default: {False})
+        cache {dict} -- Files already read, only new or changed files are read (default: {None})
+
     Returns:
         Boolean -- Returns true if files found and function completed.
 
@@ -65,21 +75,26 @@ def hk_extract(lv_dir, archive=False):
 
     # Read text file for HK
     hk_head = ['Time', 'RAW']
-    hk_df = pd.DataFrame()
+    hk_list = []
 
     for curfile in files_hk:
         logger.info("Reading %s", curfile.name)
-        file_df = pd.read_csv(curfile, sep=r' \t ', header=None,
-                              names=hk_head, engine='python')
+        file_df = pancam_fns.cached_read(
+            curfile, lambda f: pancam_fns.read_split_log(f, ' \t ', names=hk_head),
+            cache)
 
         if not file_df.empty:
-            file_df['RAW'] = file_df['RAW'].apply(
-                lambda x: x.replace('\t', ' '))
-            hk_df = hk_df.append(file_df, ignore_index=True)
+            hk_list.append(file_df)
 
         if archive:
             curfile.rename(arc_dir / curfile.name)
 
+    if hk_list:
+        hk_df = pd.concat(hk_list, ignore_index=True)
+        hk_df['RAW'] = hk_df['RAW'].str.replace('\t', ' ', regex=False)
+    else:
+        hk_df = pd.DataFrame(columns=hk_head)
+
     hk_df['Source'] = 'LabView'
     hk_df.to_pickle(proc_dir / "Unproc_HKTM.pickle")
     logger.info("PanCam Unproc HK pickled.")
@@ -88,12 +103,16 @@ def hk_extract(lv_dir, archive=False):
     return True
 
 
-def hs_extract(lv_dir, archive=False):
+def hs_extract(lv_dir, archive=False, cache=None):
     """Extracts the H&S from the .txt logs into a single pickel for furhter processing
 
     Arguments:
         lv_dir {Path} -- Dir containing .txt files with LabView generated files.
 
+    Keyword Arguments:
+        archive {bool} -- If True moves RMAP_H&S*.txt to archive folder (default: {False})
+        cache {dict} -- Files already read, only new or changed files are read (default: {None})
+
     Generates:
         hs_raw.pickle -- Pickle file in ['Time', 'RAW'] format for hs module.
 
@@ -121,20 +140,26 @@ def hs_extract(lv_dir, archive=False):
 
     # Read text file for H&S
     hs_head = ['Time', 'RAW']
-    hs_df = pd.DataFrame()
+    hs_list = []
 
     for curfile in files_hs:
         logger.info("Reading %s", curfile.name)
-        file_df = pd.read_csv(curfile, sep=r' \t ',
-                              header=None, names=hs_head, engine='python')
+        file_df = pancam_fns.cached_read(
+            curfile, lambda f: pancam_fns.read_split_log(f, ' \t ', names=hs_head),
+            cache)
+
         if not file_df.empty:
-            file_df['RAW'] = file_df['RAW'].apply(
-                lambda x: x.replace('\t', ' '))
-            hs_df = hs_df.append(file_df, ignore_index=True)
+            hs_list.append(file_df)
 
         if archive:
             curfile.rename(arc_dir / curfile.name)
 
+    if hs_list:
+        hs_df = pd.concat(hs_list, ignore_index=True)
+        hs_df['RAW'] = hs_df['RAW'].str.replace('\t', ' ', regex=False)
+    else:
+        hs_df = pd.DataFrame(columns=hs_head)
+
     hs_df.to_pickle(proc_dir / "hs_raw.pickle")
     logger.info("PanCam H+S pickled.")
     logger.info("--HS Extract Completed")
@@ -163,14 +188,18 @@ def sci_extract(lv_dir, archive=False):
     if not files_sci:
         return
 
+    # Sizes read once for the empty and repeat chunk checks
+    sizes = np.array([curfile.stat().st_size for curfile in files_sci])
+
     # Check for first file being empty due to labview bug
-    if files_sci[0].stat().st_size == 0:
+    if sizes[0] == 0:
         logger.info("First RMAP_Sci packet empty - deleting.")
         files_sci[0].unlink()
         del files_sci[0]
+        sizes = sizes[1:]
 
     # Check matches expectation from H&S
-    num_pkts = sum(1 for item in files_sci)
+    num_pkts = len(files_sci)
     num_expt = hs.sci_cnt(lv_dir / "PROC") * 7
     if num_pkts != num_expt:
         logger.error("Missing Sci Parts Detected!")
@@ -178,21 +207,22 @@ def sci_extract(lv_dir, archive=False):
         logger.error("Got: %d packets", num_pkts)
         logger.info("Looking for sequential short chunks")
         # Search for all files with a size 762030
-        small_chunks = [files_sci.index(
-            chunk) for chunk in files_sci if chunk.stat().st_size == 762030]
+        small_chunks = np.flatnonzero(sizes == 762030)
         # Search for any sequential small chunks
-        repeat_chunks = [small_chunks[i+1]
-                         for i, x in enumerate(np.diff(small_chunks) == 1) if x]
-        if repeat_chunks:
+        repeat_chunks = small_chunks[1:][np.diff(small_chunks) == 1]
+        if repeat_chunks.size:
             logger.error("Repeat chunks found. Renaming and excluding them")
-            wrong_files = [files_sci[i] for i in repeat_chunks]
-            for wrong_item in wrong_files:
+            for i in repeat_chunks:
                 if archive:
+                    wrong_item = files_sci[i]
                     logger.info("Renaming to .ignore %s", wrong_item.name)
                     wrong_item.rename(wrong_item.with_suffix('.txt.ignore'))
-                files_sci.remove(wrong_item)
 
-            num_pkts = sum(1 for item in files_sci)
+            keep = np.ones(num_pkts, dtype=bool)
+            keep[repeat_chunks] = False
+            files_sci = [curfile for curfile, k in zip(files_sci, keep) if k]
+
+            num_pkts = len(files_sci)
             if num_pkts != num_expt:
                 logger.critical(
                     "Still unexpected number of packets. Now %d", num_pkts)
@@ -217,33 +247,30 @@ def sci_extract(lv_dir, archive=False):
     write_file = img_spw_dir / "001.pci_spw"
     logger.info("Creating spw binary file %s", write_file.name)
     wf = open(write_file, 'w+b')
+    written = 0
 
-    sci_head = ['Time', 'RAW']
-    for curfile in files_sci:
+    for curfile, raw, num_lines in sci_packets(files_sci):
 
-        dl = pd.read_csv(curfile, sep=r' \t ', header=None,
-                         names=sci_head, engine='python')
-        if dl.shape[0] == 0:
+        if num_lines == 0:
             # Move .txt file to archive
             if archive:
                 curfile.rename(arc_dir / curfile.name)
             logger.info("File empty %s", curfile.name)
             continue
-        elif dl.shape[0] > 1:
+        elif num_lines > 1:
             logger.error("More than one line found in file, using first line")
 
-        dl['RAW'] = dl['RAW'].apply(lambda x: x.replace('\t', ' '))
-        raw = dl['RAW'].apply(lambda x: bytearray.fromhex(x))
-
         # Assume images are all 2097200 bytes and so break on that.
-        if write_file.stat().st_size >= 2097200:
+        if written >= IMG_BYTES:
             wf.close()
             cur_ldt = curfile.stem.split('_')[-1]
             write_file = img_spw_dir / (cur_ldt + ".pci_spw")
             logger.info("Creating spw binary file %s", write_file.name)
             wf = open(write_file, 'w+b')
+            written = 0
 
-        wf.write(raw[0])
+        wf.write(raw)
+        written += raw.size
 
         if archive:
             # Move .txt file to archive
@@ -253,6 +280,78 @@ def sci_extract(lv_dir, archive=False):
     logger.info("--Extracting Science Images from SpW logs completed.")
 
 
+def sci_packets(files_sci, prefetch=SCI_PREFETCH):
+    """Reads the RMAP_Sci*.txt files ahead with a thread pool and yields them in order.
+
+    Up to prefetch files are read and decoded at once, each into one of a
+    ring of prefetch buffers. A buffer is only reused once the packet within
+    it has been yielded, so the packet must be used before the next is taken.
+
+    Arguments:
+        files_sci {list} -- RMAP_Sci*.txt files in order.
+
+    Keyword Arguments:
+        prefetch {int} -- Number of files read ahead (default: {SCI_PREFETCH})
+
+    Generates:
+        tuple -- The file, np.array view of the packet and number of lines.
+    """
+
+    bufs = [np.empty(0, dtype=np.uint8) for _ in range(prefetch)]
+    pending = deque()
+
+    with ThreadPoolExecutor() as pool:
+        for num, curfile in enumerate(files_sci):
+            slot = num % prefetch
+            pending.append((curfile, slot, pool.submit(
+                read_sci_packet, curfile, bufs[slot])))
+
+            if len(pending) == prefetch:
+                yield _sci_next(pending, bufs)
+
+        while pending:
+            yield _sci_next(pending, bufs)
+
+
+def _sci_next(pending, bufs):
+    """Waits for the oldest read and keeps its buffer for reuse"""
+    curfile, slot, future = pending.popleft()
+    raw, num_lines = future.result()
+    if raw.base is not None:
+        bufs[slot] = raw.base
+    return curfile, raw, num_lines
+
+
+def read_sci_packet(sci_file, buf=None):
+    """Reads the packet from a RMAP_Sci*.txt file.
+
+    The file is scanned as bytes for the first line, which is split once on
+    the separator between the time and hex payload.
+
+    Arguments:
+        sci_file {Path} -- RMAP_Sci*.txt file.
+
+    Keyword Arguments:
+        buf {np.array} -- uint8 buffer to decode into (default: {None})
+
+    Returns:
+        raw {np.array} -- The packet contents of the first line.
+        num_lines {int} -- The number of lines found in the file.
+    """
+
+    if buf is None:
+        buf = np.empty(0, dtype=np.uint8)
+
+    with open(sci_file, 'rb') as f:
+        lines = [line for line in f.read().split(b'\n') if line.strip()]
+
+    if not lines:
+        return buf[:0], 0
+
+    payload = lines[0].partition(b' \t ')[2]
+    return pancam_fns.hex_decode(payload, buf), len(lines)
+
+
 def bin_move(lv_dir, archive=False, comp_spw=True):
 
     if comp_spw:
@@ -285,111 +384,129 @@ def bin_move(lv_dir, archive=False, comp_spw=True):
             logger.info("Reading file: %s", curfile.name)
             pci_raw_file = img_dir / (curfile.stem + ".pci_raw")
 
-            pancam_fns.exist_unlink(pci_raw_file)
-            copyfile(curfile, pci_raw_file)
-            create_json(pci_raw_file)
+            if pancam_fns.copy_if_changed(curfile, pci_raw_file):
+                create_json(pci_raw_file)
 
         logger.info("--Moving saved science images completed.")
         return
 
     # Else if comparing against SpW continue
+    bin_lens = {curfile: curfile.stat().st_size for curfile in bin_files}
+    part_lens = {size for size in bin_lens.values() if size < IMG_BYTES}
+
+    # Index SpW images by digest, and the digest of each partial bin length
+    logger.info("Indexing %d SpW images", len(spw_files))
+    spw_full = {}
+    spw_part = {}
+    for ref in spw_files:
+        full, parts = prefix_digests(ref, part_lens)
+        spw_full.setdefault(full, []).append(ref)
+        for length, digest in parts.items():
+            spw_part.setdefault((length, digest), []).append(ref)
+
+    matched = set()
     for curfile in bin_files:
-        curfile_matched = False
         curfile_partial = False
-        curfile_bloated = False
-        curfile_len = curfile.stat().st_size
+        curfile_len = bin_lens[curfile]
 
         logger.info("Reading file: %s", curfile.name)
 
-        # If a partial file create a temporary file for comparing
-        tmp_file = lv_dir / "PROC" / "tmp_cmp.bin"
-        if curfile_len < 2097200:
+        if curfile_len < IMG_BYTES:
             logger.info("Incomplete image binary detected")
             curfile_partial = True
+            key = (curfile_len, pancam_fns.file_digest(curfile))
+            candidates = spw_part.get(key, [])
 
-        if curfile_len > 2097200:
+        elif curfile_len > IMG_BYTES:
             logger.info("Binary image with too much data detected")
-            curfile_bloated = True
-            # Write curfile expected image size to tmp file
-            with open(curfile, 'rb') as bin_f:
-                logger.info("Creating tmp file of bin with actual image size")
-                tmp = open(tmp_file, 'wb')
-                tmp.write(bin_f.read(2097200))
+            _, parts = prefix_digests(curfile, [IMG_BYTES])
+            candidates = spw_full.get(parts[IMG_BYTES], [])
 
-        # Search through SpW files and check there is a match
-        for ref in spw_files:
+        else:
+            candidates = spw_full.get(pancam_fns.file_digest(curfile), [])
 
-            if curfile_partial:
-                # Write same equivalent bytes tmp file
-                with open(ref, 'rb') as spw_f:
-                    logger.info("Partial comparing with %s", ref.name)
-                    tmp = open(tmp_file, 'wb')
-                    tmp.write(spw_f.read(curfile_len))
-
-                if filecmp.cmp(curfile, tmp_file, shallow=False):
-                    curfile_matched = True
-                    logger.info("Beginning of file matches %s", ref.name)
-
-                    # Use spw generated binary as image
-                    logger.info("Using generated image from SpW.txt files")
-                    spw_files.remove(ref)
-                    pci_raw_file = img_dir / \
-                        (curfile.stem + "_repaired" + ref.stem + ".pci_raw")
-
-                    # Copy to pci_raw folder and create json
-                    copyfile(ref, pci_raw_file)
-                    create_repairedjson(pci_raw_file)
-                    ref.unlink()
-
-            elif curfile_bloated:
-                if filecmp.cmp(tmp_file, ref, shallow=False):
-                    curfile_matched = True
-                    logger.info(
-                        "Trimmed bin image matches that of SpW.txt files")
-                    spw_files.remove(ref)
-                    pci_raw_file = img_dir / \
-                        (curfile.stem + "_repaired" + ref.stem + ".pci_raw")
-
-                    # Copy to pci_raw folder and create json
-                    copyfile(ref, pci_raw_file)
-                    create_repairedjson(pci_raw_file)
-                    ref.unlink
-
-            # If file is complete then a standard compare
-            elif filecmp.cmp(curfile, ref, shallow=False):
-                curfile_matched = True
-                logger.info("File matches, deleting file: %s", ref.name)
-
-                # Delete spw generated binary
-                spw_files.remove(ref)
-                ref.unlink()
-
-                # Copy image to pci_raw folder and create json
-                pci_raw_file = img_dir / (curfile.stem + ".pci_raw")
-                copyfile(curfile, pci_raw_file)
+        # First SpW image with the same contents not already used
+        ref = next((ref for ref in candidates if ref not in matched), None)
+        if ref is None:
+            logger.error("File has no corresponding match!!!")
+            continue
+        matched.add(ref)
+
+        if curfile_len == IMG_BYTES:
+            logger.info("File matches, deleting file: %s", ref.name)
+
+            # Copy image to pci_raw folder and create json
+            pci_raw_file = img_dir / (curfile.stem + ".pci_raw")
+            if pancam_fns.copy_if_changed(curfile, pci_raw_file):
                 create_json(pci_raw_file)
 
-            if curfile_matched:
-                if archive:
-                    # Move file to archive folder
-                    curfile.rename(arc_dir / curfile.name)
-                    # If not a partial file can delete png preview
-                    pngfile = curfile.with_suffix(".png")
-                    if (not curfile_partial):
-                        pancam_fns.exist_unlink(pngfile)
+        else:
+            if curfile_partial:
+                logger.info("Beginning of file matches %s", ref.name)
+            else:
+                logger.info("Trimmed bin image matches that of SpW.txt files")
 
-                break
+            # Use spw generated binary as image
+            logger.info("Using generated image from SpW.txt files")
+            pci_raw_file = img_dir / \
+                (curfile.stem + "_repaired" + ref.stem + ".pci_raw")
 
-        if not curfile_matched:
-            logger.error("File has no corresponding match!!!")
+            # Copy to pci_raw folder and create json
+            if pancam_fns.copy_if_changed(ref, pci_raw_file):
+                create_repairedjson(pci_raw_file)
 
-    # if tmp_file.exists():
-        # tmp_file.unlink()
+        # Delete spw generated binary
+        ref.unlink()
+
+        if archive:
+            # Move file to archive folder
+            curfile.rename(arc_dir / curfile.name)
+            # If not a partial file can delete png preview
+            pngfile = curfile.with_suffix(".png")
+            if (not curfile_partial):
+                pancam_fns.exist_unlink(pngfile)
+
+    for ref in spw_files:
+        if ref not in matched:
+            logger.info("No bin file matches SpW image %s", ref.name)
 
     logger.info("--Moving saved science images completed.")
 
 
-def psu_extract(lv_dir, archive=False):
+def prefix_digests(path, lengths):
+    """Returns the digest of a file along with that of the first bytes of it.
+
+    The file is read once with the digest of each prefix taken on the way.
+
+    Arguments:
+        path {Path} -- File to hash.
+        lengths {iterable} -- Prefix lengths in bytes, any longer than the file are ignored.
+
+    Returns:
+        full {str} -- hex digest of the whole file.
+        parts {dict} -- hex digest of each prefix keyed by length.
+    """
+
+    digest = hashlib.sha256()
+    parts = {}
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        lengths = sorted(length for length in lengths if length <= size)
+
+        pos = 0
+        for length in lengths:
+            digest.update(f.read(length - pos))
+            parts[length] = digest.hexdigest()
+            pos = length
+
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest(), parts
+
+
+def psu_extract(lv_dir, archive=False, cache=None):
 
     logger.info("Extracting PSU measurements.")
 
@@ -430,27 +547,12 @@ def psu_extract(lv_dir, archive=False):
 
     for curfile in files_psu:
         logger.info("Reading %s", curfile.name)
-        file_df = pd.read_csv(curfile,
-                              sep='\t',
-                              names=hdr,
-                              dtype=hdr_types,
-                              usecols=skip,
-                              skiprows=1)
+        file_df = pancam_fns.cached_read(
+            curfile, lambda f: psu_read(f, hdr, hdr_types, skip), cache)
 
         if file_df.empty:
             continue
 
-        file_df['DT'] = pd.to_datetime(file_df['Date Time'],
-                                       format='%d/%m/%Y %H:%M:%S.%f')
-        file_df['Power'] = file_df['Voltage'] * file_df['Current']
-
-        # If no heater just set all to zero
-        if file_df.shape[1] == 5:
-            file_df['Htr. Voltage'] = 0
-            file_df['Htr. Current'] = 0
-
-        file_df['Htr. Power'] = file_df['Htr. Voltage'] * \
-            file_df['Htr. Current']
         psu_df = psu_df.append(file_df, ignore_index=True)
 
         if archive:
@@ -465,7 +567,35 @@ def psu_extract(lv_dir, archive=False):
     logger.info("--PSU Extract Completed")
 
 
-def tc_extract(lv_dir, archive=False):
+def psu_read(curfile, hdr, hdr_types, skip):
+    """Reads a single PSU_Log file and adds the time and power columns"""
+
+    file_df = pd.read_csv(curfile,
+                          sep='\t',
+                          names=hdr,
+                          dtype=hdr_types,
+                          usecols=skip,
+                          skiprows=1)
+
+    if file_df.empty:
+        return file_df
+
+    file_df['DT'] = pd.to_datetime(file_df['Date Time'],
+                                   format='%d/%m/%Y %H:%M:%S.%f')
+    file_df['Power'] = file_df['Voltage'] * file_df['Current']
+
+    # If no heater just set all to zero
+    if file_df.shape[1] == 5:
+        file_df['Htr. Voltage'] = 0
+        file_df['Htr. Current'] = 0
+
+    file_df['Htr. Power'] = file_df['Htr. Voltage'] * \
+        file_df['Htr. Current']
+
+    return file_df
+
+
+def tc_extract(lv_dir, archive=False, cache=None):
     logger.info("Extracting Labview TC commands.")
 
     files_tc = pancam_fns.Find_Files(lv_dir, "RMAP_CMD_*.txt")
@@ -489,11 +619,13 @@ def tc_extract(lv_dir, archive=False):
     tc_hdr = tc_hdr_strings + tc_hdr_cmd
     tc_col = tc_hdr_cmd
 
-    tc = pd.DataFrame()
+    tc_list = []
 
     for curfile in files_tc:
         logger.info("Reading %s", curfile.name)
-        file_df = pd.read_csv(curfile, sep='\t', names=tc_hdr, dtype=object)
+        file_df = pancam_fns.cached_read(
+            curfile, lambda f: pd.read_csv(f, sep='\t', names=tc_hdr, dtype=object),
+            cache)
 
         if archive:
             curfile.rename(arc_dir / curfile.name)
@@ -505,29 +637,62 @@ def tc_extract(lv_dir, archive=False):
         if file_df['Description'].iloc[-1] == '  ':
             file_df = file_df[:-1]
 
-        # Decode hex
-        file_df[tc_col] = file_df[tc_col].fillna('-1')
-        file_df[tc_col] = file_df[tc_col].applymap(lambda x: int(x, base=16))
-        file_df[tc_col] = file_df[tc_col].replace('-1', np.nan)
+        tc_list.append(file_df)
 
-        # Calculate time
-        file_df['DT'] = file_df['Date'] + file_df['Time']
-        file_df['DT'] = pd.to_datetime(
-            file_df['DT'], format='%Y-%m-%d%H:%M:%S.%f ')
-
-        file_df['BID'] = ((file_df[0]*256+file_df[1]) & 0x7F8).values >> 3
-        tc = tc.append(file_df, ignore_index=True)
+    tc = pd.concat(tc_list, ignore_index=True) if tc_list else pd.DataFrame()
 
     if tc.empty:
         logger.info("PanCam TC Empty. -- Finished")
         return
 
-    tc['ACTION'] = tc['Description'].map(lambda x: x[12:])
+    # Decode hex, missing bytes are set to -1
+    values, valid = tc_hex_decode(tc[tc_col])
+    cmd = np.where(valid, values.astype(np.int64), -1)
+    for col in tc_col:
+        tc[col] = cmd[:, col]
+
+    # Calculate time
+    tc['DT'] = pd.to_datetime(
+        tc['Date'] + tc['Time'], format='%Y-%m-%d%H:%M:%S.%f ')
+
+    tc['BID'] = ((cmd[:, 0]*256 + cmd[:, 1]) & 0x7F8) >> 3
+
+    tc['ACTION'] = tc['Description'].str.slice(12)
     tc.to_pickle(proc_dir / "Unproc_TC.pickle")
     logger.info("PanCam TC pickled.")
     logger.info("--TC Extract Completed")
 
 
+def tc_hex_decode(cells):
+    """Decodes a table of hex byte strings into a uint8 matrix.
+
+    Each cell is 1 or 2 hex characters which are converted with HEX_LUT
+    rather than int() per cell.
+
+    Arguments:
+        cells {pd.DataFrame()} -- Hex strings, with NaN where missing.
+
+    Returns:
+        values {np.array} -- uint8 matrix of the decoded bytes, 0 where invalid.
+        valid {np.array} -- bool matrix, False where missing or not hex.
+    """
+
+    # Fixed width of 3 so anything longer than 2 characters is detectable
+    codes = cells.apply(lambda col: col.str.strip()).fillna('')
+    codes = np.ascontiguousarray(codes.to_numpy().astype('S3'))
+    raw = codes.view(np.uint8).reshape(codes.shape + (3,))
+
+    hi = pancam_fns.HEX_LUT[raw[..., 0]]
+    lo = pancam_fns.HEX_LUT[raw[..., 1]]
+    single = raw[..., 1] == 0
+
+    valid = (hi < 16) & ((lo < 16) | single) & (raw[..., 2] == 0)
+    values = np.where(single, hi, (hi << 4) | lo).astype(np.uint8)
+    values[~valid] = 0
+
+    return values, valid
+
+
 def create_json(img_file):
     """Creates a json file to accompany .pci_raw image.
 
@@ -571,22 +736,24 @@ def create_repairedjson(img_file):
         json.dump(top_lev_dic, f, indent=4)
 
 
-def create_archive(lv_dir):
+def create_archive(lv_dir, codec='bz2'):
     """Creates a compressed tar archive of the archive folder
 
     Arguments:
         lv_dir {Path} -- Path to LabView directory
 
+    Keyword Arguments:
+        codec {str} -- 'bz2' or the faster 'xz' (default: {'bz2'})
+
     Generates:
         ARCHIVE.tar.bz2 -- Compressed archive of original files
     """
 
-    archive_name = lv_dir / "ARCHIVE"
-    # Folde that will be archived
+    # Folder that will be archived
     target = lv_dir / "ARCHIVE"
 
-    # bz2 is a good compromise between speed and efficiency
-    shutil.make_archive(archive_name, 'bztar', target, logger=logger)
+    # Blocks are compressed in parallel, readable by the standard tools
+    session_archive.create_archive(target, codec=codec)
 
     # Once complete delete original folder
     shutil.rmtree(target)
@@ -629,13 +796,12 @@ def create_spw_images(dir_proc):
     # Create normal images for them along with JSON
     for curfile in raw_spw:
         pci_raw_file = dir_raw / (curfile.stem + '.pci_raw')
-        pancam_fns.exist_unlink(pci_raw_file, logging.WARNING)
-
         json_file = pci_raw_file.with_suffix('.json')
-        pancam_fns.exist_unlink(json_file, logging.WARNING)
 
         logger.info("Moving %s to IMG_RAW dir", curfile.name)
-        copyfile(curfile, pci_raw_file)
+        if not pancam_fns.copy_if_changed(curfile, pci_raw_file):
+            continue
+        pancam_fns.exist_unlink(json_file, logging.WARNING)
 
         # Create json file
         proc_info = labviewProcVer
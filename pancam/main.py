@@ -10,8 +10,8 @@ Created 31 Oct 2019
 """
 
 from pathlib import Path
+import contextlib
 import logging
-import shutil
 import json
 
 import plotter
@@ -25,9 +25,54 @@ import hs
 import labview
 import tc_cal
 import pancam_fns
+import archive
+import watch
 
 logger, status = pancam_fns.setup_logging()
 
+
+def staged(session_arch, session_dir, extractor):
+    """Returns a context staging the archive members read by extractor.
+
+    Does nothing when not processing an archive.
+
+    Arguments:
+        session_arch {SessionArchive} -- Open archive or None.
+        session_dir {Path} -- Folder that the products are produced within.
+        extractor {str} -- Key of archive.EXTRACTOR_MEMBERS.
+    """
+    if session_arch is None:
+        return contextlib.nullcontext()
+    return session_arch.staging(
+        session_dir, archive.EXTRACTOR_MEMBERS[extractor])
+
+
+def swis_instances(session_arch, session_dir):
+    """Returns the SWIS TB instances, staging their files from an archive.
+
+    The instance files are moved by create_instances so are kept until the
+    final cleanup, and only staged if the archive index holds SWIS files.
+
+    Arguments:
+        session_arch {SessionArchive} -- Open archive or None.
+        session_dir {Path} -- Folder that the products are produced within.
+
+    Returns:
+        instances {List of Paths} -- Instance folders from create_instances.
+    """
+    if session_arch is None:
+        return swis.create_instances(session_dir)
+    if session_arch.classify() != 'SWIS':
+        return []
+
+    session_arch.stage(
+        session_dir, archive.EXTRACTOR_MEMBERS['swis.create_instances'])
+    instances = swis.create_instances(session_dir)
+    session_arch.adopt(path for inst in instances if inst != session_dir
+                       for path in inst.iterdir() if path.is_file())
+    return instances
+
+
 if __name__ == '__main__':
 
     status.info("Running main.py")
@@ -40,24 +85,28 @@ if __name__ == '__main__':
         quit()
 
     # Determine if working with archived folder
-    arch = input("Is the folder in a tar.bz2 archive? [Y/N (Default)]: ")
+    arch = input("Is the folder in a tar.bz2 or tar.xz archive? [Y/N (Default)]: ")
     if arch == 'Y' or arch == 'y':
         file_arch = input("Input the archive full filename: ")
         file_path = top_dir / file_arch
 
-        if file_path.suffixes != ['.tar', '.bz2']:
+        if file_path.suffixes[-2:] not in (['.tar', '.bz2'], ['.tar', '.xz']):
             logger.error("Not a valid archive format - exiting")
             quit()
 
-        logger.info("Unpacking archive to: %s", top_dir)
-        shutil.unpack_archive(file_path, top_dir, 'bztar')
-
-        # New top dir
+        # New top dir, only the products and files read are written here
         top_dir = top_dir / file_path.stem[:-4]
+        top_dir.mkdir(exist_ok=True)
+
+        # Members are written out just before the extractor reading them
+        session_arch = archive.SessionArchive(file_path)
+        session_arch.open()
+        session_arch.stage(top_dir, [('config.json', False)])
 
         arch_logs = False
 
     else:
+        session_arch = None
         arch_user = input(
             "Do you want to archive the files after processing? [Y/N (Default)]: ")
         if arch_user == 'Y' or arch_user == 'y':
@@ -103,110 +152,139 @@ if __name__ == '__main__':
         config = {}
 
     # Cycle through processing types
-    if not source:
-        # First check if SWIS as multiple folders
-        instances = swis.create_instances(top_dir)
-        if instances:
-            status.info("SWIS Instances Found")
-            source = "SWIS"
-
-        elif labview.hk_extract(top_dir, archive=arch_logs):
-            status.info("LabView Type Found")
-            source = "LabView"
-
-        elif rover.TM_extract(top_dir):
-            status.info("Rover Type Found")
-            source = "Rover"
-
-            # Idnetify Rover model
-            model = rover.type(top_dir)
-
-            # Version of RVSW
-            version = rover.sw_ver(top_dir)
-
-            source_details = {"Type": "Rover",
-                              "Model": model,
-                              "RMSW Ver": version}
-
-            config.update({"Source Details": source_details})
-
-        elif swis.nsvf_parse(top_dir):
-            status.info("Single SWIS Type Found")
-            source = "Single SWIS"
-
-        else:
-            status.error("No Source Type could be determined - Aborting")
-            source = "Undetermined"
-
-        # Write type to config_file
-        if config:
-            config.update({"Source": source})
-        else:
-            config = {"Source": source}
-
-        with open(config_file, 'w') as f:
-            json.dump(config, f, indent=4, sort_keys=True)
-
-    if source == 'SWIS':
-        for inst in instances:
-            proc_dir = inst / "PROC"
-            status.info("Analysing %s", inst.name)
-            swis.hk_extract(inst)
-            swis.hs_extract(inst)
-            hs.decode(proc_dir, True)
-            hs.verify(inst)
-            hk_raw.decode(proc_dir, source)
-            hk_cal.cal_HK(proc_dir)
-            tc_cal.decode_all(proc_dir)
-            plotter.all_plots(proc_dir)
-            swis.sci_extract(inst)
-            swis.sci_compare(inst)
-            image_browse.Img_RAW_Browse(proc_dir)
-
-    elif source == 'LabView':
-        # LabView Files
-        labview.hs_extract(top_dir, archive=arch_logs)
-        hs.decode(proc_dir)
-        hs.verify(proc_dir)
-        labview.tc_extract(top_dir)
-        if hs.all_default_image_dim(proc_dir):
-            labview.sci_extract(top_dir, archive=arch_logs)
-            labview.bin_move(top_dir, archive=arch_logs)
-        else:
-            labview.bin_move(top_dir, archive=arch_logs, comp_spw=False)
-        labview.psu_extract(top_dir, archive=arch_logs)
-        labview.create_spw_images(proc_dir)
-        if arch_logs:
-            labview.create_archive(top_dir)
-
-    elif source == "Rover":
-        # Rover files
-        rover.TC_extract(top_dir)
-        rover.TM_extract(top_dir)
-        rover_ha.HaScan(top_dir)
-        rover_ha.RestructureHK(proc_dir)
-        rover_ha.compareHaCSV(proc_dir)
-        rover.NavCamBrowse(top_dir)
-
-    elif source == "Single SWIS":
-        swis.nsvf_lb_extract(top_dir)
-        swis.nsvf_tc_extract(top_dir)
-        swis.hk_extract(proc_dir)
-        hs.decode(proc_dir, spw_header=True)
-        hs.verify(proc_dir)
-        swis.sci_extract(proc_dir, True)
-        swis.sci_compare(proc_dir)
-
-    elif source == "Undetermined":
-        quit()
-
-    # Process secondary files
-    hk_raw.decode(proc_dir, source, model)
-    image_browse.Img_RAW_Browse(proc_dir)
-    hk_cal.cal_HK(proc_dir)
-    tc_cal.decode_all(proc_dir)
+    try:
+        instances = None
+        if not source:
+            # First check if SWIS as multiple folders
+            instances = swis_instances(session_arch, top_dir)
+            if instances:
+                status.info("SWIS Instances Found")
+                source = "SWIS"
+
+            else:
+                with staged(session_arch, top_dir, 'labview.hk_extract'):
+                    found = labview.hk_extract(top_dir, archive=arch_logs)
+                if found:
+                    status.info("LabView Type Found")
+                    source = "LabView"
+
+            if not source:
+                with staged(session_arch, top_dir, 'rover.TM_extract'):
+                    found = rover.TM_extract(top_dir)
+                if found:
+                    status.info("Rover Type Found")
+                    source = "Rover"
+
+                    # Idnetify Rover model
+                    with staged(session_arch, top_dir, 'rover.TC_extract'):
+                        model = rover.type(top_dir)
+
+                    # Version of RVSW
+                    version = rover.sw_ver(top_dir)
+
+                    source_details = {"Type": "Rover",
+                                      "Model": model,
+                                      "RMSW Ver": version}
+
+                    config.update({"Source Details": source_details})
+
+            if not source:
+                with staged(session_arch, top_dir, 'swis.nsvf_parse'):
+                    found = swis.nsvf_parse(top_dir)
+                if found:
+                    status.info("Single SWIS Type Found")
+                    source = "Single SWIS"
+
+                else:
+                    status.error(
+                        "No Source Type could be determined - Aborting")
+                    source = "Undetermined"
+
+            # Write type to config_file
+            if config:
+                config.update({"Source": source})
+            else:
+                config = {"Source": source}
+
+            with open(config_file, 'w') as f:
+                json.dump(config, f, indent=4, sort_keys=True)
+
+        if source == 'SWIS':
+            if instances is None:
+                instances = swis_instances(session_arch, top_dir)
+            swis.process_instances(top_dir, instances)
+
+        elif source == 'LabView':
+            # LabView Files
+            with staged(session_arch, top_dir, 'labview.hs_extract'):
+                labview.hs_extract(top_dir, archive=arch_logs)
+            hs.decode(proc_dir)
+            hs.verify(proc_dir)
+            with staged(session_arch, top_dir, 'labview.tc_extract'):
+                labview.tc_extract(top_dir)
+            if hs.all_default_image_dim(proc_dir):
+                with staged(session_arch, top_dir, 'labview.sci_extract'):
+                    labview.sci_extract(top_dir, archive=arch_logs)
+                with staged(session_arch, top_dir, 'labview.bin_move'):
+                    labview.bin_move(top_dir, archive=arch_logs)
+            else:
+                with staged(session_arch, top_dir, 'labview.bin_move'):
+                    labview.bin_move(
+                        top_dir, archive=arch_logs, comp_spw=False)
+            with staged(session_arch, top_dir, 'labview.psu_extract'):
+                labview.psu_extract(top_dir, archive=arch_logs)
+            labview.create_spw_images(proc_dir)
+            if arch_logs:
+                labview.create_archive(
+                    top_dir, codec=config.get('Archive Codec', 'bz2'))
+
+        elif source == "Rover":
+            # Rover files
+            with staged(session_arch, top_dir, 'rover.TC_extract'):
+                rover.TC_extract(top_dir)
+            with staged(session_arch, top_dir, 'rover.TM_extract'):
+                rover.TM_extract(top_dir)
+            with staged(session_arch, top_dir, 'rover_ha.HaScan'):
+                rover_ha.HaScan(top_dir)
+            rover_ha.RestructureHK(proc_dir)
+            rover_ha.compareHaCSV(proc_dir)
+            with staged(session_arch, top_dir, 'rover.NavCamBrowse'):
+                rover.NavCamBrowse(top_dir)
+
+        elif source == "Single SWIS":
+            with staged(session_arch, top_dir, 'swis.nsvf_lb_extract'):
+                swis.nsvf_lb_extract(top_dir)
+            swis.nsvf_tc_extract(top_dir)
+            swis.hk_extract(proc_dir)
+            hs.decode(proc_dir, spw_header=True)
+            hs.verify(proc_dir)
+            swis.sci_extract(proc_dir, True)
+            swis.sci_compare(proc_dir)
+
+        elif source == "Undetermined":
+            quit()
 
-    # Produce Plots
-    plotter.all_plots(proc_dir)
+        # Process secondary files
+        hk_raw.decode(proc_dir, source, model)
+        image_browse.Img_RAW_Browse(proc_dir)
+        hk_cal.cal_HK(proc_dir)
+        tc_cal.decode_all(proc_dir)
+
+        # Produce Plots
+        plotter.all_plots(proc_dir)
+
+    finally:
+        # Remove any files still staged from the archive
+        if session_arch:
+            session_arch.cleanup()
+            session_arch.close()
+
+    # Follow folder and refresh products as new data arrives
+    if (source == 'Rover' or source == 'LabView') and not arch_logs \
+            and not session_arch:
+        watch_user = input(
+            "Do you want to watch the folder for new data? [Y/N (Default)]: ")
+        if watch_user == 'Y' or watch_user == 'y':
+            watch.watch(top_dir, source, model)
 
 logger.info("main.py completed")
@@ -6,16 +6,35 @@
 # PanCam Data Processing Tools
 
 from pathlib import Path
+from collections import OrderedDict
 from natsort import natsorted, ns
 from bitstruct import unpack_from as upf
+import numpy as np
 import pandas as pd
 import binascii
+import filecmp
+import hashlib
 import logging
+import logging.handlers
+import mmap
+import os
+import shutil
+import sys
 
 logger = logging.getLogger(__name__)
 status = logging.getLogger('status')
 
 
+# Lookup of ASCII character to hex digit value.
+# Whitespace is HEX_SPACE, anything else not a hex digit is HEX_INVALID.
+HEX_SPACE = 0xFE
+HEX_INVALID = 0xFF
+HEX_LUT = np.full(256, HEX_INVALID, dtype=np.uint8)
+HEX_LUT[np.frombuffer(b'0123456789abcdef', dtype=np.uint8)] = np.arange(16)
+HEX_LUT[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+HEX_LUT[np.frombuffer(b' \t\r\n\v\f', dtype=np.uint8)] = HEX_SPACE
+
+
 def Find_Files(DIR, FILT, SingleFile=False, Recursive=True):
     """Finds all the files within DIR using the wildcard FILT.
     If SingleFile is True expects to return only one file."""
@@ -170,6 +189,39 @@ def setup_proc_logging(logger, proc_dir):
     logger.addHandler(fh)
 
 
+class LogDispatch(logging.Handler):
+    """Passes records from worker processes to the logger of the same name.
+
+    Used with a logging.handlers.QueueListener on the queue given to
+    worker_logging.
+    """
+
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def worker_logging(log_queue):
+    """Process pool initialiser that sends all log records to log_queue.
+
+    Worker processes otherwise have no handlers under spawn, or share the
+    parent file handler unsynchronised under fork.
+
+    Arguments:
+        log_queue -- multiprocessing.Queue read by a QueueListener in the parent.
+    """
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+    # Status records reach the queue through the root logger
+    stat = logging.getLogger('status')
+    for handler in stat.handlers[:]:
+        stat.removeHandler(handler)
+
+
 def exist_unlink(purepath, loglevel=logging.INFO):
     """Checks whether a file exists before unlinking.
 
@@ -184,3 +236,288 @@ def exist_unlink(purepath, loglevel=logging.INFO):
     if purepath.exists():
         purepath.unlink()
         logger.log(loglevel, "Deleting file: %s", purepath.name)
+
+
+def hex_decode(data, buf):
+    """Decodes whitespace separated hex into a reusable buffer.
+
+    Equivalent to bytes.fromhex but the result is written into buf, which is
+    only replaced when too small.
+
+    Arguments:
+        data {bytes} -- ASCII hex digits, whitespace is ignored.
+        buf {np.array} -- uint8 buffer to decode into.
+
+    Returns:
+        np.array -- View of buf, or of a new larger buffer, with the decoded bytes.
+    """
+
+    vals = HEX_LUT[np.frombuffer(data, dtype=np.uint8)]
+    if (vals == HEX_INVALID).any():
+        raise ValueError("non-hexadecimal value found")
+
+    digits = vals[vals != HEX_SPACE]
+    if digits.size % 2:
+        raise ValueError("odd number of hexadecimal digits")
+
+    num = digits.size // 2
+    if buf.size < num:
+        buf = np.empty(num, dtype=np.uint8)
+
+    out = buf[:num]
+    np.left_shift(digits[0::2], 4, out=out)
+    np.bitwise_or(out, digits[1::2], out=out)
+
+    return out
+
+
+def read_split_log(file, sep, names=('Time', 'RAW')):
+    """Reads a text log where each line is a time and payload split by sep.
+
+    Equivalent to pd.read_csv(sep=sep, engine='python') for the two field
+    layouts of the LabView and SWIS logs. As the separators are more than one
+    character the C engine cannot be used, so instead the lines are split on
+    the first sep by a single np.char.partition of the file bytes. Trailing
+    whitespace is removed and blank lines ignored.
+
+    Arguments:
+        file -- pathlib path of the log to read.
+        sep {str} -- literal separator between the time and payload.
+
+    Keyword Arguments:
+        names {tuple} -- column names of the two fields (default: {('Time', 'RAW')})
+
+    Returns:
+        pd.DataFrame -- a row per line, payload is NaN if no sep in the line.
+    """
+
+    with open(file, 'rb') as f:
+        lines = np.char.rstrip(np.array(f.read().splitlines(), dtype=bytes))
+    lines = lines[np.char.str_len(lines) > 0]
+
+    if lines.size == 0:
+        return pd.DataFrame(columns=list(names))
+
+    parts = np.char.partition(lines, sep.encode())
+    payload = parts[:, 2].astype(str).astype(object)
+    payload[parts[:, 1] == b''] = None
+
+    return pd.DataFrame({names[0]: parts[:, 0].astype(str).astype(object),
+                         names[1]: payload}, dtype=object)
+
+
+def cached_read(file, reader, cache=None):
+    """Returns reader(file), reusing the previous result while file is unchanged.
+
+    Results are held in cache against the size and mtime of the file, so a
+    caller re-reading a folder of logs as they grow only parses the new and
+    appended files. The result must not be modified by the caller.
+
+    Arguments:
+        file -- pathlib path of the file to read.
+        reader -- function taking file and returning its parsed contents.
+
+    Keyword Arguments:
+        cache {dict} -- results of previous reads, None to always read (default: {None})
+
+    Returns:
+        The result of reader(file).
+    """
+
+    if cache is None:
+        return reader(file)
+
+    stat = file.stat()
+    key = (stat.st_size, stat.st_mtime_ns)
+    hit = cache.get(file)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+
+    result = reader(file)
+    cache[file] = (key, result)
+    return result
+
+
+def copy_range(src, dst, offset=0, count=None):
+    """Copies part of a file onto the end of an open binary file.
+
+    Where the OS supports it the data is copied within the kernel using
+    copy_file_range or sendfile so the contents never enter Python. Otherwise
+    falls back to a chunked copy.
+
+    Arguments:
+        src -- pathlib path of the file to copy from.
+        dst -- open binary file object to copy to.
+
+    Keyword Arguments:
+        offset {int} -- byte offset within src to start copying (default: {0})
+        count {int} -- number of bytes to copy, None for to the end (default: {None})
+
+    Returns:
+        int -- number of bytes copied.
+    """
+
+    chunk = 1024*1024
+
+    with open(src, 'rb') as fsrc:
+        in_fd = fsrc.fileno()
+        if count is None:
+            count = max(os.fstat(in_fd).st_size - offset, 0)
+
+        dst.flush()
+        out_fd = dst.fileno()
+        copied = 0
+
+        try:
+            if hasattr(os, 'copy_file_range'):
+                while copied < count:
+                    sent = os.copy_file_range(
+                        in_fd, out_fd, count - copied, offset + copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+
+            elif hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+                while copied < count:
+                    sent = os.sendfile(
+                        out_fd, in_fd, offset + copied, count - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+
+        except OSError:
+            logger.info("Kernel copy unavailable, using buffered copy")
+
+        # Buffered copy of anything remaining
+        fsrc.seek(offset + copied)
+        while copied < count:
+            data = fsrc.read(min(chunk, count - copied))
+            if not data:
+                break
+            dst.write(data)
+            copied += len(data)
+
+    return copied
+
+
+def file_digest(path, offset=0, algorithm='sha256'):
+    """Returns the hex digest of a file from the given offset onwards.
+
+    The file is memory mapped so it is hashed without being read into Python.
+
+    Arguments:
+        path -- pathlib path of the file to hash.
+
+    Keyword Arguments:
+        offset {int} -- byte offset within the file to start from (default: {0})
+        algorithm {str} -- hashlib algorithm name (default: {'sha256'})
+
+    Returns:
+        str -- hex digest of the file contents.
+    """
+
+    digest = hashlib.new(algorithm)
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > offset:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)[offset:]
+                try:
+                    digest.update(view)
+                finally:
+                    view.release()
+
+    return digest.hexdigest()
+
+
+def copy_if_changed(src, dst):
+    """Copies src to dst unless dst already holds the same contents.
+
+    Leaving an identical dst untouched keeps its mtime, so products made from
+    it are not seen as out of date.
+
+    Arguments:
+        src -- pathlib path of the file to copy.
+        dst -- pathlib path of the copy.
+
+    Returns:
+        bool -- True if dst was written.
+    """
+
+    if dst.exists() and filecmp.cmp(src, dst, shallow=False):
+        logger.info("%s unchanged, not copied", dst.name)
+        return False
+
+    exist_unlink(dst)
+    shutil.copyfile(src, dst)
+    return True
+
+
+class WriterPool(object):
+    """Keeps files that are written piece by piece open behind large buffers.
+
+    Files are opened in append mode when first written and kept open until
+    closed by the caller. When more than max_open files are open the least
+    recently written file is flushed and closed, to be reopened in append
+    mode if written again. Should be used as a context manager so that all
+    files are flushed and closed even if processing fails.
+
+    Keyword Arguments:
+        max_open {int} -- Maximum number of files open at once (default: {64})
+        buffering {int} -- Write buffer size for each file (default: {1 MiB})
+    """
+
+    def __init__(self, max_open=64, buffering=1024*1024):
+        self.max_open = max_open
+        self.buffering = buffering
+        self._files = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_all()
+
+    def __contains__(self, path):
+        return Path(path) in self._files
+
+    def write(self, path, data):
+        """Appends data to the file given by path"""
+        self._handle(Path(path)).write(data)
+
+    def flush(self, path=None):
+        """Flushes the file given by path, or all files if None"""
+        if path is None:
+            for wf in self._files.values():
+                wf.flush()
+        elif Path(path) in self._files:
+            self._files[Path(path)].flush()
+
+    def close(self, path):
+        """Flushes and closes the file given by path if open"""
+        wf = self._files.pop(Path(path), None)
+        if wf is not None:
+            wf.close()
+
+    def close_all(self):
+        """Flushes and closes all open files"""
+        while self._files:
+            path, wf = self._files.popitem(last=False)
+            try:
+                wf.close()
+            except OSError:
+                logger.exception("Unable to close file: %s", path.name)
+
+    def _handle(self, path):
+        wf = self._files.get(path)
+        if wf is not None:
+            self._files.move_to_end(path)
+            return wf
+
+        while len(self._files) >= self.max_open:
+            _, old = self._files.popitem(last=False)
+            old.close()
+
+        wf = open(path, 'ab', buffering=self.buffering)
+        self._files[path] = wf
+        return wf
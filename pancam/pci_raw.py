@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Memory mapped access to .pci_raw images.
+
+A .pci_raw file is the 48 byte image header followed by the pixel data,
+either 16-bit big endian padded pixels or four 10-bit pixels every 5 bytes.
+PciRaw maps the file so the header is only decoded when first used and the
+padded pixels are a read only view of the file in the shape given by the
+binning mode, nothing being read until it is touched. The browse orientation
+of each camera is applied as a view rather than a copy.
+
+:copyright: (c) 2020 by Barry J Whiteside. Mullard Space Science Laboratory - UCL
+
+:license: GPLv3, see LICENSE for more details.
+"""
+
+from pathlib import Path
+import logging
+
+import numpy as np
+
+from image_hdr_raw import decodeRAW_ImgHDR
+
+logger = logging.getLogger(__name__)
+status = logging.getLogger('status')
+
+# Global parameters
+HDR_BYTES = 48
+IMG_BYTES = 2097200
+BIN_RES = [1024, 512, 256, 128]
+
+
+class PciRawError(Exception):
+    """error for unexpected things"""
+    pass
+
+
+def read_header(raw_file):
+    """Returns the decoded header of a pci_raw file, reading only the header"""
+    with open(raw_file, 'rb') as f:
+        return decodeRAW_ImgHDR(f.read(HDR_BYTES))
+
+
+def unpack_10bit(data, res=None):
+    """Unpacks non-padded image data of four 10-bit pixels every 5 bytes.
+
+    Arguments:
+        data {bytes} -- Packed pixel data, any incomplete final group is ignored.
+
+    Keyword Arguments:
+        res {int} -- Image width and height, one of BIN_RES, None for 1-D (default: {None})
+
+    Returns:
+        np.array -- uint16 pixels, shape (res, res) if res given.
+    """
+
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if res is not None:
+        num = res * res // 4
+        if len(raw) < num * 5:
+            raise PciRawError(
+                f"Expected {num*5} bytes for {res}x{res} image, got {len(raw)}")
+    else:
+        num = len(raw) // 5
+
+    grp = raw[:num*5].reshape(num, 5).astype(np.uint16)
+    pix = np.empty((num, 4), dtype=np.uint16)
+    pix[:, 0] = (grp[:, 0] << 2) | (grp[:, 1] >> 6)
+    pix[:, 1] = ((grp[:, 1] & 0x3F) << 4) | (grp[:, 2] >> 4)
+    pix[:, 2] = ((grp[:, 2] & 0x0F) << 6) | (grp[:, 3] >> 2)
+    pix[:, 3] = ((grp[:, 3] & 0x03) << 8) | grp[:, 4]
+
+    if res is not None:
+        return pix.reshape(res, res)
+    return pix.reshape(-1)
+
+
+def pack_10bit(pixels):
+    """Packs pixels into non-padded image data, the inverse of unpack_10bit.
+
+    Arguments:
+        pixels {np.array} -- 10-bit pixel values, size a multiple of 4.
+
+    Returns:
+        bytes -- Packed pixel data, 5 bytes for every 4 pixels.
+    """
+
+    pix = np.asarray(pixels, dtype=np.uint16).reshape(-1, 4)
+    grp = np.empty((len(pix), 5), dtype=np.uint8)
+    grp[:, 0] = pix[:, 0] >> 2
+    grp[:, 1] = ((pix[:, 0] & 0x03) << 6) | (pix[:, 1] >> 4)
+    grp[:, 2] = ((pix[:, 1] & 0x0F) << 4) | (pix[:, 2] >> 6)
+    grp[:, 3] = ((pix[:, 2] & 0x3F) << 2) | (pix[:, 3] >> 8)
+    grp[:, 4] = pix[:, 3] & 0xFF
+    return grp.tobytes()
+
+
+def orient(img, cam):
+    """Returns a view of img in the browse orientation of the camera.
+
+    Arguments:
+        img {np.array} -- Image as stored in the pci_raw.
+        cam {int} -- Camera from the image header, 1 and 2 WACs, 3 HRC.
+
+    Returns:
+        np.array -- View of img, no pixels are copied.
+        dict -- Transform applied for the browse properties.
+    """
+
+    if cam == 1:
+        return np.rot90(img, k=3), {'Browse_Rotation': '-90'}
+    elif cam == 2:
+        return np.rot90(img, k=1), {'Browse_Rotation': '+90'}
+    elif cam == 3:
+        return np.fliplr(img), {'Browse_Transpose': "Left_Right"}
+    else:
+        logger.warning("Invalid CAM number %s, image not transformed", cam)
+        return img, {'Browse_Transform': 'None'}
+
+
+class PciRaw(object):
+    """Memory mapped .pci_raw image.
+
+    Arguments:
+        raw_file {Path} -- .pci_raw image file.
+
+    Usage:
+        with PciRaw(raw_file) as img:
+            if img.header['Cam'] == 3:
+                hrc = img.oriented()
+    """
+
+    def __init__(self, raw_file):
+        self.file = Path(raw_file)
+        self._mm = None
+        self._header = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """Maps the file, no data is read until used"""
+        size = self.file.stat().st_size
+        if size < HDR_BYTES:
+            raise PciRawError(
+                f"{self.file.name} is {size} bytes, shorter than the header")
+        self._mm = np.memmap(self.file, dtype=np.uint8, mode='r')
+
+    def close(self):
+        # Views already handed out keep the mapping alive until released
+        self._mm = None
+
+    @property
+    def header(self):
+        """Decoded image header, decoded once on first use"""
+        if self._header is None:
+            self._header = decodeRAW_ImgHDR(self._mm[:HDR_BYTES].tobytes())
+        return self._header
+
+    @property
+    def res(self):
+        """Image width and height given by the binning mode"""
+        if self.header['Cam'] != 3:
+            return BIN_RES[self.header['W_Bin']]
+        return 1024
+
+    @property
+    def padded(self):
+        """True if each pixel is padded to 16-bits"""
+        if self.header['Cam'] != 3:
+            return bool(self.header['W_Pad_F'])
+        return True
+
+    @property
+    def data(self):
+        """Read only uint8 view of the data after the header"""
+        return self._mm[HDR_BYTES:]
+
+    @property
+    def pixels(self):
+        """Pixel plane as a (res, res) array.
+
+        Padded images give a read only view of the file. Non-padded images
+        have to be unpacked and so give a uint16 copy.
+        """
+
+        res = self.res
+        if not self.padded:
+            return unpack_10bit(self.data, res)
+
+        num = res * res * 2
+        if self.data.size < num:
+            raise PciRawError(
+                f"Expected {num} bytes for {res}x{res} image, got {self.data.size}")
+        return self.data[:num].view('>u2').reshape(res, res)
+
+    def oriented(self, img=None):
+        """Returns a view of the pixels, or img, in the browse orientation.
+
+        Keyword Arguments:
+            img {np.array} -- Image derived from the pixels, None for the pixels (default: {None})
+
+        Returns:
+            np.array -- View in the browse orientation.
+            dict -- Transform applied for the browse properties.
+        """
+        if img is None:
+            img = self.pixels
+        return orient(img, self.header['Cam'])
@@ -14,6 +14,7 @@ import imageio
 from datetime import datetime
 
 import pancam_fns
+import image_browse
 
 logger = logging.getLogger(__name__)
 status = logging.getLogger('status')
@@ -26,14 +27,17 @@ name_rov_ls = "AB.TM.MRSP8001"
 name_rov_hs = "AB.TM.MRSP8002"
 
 
-def TM_extract(ROV_DIR):
-    """Searches for TM with Rover files and creates a binary array of each file found"""
+def TM_extract(ROV_DIR, cache=None):
+    """Searches for TM with Rover files and creates a binary array of each file found
+
+    Keyword Arguments:
+        cache {dict} -- Files already read, only new or changed files are read (default: {None})
+    """
 
     logger.info("Processing Rover TM Files")
     DF = pd.DataFrame()
     DRS = pd.DataFrame()
     DRT = pd.DataFrame()
-    DG = pd.DataFrame()
 
     TMfiles = pancam_fns.Find_Files(ROV_DIR, "STDRawOcds*.csv")
     if not TMfiles:
@@ -46,81 +50,19 @@ def TM_extract(ROV_DIR):
     # Read CSV files and parse
     for file in TMfiles:
         logger.info("Reading %s", file.name)
-        DT = pd.read_csv(file, sep=';', header=0, index_col=False)
+        es_entries, ne_entries, DL, DP, DK = pancam_fns.cached_read(
+            file, tm_read, cache)
 
-        # Search for PanCam housekeeping
-        DF_es_entries += DT[DT['NAME'] == name_hk_es].shape[0]
-        DF_ne_entries += DT[DT['NAME'] == name_hk_ne].shape[0]
+        DF_es_entries += es_entries
+        DF_ne_entries += ne_entries
 
-        DL = DT[(DT['NAME'] == name_hk_es) | (
-            DT['NAME'] == name_hk_ne)].copy()
         if not DL.empty:
-            DL['RAW'] = DL.RAW_DATA.apply(lambda x: x[38: -4])
-            DL['DT'] = pd.to_datetime(
-                DL['GROUND_REFERENCE_TIME'], format='%d/%m/%Y %H:%M:%S.%f')
             DF = DF.append(DL[['RAW', 'DT']], ignore_index=True)
 
-        # Rover HK both low and high speed
-        DP = DT[(DT['NAME'] == name_rov_ls) | (
-            DT['NAME'] == name_rov_hs)].copy()
         if not DP.empty:
-            DG = DP.RAW_DATA.apply(lambda x: x[2:])
-            DG = DG.apply(lambda x: bytearray.fromhex(x))
-            # PanCam Current
-            OffBy, OffBi, Len = 85, 4, 'u12'
-            DP['RAW_Inst_Curr'] = DG.apply(
-                lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
-            DP['Inst_Curr'] = DP['RAW_Inst_Curr'] * 1.1111/4095
-            # PanCam Heater
-            OffBy, OffBi, Len = 57, 4, 'u12'
-            DP['RAW_HTR_Curr'] = DG.apply(
-                lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
-            DP['HTR_Curr'] = DP['RAW_HTR_Curr'] * 1.1111/4095
-            # PanCam Heater Status
-            OffBy, OffBi, Len = 51, 2, 'u1'
-            DP['HTR_ST'] = DG.apply(lambda x: upf(
-                Len, x, offset=8*OffBy+OffBi)[0])
-            # PanCam Power Status
-            OffBy, OffBi, Len = 77, 1, 'u1'
-            DP['PWR_ST'] = DG.apply(lambda x: upf(
-                Len, x, offset=8*OffBy+OffBi)[0])
-            DP['DT'] = pd.to_datetime(
-                DP['GROUND_REFERENCE_TIME'], format='%d/%m/%Y %H:%M:%S.%f')
             DRS = DRS.append(DP, ignore_index=True)
 
-        # Rover HK Thermistors Only contained within low speed HK
-        DK = DT.loc[DT['NAME'] == name_rov_ls].copy()
         if not DK.empty:
-            DW = DK.RAW_DATA.apply(lambda x: x[2:])
-            DW = DW.apply(lambda x: bytearray.fromhex(x))
-            DK['DT'] = pd.to_datetime(
-                DK['GROUND_REFERENCE_TIME'], format='%d/%m/%Y %H:%M:%S.%f')
-
-            # Get first entry and determine if to use old or new cal
-            dtime0 = DK['DT'].iloc[0]
-            # If after Feb 2020 use new Cal
-            if dtime0 < datetime(2020, 2, 1):
-                logger.info("Using old thermistor calibration")
-                piu_loc = (511, 3, 'u13')
-                dcdc_loc = (559, 3, 'u13')
-            else:
-                logger.info("Using new thermistor calibration")
-                piu_loc = (508, 3, 's13')
-                dcdc_loc = (556, 3, 's13')
-
-            # PIU Temp
-            (OffBy, OffBi, Len) = piu_loc
-            DK['RAW_PIU_T'] = DW.apply(
-                lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
-            # Calculated from thermistor curve provided
-            DK['PIU_T'] = DK['RAW_PIU_T']*0.18640 - 259.84097
-            # DCDC Temp
-            OffBy, OffBi, Len = dcdc_loc
-            DK['RAW_DCDC_T'] = DW.apply(
-                lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
-            # Calculated from thermistor curve provided
-            DK['DCDC_T'] = DK['RAW_DCDC_T']*0.18640 - 259.84097
-
             DRT = DRT.append(DK, ignore_index=True)
 
     if (DF_es_entries > 0):
@@ -158,7 +100,102 @@ def TM_extract(ROV_DIR):
     return True
 
 
-def TC_extract(ROV_DIR):
+def tm_read(file):
+    """Reads a single STDRawOcds.csv file.
+
+    Arguments:
+        file {Path} -- STDRawOcds.csv file to read.
+
+    Returns:
+        int -- Number of PanCam HK Ess entries.
+        int -- Number of PanCam HK NonE entries.
+        pd.DataFrame -- PanCam HK with RAW and DT columns.
+        pd.DataFrame -- Rover status entries.
+        pd.DataFrame -- Rover temperature entries.
+    """
+
+    DT = pd.read_csv(file, sep=';', header=0, index_col=False)
+
+    # Search for PanCam housekeeping
+    es_entries = DT[DT['NAME'] == name_hk_es].shape[0]
+    ne_entries = DT[DT['NAME'] == name_hk_ne].shape[0]
+
+    DL = DT[(DT['NAME'] == name_hk_es) | (
+        DT['NAME'] == name_hk_ne)].copy()
+    if not DL.empty:
+        DL['RAW'] = DL.RAW_DATA.apply(lambda x: x[38: -4])
+        DL['DT'] = pd.to_datetime(
+            DL['GROUND_REFERENCE_TIME'], format='%d/%m/%Y %H:%M:%S.%f')
+
+    # Rover HK both low and high speed
+    DP = DT[(DT['NAME'] == name_rov_ls) | (
+        DT['NAME'] == name_rov_hs)].copy()
+    if not DP.empty:
+        DG = DP.RAW_DATA.apply(lambda x: x[2:])
+        DG = DG.apply(lambda x: bytearray.fromhex(x))
+        # PanCam Current
+        OffBy, OffBi, Len = 85, 4, 'u12'
+        DP['RAW_Inst_Curr'] = DG.apply(
+            lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
+        DP['Inst_Curr'] = DP['RAW_Inst_Curr'] * 1.1111/4095
+        # PanCam Heater
+        OffBy, OffBi, Len = 57, 4, 'u12'
+        DP['RAW_HTR_Curr'] = DG.apply(
+            lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
+        DP['HTR_Curr'] = DP['RAW_HTR_Curr'] * 1.1111/4095
+        # PanCam Heater Status
+        OffBy, OffBi, Len = 51, 2, 'u1'
+        DP['HTR_ST'] = DG.apply(lambda x: upf(
+            Len, x, offset=8*OffBy+OffBi)[0])
+        # PanCam Power Status
+        OffBy, OffBi, Len = 77, 1, 'u1'
+        DP['PWR_ST'] = DG.apply(lambda x: upf(
+            Len, x, offset=8*OffBy+OffBi)[0])
+        DP['DT'] = pd.to_datetime(
+            DP['GROUND_REFERENCE_TIME'], format='%d/%m/%Y %H:%M:%S.%f')
+
+    # Rover HK Thermistors Only contained within low speed HK
+    DK = DT.loc[DT['NAME'] == name_rov_ls].copy()
+    if not DK.empty:
+        DW = DK.RAW_DATA.apply(lambda x: x[2:])
+        DW = DW.apply(lambda x: bytearray.fromhex(x))
+        DK['DT'] = pd.to_datetime(
+            DK['GROUND_REFERENCE_TIME'], format='%d/%m/%Y %H:%M:%S.%f')
+
+        # Get first entry and determine if to use old or new cal
+        dtime0 = DK['DT'].iloc[0]
+        # If after Feb 2020 use new Cal
+        if dtime0 < datetime(2020, 2, 1):
+            logger.info("Using old thermistor calibration")
+            piu_loc = (511, 3, 'u13')
+            dcdc_loc = (559, 3, 'u13')
+        else:
+            logger.info("Using new thermistor calibration")
+            piu_loc = (508, 3, 's13')
+            dcdc_loc = (556, 3, 's13')
+
+        # PIU Temp
+        (OffBy, OffBi, Len) = piu_loc
+        DK['RAW_PIU_T'] = DW.apply(
+            lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
+        # Calculated from thermistor curve provided
+        DK['PIU_T'] = DK['RAW_PIU_T']*0.18640 - 259.84097
+        # DCDC Temp
+        OffBy, OffBi, Len = dcdc_loc
+        DK['RAW_DCDC_T'] = DW.apply(
+            lambda x: upf(Len, x, offset=8*OffBy+OffBi)[0])
+        # Calculated from thermistor curve provided
+        DK['DCDC_T'] = DK['RAW_DCDC_T']*0.18640 - 259.84097
+
+    return es_entries, ne_entries, DL, DP, DK
+
+
+def TC_extract(ROV_DIR, cache=None):
+    """Searches for Rover TC files and creates a pickle of the PanCam TCs
+
+    Keyword Arguments:
+        cache {dict} -- Files already read, only new or changed files are read (default: {None})
+    """
 
     logger.info("Processing Rover TC Files")
     TC = pd.DataFrame()
@@ -172,8 +209,10 @@ def TC_extract(ROV_DIR):
     # Read CSV file and parse
     for file in TCfiles:
         logger.info("Reading %s", file.name)
-        dt = pd.read_csv(file, sep=';', encoding="ISO-8859-1",
-                         header=0, dtype=object, index_col=False)
+        dt = pancam_fns.cached_read(
+            file, lambda f: pd.read_csv(f, sep=';', encoding="ISO-8859-1",
+                                        header=0, dtype=object, index_col=False),
+            cache)
 
         dp = dt[dt['DESCRIPTION'].str.contains(
             "Pan Cam", na=False) & dt['NAME'].str.contains("CRM", na=False)].copy()
@@ -197,20 +236,33 @@ def TC_extract(ROV_DIR):
     logger.info("Processing Rover TC Files Completed")
 
 
-def NavCamBrowse(ROV_DIR):
-    """Searches for PGM files and creates an 8-bit .png to browse"""
+def NavCamBrowse(ROV_DIR, workers=None, force=False):
+    """Searches for PGM files and creates an 8-bit .png to browse
+
+    Files with a .png newer than the .pgm are skipped unless force is True.
+    The conversions share the image_browse process pool.
+    """
 
     logger.info("Searching for NavCam .pgm files to generate browse")
     PGM_Files = pancam_fns.Find_Files(ROV_DIR, "*.pgm")
 
-    for curFile in PGM_Files:
-        image = imageio.imread(curFile)
-        write_file = curFile.with_suffix(".png")
+    jobs = [(pgm_browse, curFile) for curFile in PGM_Files
+            if force or not image_browse.is_newer(
+                [curFile.with_suffix(".png")], [curFile])]
+
+    image_browse.browse_pool(jobs, len(PGM_Files), workers)
+
+
+def pgm_browse(curFile):
+    """Creates an 8-bit .png next to a NavCam .pgm file"""
+
+    image = imageio.imread(curFile)
+    write_file = curFile.with_suffix(".png")
 
-        # Check if file exists
-        pancam_fns.exist_unlink(write_file)
-        logger.info("Creating file: %s", write_file.name)
-        imageio.imwrite(write_file, image)
+    # Check if file exists
+    pancam_fns.exist_unlink(write_file)
+    logger.info("Creating file: %s", write_file.name)
+    imageio.imwrite(write_file, image)
 
 
 def type(ROV_DIR):
@@ -13,37 +13,64 @@ import pandas as pd
 import json
 from collections import namedtuple
 import binascii  # Used if wanting to output ascii to terminal
-import math
 import bitstruct
+import bisect
+import io
+import tempfile
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import logging
+import logging.handlers
+import multiprocessing
+import os
 
 import pancam_fns
+import pci_raw
+import ha_index
+from ha_index import HaReadError
 
 logger = logging.getLogger(__name__)
 status = logging.getLogger('status')
 
 # Global parameters
 ProcInfo = {'HaImageProcVer': 0.7}
-Found_IDS = {}
-Buffer = {}
-EndBuffer = {}
 LDT_IDs = ["AB.TM.MRSS0697",
            "AB.TM.MRSS0698",
            "AB.TM.MRSS0699"]
 RMSW_VER = 2.0
-
-
-class HaReadError(Exception):
-    """error for unexpected things"""
-    pass
+MAX_BUFFER_BYTES = 256 * 1024 * 1024
+CHECKPOINT_FILE = 'HaScan.checkpoint'
+CHECKPOINT_VER = 3
+CHECKPOINT_INTERVAL = 60
+CHECKPOINT_MIN_INTERVAL = 5
+SPILL_FILE = 'HaScan.spill'
+
+# Structure of the HK Essential and Non-Essential packets written by HaScan
+HKES_DTYPE = np.dtype([('Pkt_Hdr', 'u1', (2,)),
+                       ('Pkt_CUC', 'u1', (6,)),
+                       ('Data', 'u1', (64,))])
+HKNE_DTYPE = np.dtype([('Pkt_Hdr', 'u1', (2,)),
+                       ('Pkt_CUC', 'u1', (6,)),
+                       ('Data', 'u1', (80,))])
+
+# Compact record of a LDT part found by a parallel .ha scan
+#   Part    -- 0 first, 1 intermediate or 2 end part
+#   Header  -- first 30 bytes of a first part for LDT_Properties, else None
+#   Offset  -- byte offset of the payload within the scan spool file
+#   Length  -- payload length in bytes
+#   Ha_Offset -- byte offset of the packet within the .ha file
+LdtPart = namedtuple(
+    'LdtPart', ['Part', 'Unit_ID', 'SEQ_No', 'Header', 'Offset', 'Length',
+                'Ha_Offset'])
 
 
 class LDT_Properties(object):
     """Creates a LDT class for tracking those found"""
 
-    def __init__(self, PKT_Bin):
+    def __init__(self, PKT_Bin, rmsw_ver=RMSW_VER):
         unpacked = bitstruct.unpack('u16u16u8u16u32u8u8', PKT_Bin[16:30])
         self.Unit_ID = unpacked[0]
         self.SEQ_No = unpacked[1]
@@ -78,8 +105,9 @@ class LDT_Properties(object):
         self.writtenLen = 0
         self.write_completed = False
         self.write_occurance = 0
+        self.rmsw_ver = rmsw_ver
 
-    def setWriteFile(self, DIR, pkt_HD):
+    def setWriteFile(self, DIR):
         if self.PanCam:
             # Create filename
             write_filename = "PanCam_" \
@@ -126,24 +154,20 @@ class LDT_Properties(object):
 
     def verifyImg(self):
 
-        global RMSW_VER
-
         # Newer software has an extra 16bytes to account for image compression structure
-        if RMSW_VER > 3:
-            raw_img_sze = 2097200 + 14
+        if self.rmsw_ver > 3:
+            raw_img_sze = pci_raw.IMG_BYTES + 14
         else:
-            raw_img_sze = 2097200
+            raw_img_sze = pci_raw.IMG_BYTES
 
         # Check written equals expected and rename file
         if self.writtenLen == raw_img_sze:
             logger.info("Restructuring to .pci_raw format")
             newFile = self.write_file.with_suffix(".pci_raw")
             pancam_fns.exist_unlink(newFile)
-            with open(self.write_file, 'rb') as in_file:
-                with open(newFile, 'wb') as out_file:
-                    out_file.write(
-                        in_file.read()[:2097200])
-            self.write_file.unlink()
+            # Drop any trailing compression structure in place
+            os.truncate(self.write_file, pci_raw.IMG_BYTES)
+            self.write_file.rename(newFile)
             self.write_file = newFile
 
         else:
@@ -176,7 +200,8 @@ class LDT_Properties(object):
 
         # Write LDT properties to a json file
         JSON_file = self.write_file.with_suffix(".json")
-        TopLevDic = {"Processing Info": ProcInfo,
+        TopLevDic = {"Processing Info": {**ProcInfo,
+                                         'RMSW Version': self.rmsw_ver},
                      "LDT Information": LDTSource}
         pancam_fns.exist_unlink(JSON_file)
         with open(JSON_file, 'w') as f:
@@ -227,15 +252,11 @@ class LDT_Properties(object):
 
             logger.info('Creating pgm file: %s', name_new)
             pgm_hdr = bytes('P5\n1024 1024 255\n', 'utf8')
-            src = open(self.write_file, 'rb')
-            src.read(68)
 
-            # Write file to NavCam
+            # Write file to NavCam, skipping the 68 byte LDT header
             with open(file_targ, 'wb') as f:
                 f.write(pgm_hdr)
-                f.write(src.read())
-
-            src.close()
+                pancam_fns.copy_range(self.write_file, f, offset=68)
 
     def setOccurance(self, occurance):
         self.write_occurance = occurance
@@ -259,13 +280,536 @@ class LDT_End:
         self.SEQ_No = unpacked[1]
 
 
-def HaScan(ROV_DIR):
+class LdtPartBuffer(object):
+    """Out of sequence LDT intermediate parts waiting to be written.
+
+    Sequence numbers are held in a sorted list per unit ID so finding and
+    draining the next expected run of parts is a bisect rather than a probe
+    per part. Payloads are held in memory up to max_bytes, after which they
+    are spilled to a file until required.
+
+    The state saved for a checkpoint is the offset of each part within the
+    spill file, so only parts held in memory and not yet saved are written.
+
+    Arguments:
+        max_bytes {int} -- Memory cap for buffered payloads.
+
+    Keyword Arguments:
+        spill_file {Path} -- File to spill to, None for a temporary file (default: {None})
+    """
+
+    def __init__(self, max_bytes=MAX_BUFFER_BYTES, spill_file=None):
+        self.max_bytes = max_bytes
+        self.spill_file = spill_file
+        self._seqs = {}
+        self._parts = {}
+        self._saved = {}
+        self._mem = 0
+        self._over = False
+        self._spill = None
+
+    def __len__(self):
+        return len(self._parts)
+
+    def keys(self):
+        """Returns the (Unit_ID, SEQ_No) of all buffered parts"""
+        return list(self._parts)
+
+    def add(self, unit_id, seq_no, data):
+        key = (unit_id, seq_no)
+        if key in self._parts:
+            self._release(self._parts[key])
+            self._saved.pop(key, None)
+        else:
+            bisect.insort(self._seqs.setdefault(unit_id, []), seq_no)
+
+        if self._mem + len(data) > self.max_bytes:
+            if not self._over:
+                logger.warning("LDT buffer above %d bytes, spilling to disk",
+                               self.max_bytes)
+                self._over = True
+            self._parts[key] = self._spill_write(data)
+        else:
+            self._parts[key] = data
+            self._mem += len(data)
+
+    def get_state(self):
+        """Returns the spill file offset and length of every part.
+
+        Parts in memory not already in the spill file are appended to it,
+        they are kept in memory as well. Once the buffer is empty the spill
+        file is emptied.
+        """
+
+        if not self._parts:
+            self._saved = {}
+            if self._spill is not None:
+                self._spill.truncate(0)
+            return {'Parts': {}, 'Spill_Bytes': 0}
+
+        parts = {}
+        for key, entry in self._parts.items():
+            if isinstance(entry, tuple):
+                parts[key] = entry
+            else:
+                if key not in self._saved:
+                    self._saved[key] = self._spill_write(entry)
+                parts[key] = self._saved[key]
+
+        self._spill.flush()
+        self._spill.seek(0, io.SEEK_END)
+        return {'Parts': parts, 'Spill_Bytes': self._spill.tell()}
+
+    def set_state(self, state):
+        """Restores the parts from get_state, all are left in the spill file"""
+
+        self._seqs = {}
+        self._parts = dict(state['Parts'])
+        self._saved = {}
+        self._mem = 0
+        for unit_id, seq_no in sorted(self._parts):
+            self._seqs.setdefault(unit_id, []).append(seq_no)
+
+        if self._parts:
+            self._spill_open(truncate=False)
+            # Drop anything written after the checkpoint was taken
+            self._spill.truncate(state['Spill_Bytes'])
+
+    def pop_run(self, unit_id, seq_no):
+        """Removes and returns the consecutive parts starting at seq_no"""
+        seqs = self._seqs.get(unit_id)
+        if not seqs:
+            return []
+
+        start = bisect.bisect_left(seqs, seq_no)
+        end = start
+        while (end < len(seqs)) and (seqs[end] == seq_no + end - start):
+            end += 1
+
+        run = []
+        for seq in seqs[start:end]:
+            entry = self._parts.pop((unit_id, seq))
+            run.append(self._read(entry))
+            self._release(entry)
+            self._saved.pop((unit_id, seq), None)
+        del seqs[start:end]
+
+        if not seqs:
+            del self._seqs[unit_id]
+        return run
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _spill_open(self, truncate=True):
+        if self._spill is not None:
+            return
+        if self.spill_file is None:
+            self._spill = tempfile.TemporaryFile()
+        elif truncate or not self.spill_file.exists():
+            self._spill = open(self.spill_file, 'w+b')
+        else:
+            self._spill = open(self.spill_file, 'r+b')
+
+    def _spill_write(self, data):
+        self._spill_open()
+        self._spill.seek(0, io.SEEK_END)
+        offset = self._spill.tell()
+        self._spill.write(data)
+        return (offset, len(data))
+
+    def _read(self, entry):
+        if isinstance(entry, tuple):
+            self._spill.seek(entry[0])
+            return self._spill.read(entry[1])
+        return entry
+
+    def _release(self, entry):
+        if not isinstance(entry, tuple):
+            self._mem -= len(entry)
+
+
+class LdtReassembler(object):
+    """Rebuilds LDT files from the parts found within Rover .ha files.
+
+    All state for a scan is held within the object so independent scans can
+    be run within the same process.
+
+    Arguments:
+        dir_proc {Path} -- PROC directory where the LDT files are written.
+        pool {pancam_fns.WriterPool} -- Pool used to write the LDT files.
+
+    Keyword Arguments:
+        rmsw_ver {float} -- Rover module software version (default: {RMSW_VER})
+        max_buffer {int} -- Memory cap for out of sequence parts (default: {MAX_BUFFER_BYTES})
+    """
+
+    def __init__(self, dir_proc, pool, rmsw_ver=RMSW_VER,
+                 max_buffer=MAX_BUFFER_BYTES):
+        self.dir_proc = dir_proc
+        self.pool = pool
+        self.rmsw_ver = rmsw_ver
+        self.found_ids = {}
+        self.buffer = LdtPartBuffer(max_buffer, dir_proc / SPILL_FILE)
+        self.end_buffer = set()
+        self.completed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+
+    def get_state(self):
+        """Returns the reassembly state as a picklable dictionary"""
+        return {'Found_IDS': self.found_ids,
+                'Buffer': self.buffer.get_state(),
+                'EndBuffer': self.end_buffer,
+                'Completed': self.completed}
+
+    def set_state(self, state):
+        """Restores the state from get_state of a previous scan.
+
+        Files still being written are truncated back to the length recorded
+        in the state so they can be appended to again.
+        """
+
+        self.found_ids = state['Found_IDS']
+        self.end_buffer = state['EndBuffer']
+        self.completed = state['Completed']
+        self.buffer.set_state(state['Buffer'])
+
+        for Cur_LDT in self.found_ids.values():
+            if (not Cur_LDT.write) or Cur_LDT.write_completed:
+                continue
+
+            if Cur_LDT.write_file.exists():
+                os.truncate(Cur_LDT.write_file, Cur_LDT.writtenLen)
+            else:
+                # Completed after the checkpoint was taken
+                logger.warning("LDT file no longer partial, not resuming: %s",
+                               Cur_LDT.write_file.name)
+                Cur_LDT.write = False
+
+    def add_packet(self, PKT_ID, PKT_Bin):
+        """Decodes a LDT packet and writes or buffers its contents"""
+
+        # First LDT Part
+        if PKT_ID == LDT_IDs[0]:
+            self.add_first(LDT_Properties(PKT_Bin, self.rmsw_ver),
+                           PKT_Bin[29:-2])
+
+        # Second LDT Part
+        elif PKT_ID == LDT_IDs[1]:
+            IntP = LDT_Intermediate(PKT_Bin)
+            self.add_intermediate(IntP.Unit_ID, IntP.SEQ_No, PKT_Bin[20:-2])
+
+        elif PKT_ID == LDT_IDs[2]:
+            EndP = LDT_End(PKT_Bin)
+            self.add_end(EndP.Unit_ID, EndP.SEQ_No)
+
+    def add_first(self, LDT_Cur_Pkt, Data):
+        if LDT_Cur_Pkt.PanCam:
+            log_message = 'New PanCam LDT part'
+
+        else:
+            log_message = '----Other LDT part'
+
+        logger.info(log_message + ' found with file ID: %s, and unitID %s',
+                    LDT_Cur_Pkt.FILE_ID, LDT_Cur_Pkt.Unit_ID)
+
+        # If write is True, check to see if ID already exists
+        if LDT_Cur_Pkt.write and (LDT_Cur_Pkt.Unit_ID in self.found_ids):
+            status.info(
+                "Multiple initial packets with the same ID found.")
+            prev_ldt = self.found_ids.get(LDT_Cur_Pkt.Unit_ID)
+            LDT_Cur_Pkt.setOccurance(prev_ldt.write_occurance + 1)
+
+            # Check to see if previous ID was not already completed
+            if not prev_ldt.write_completed:
+                logger.error(
+                    "Previous FileID not completed, now adding to second FileID")
+
+        # Write packet contents to file
+        if LDT_Cur_Pkt.write:
+            LDT_Cur_Pkt.setWriteFile(self.dir_proc)
+            self.write_bytes(LDT_Cur_Pkt, Data)
+
+        self.found_ids.update({LDT_Cur_Pkt.Unit_ID: LDT_Cur_Pkt})
+
+    def add_intermediate(self, Unit_ID, SEQ_No, Data):
+        # Check to see if Unit ID already started if not add to buffer
+        if Unit_ID not in self.found_ids:
+            logger.info("New Packet without first part - adding to buffer")
+            self.buffer.add(Unit_ID, SEQ_No, Data)
+            return
+
+        Cur_LDT = self.found_ids.get(Unit_ID)
+
+        # Check file should be written
+        if not Cur_LDT.write:
+            return
+
+        # Verify SEQ number is as expected
+        if SEQ_No == Cur_LDT.SEQ_No + 1:
+            self.write_bytes(Cur_LDT, Data)
+            Cur_LDT.SEQ_No += 1
+
+        # Else add to buffer and try to rebuild
+        else:
+            logger.warning("LDT parts not sequential")
+            logger.warning("Expected: %d", Cur_LDT.SEQ_No + 1)
+            logger.warning("Got: %d", SEQ_No)
+            self.buffer.add(Unit_ID, SEQ_No, Data)
+            logger.warning("Added LDT part to buffer: %d", SEQ_No)
+            self.check_buffers(Cur_LDT)
+
+    def add_end(self, Unit_ID, SEQ_No):
+        # Check end of file and rename properly
+        logger.info("End Packet Received with unitID: %d", Unit_ID)
+
+        # Check to see if Unit ID already started if not add to buffer
+        if Unit_ID not in self.found_ids:
+            logger.error("End Packet without first part - adding to EndBuffer")
+            self.end_buffer.add((Unit_ID, SEQ_No))
+            return
+
+        Cur_LDT = self.found_ids.get(Unit_ID)
+
+        # Check file should be written
+        if not Cur_LDT.write:
+            return
+
+        # Verify SEQ number is as expected
+        if SEQ_No == Cur_LDT.SEQ_No + 1:
+            Cur_LDT.SEQ_No += 1
+            self.complete(Cur_LDT)
+
+        else:
+            logger.warning("END LDT not sequential")
+            logger.warning("Expected: %d", Cur_LDT.SEQ_No + 1)
+            logger.warning("Got: %d", SEQ_No)
+            self.end_buffer.add((Unit_ID, SEQ_No))
+            logger.warning(
+                "Added End part to buffer: %d, %d", Unit_ID, SEQ_No)
+            self.check_buffers(Cur_LDT)
+
+    def check_buffers(self, Cur_LDT):
+        """Checks the LDT part buffer and end buffer to add parts already found out of sequence"""
+
+        # First partial buffer
+        # Write the run of parts that follow on from those already written
+        for Data in self.buffer.pop_run(Cur_LDT.Unit_ID, Cur_LDT.SEQ_No + 1):
+            self.write_bytes(Cur_LDT, Data)
+            Cur_LDT.SEQ_No += 1
+            logger.warning("Wrote LDT part from buffer: %d", Cur_LDT.SEQ_No)
+
+        # Then End Buffer
+        # Determine if the end packet has been found
+        Expected_SEQ = (Cur_LDT.Unit_ID, Cur_LDT.SEQ_No + 1)
+        if Expected_SEQ in self.end_buffer:
+            logger.warning("End LDT now fits: %d", Expected_SEQ[1])
+            Cur_LDT.SEQ_No += 1
+            self.complete(Cur_LDT)
+            self.end_buffer.remove(Expected_SEQ)
+
+    def write_bytes(self, Cur_LDT, Data):
+        """Writes data to the LDT file"""
+        self.pool.write(Cur_LDT.write_file, Data)
+        Cur_LDT.writtenLen += len(Data)
+
+    def complete(self, Cur_LDT):
+        # File must be flushed and closed before being renamed
+        self.pool.close(Cur_LDT.write_file)
+        Cur_LDT.complete_file()
+        self.completed += 1
+
+    def finish(self):
+        """Final buffer check once all packets have been added"""
+
+        # Merge buffers
+        FinalBuf = self.buffer.keys() + list(self.end_buffer)
+        if len(FinalBuf) > 0:
+            logger.error("Items remaining in buffers")
+            for item in FinalBuf:
+                logger.info(item)
+                if item[0] in self.found_ids:
+                    self.check_buffers(self.found_ids.get(item[0]))
+                else:
+                    logger.error(
+                        "Initial LDT part not found for UnitID: %d", item[0])
+
+        remaining = len(self.buffer) + len(self.end_buffer)
+        if remaining > 0:
+            logger.info("Still %d items in buffer", remaining)
+        else:
+            logger.info("LDT Buffer Empty")
+            status.info("LDT Buffer Now Empty")
+
+        if len(self.found_ids) > 0:
+            msg = (f"Found the following PanCam LDT files: \n")
+            for _, value in self.found_ids.items():
+                msg += f"\t\t{value.FILE_ID}\n"
+            status.info(msg)
+
+
+class HaCheckpoint(object):
+    """Periodically saves the progress of a HaScan so it can be resumed.
+
+    The checkpoint holds the reassembler state along with the file being
+    processed and the offset of the last packet processed within it. It is
+    saved at the end of each .ha file, when an LDT file has been completed
+    and at least min_interval seconds have passed, and otherwise every
+    interval seconds. Buffered parts are held in the spill file next to it. The files before it must be
+    unchanged for the checkpoint to be used, the file itself may have grown.
+
+    Arguments:
+        dir_proc {Path} -- PROC directory where the checkpoint is stored.
+        ha_files {list} -- .ha files in processing order.
+        rmsw_ver {float} -- Rover module software version of the scan.
+
+    Keyword Arguments:
+        interval {float} -- Seconds between periodic saves (default: {CHECKPOINT_INTERVAL})
+        min_interval {float} -- Minimum seconds between saves for completed files (default: {CHECKPOINT_MIN_INTERVAL})
+    """
+
+    def __init__(self, dir_proc, ha_files, rmsw_ver, interval=CHECKPOINT_INTERVAL,
+                 min_interval=CHECKPOINT_MIN_INTERVAL):
+        self.file = dir_proc / CHECKPOINT_FILE
+        self.spill_file = dir_proc / SPILL_FILE
+        self.ha_files = ha_files
+        self.rmsw_ver = rmsw_ver
+        self.interval = interval
+        self.min_interval = min_interval
+        self._saved = time.monotonic()
+        self._completed = 0
+        self.position = (0, -1)
+
+    def load(self, ldt):
+        """Restores the state of ldt from the checkpoint if valid.
+
+        Returns:
+            tuple -- Index of the file to start from and the offset of the last
+                     packet already processed within it.
+        """
+
+        if not self.file.exists():
+            return 0, -1
+
+        try:
+            with open(self.file, 'rb') as f:
+                chk = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.error("Unable to read HaScan checkpoint, starting again")
+            return 0, -1
+
+        if (chk.get('Checkpoint Version') != CHECKPOINT_VER) \
+                or (chk['RMSW Ver'] != self.rmsw_ver) \
+                or (chk['Files'] != self._fingerprint(chk['File_No'])) \
+                or not self._current_valid(chk['File_No'], chk['Current']):
+            logger.warning(".ha files changed since checkpoint, starting again")
+            return 0, -1
+
+        spill_bytes = chk['Reassembler']['Buffer']['Spill_Bytes']
+        if spill_bytes and ((not self.spill_file.exists())
+                            or self.spill_file.stat().st_size < spill_bytes):
+            logger.warning("HaScan spill file incomplete, starting again")
+            return 0, -1
+
+        status.info("Resuming HaScan from %d of %d .ha files",
+                    chk['File_No'], len(self.ha_files))
+        ldt.set_state(chk['Reassembler'])
+        self._completed = ldt.completed
+        self.position = (chk['File_No'], chk['Offset'])
+        return self.position
+
+    def update(self, ldt, file_no, offset, force=False):
+        """Saves the checkpoint if forced, a file completed or interval passed"""
+
+        self.position = (file_no, offset)
+        elapsed = time.monotonic() - self._saved
+        if not (force
+                or ((ldt.completed != self._completed) and (elapsed > self.min_interval))
+                or (elapsed > self.interval)):
+            return
+
+        # Files on disk must match the written lengths held in the state
+        ldt.pool.flush()
+
+        chk = {'Checkpoint Version': CHECKPOINT_VER,
+               'RMSW Ver': self.rmsw_ver,
+               'Files': self._fingerprint(file_no),
+               'Current': self._current(file_no, offset),
+               'File_No': file_no,
+               'Offset': offset,
+               'Reassembler': ldt.get_state()}
+
+        tmp_file = self.file.with_suffix('.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(chk, f)
+        os.replace(tmp_file, self.file)
+
+        self._saved = time.monotonic()
+        self._completed = ldt.completed
+
+    def clear(self):
+        pancam_fns.exist_unlink(self.file)
+        pancam_fns.exist_unlink(self.spill_file)
+
+    def _fingerprint(self, file_no):
+        """Name, size and mtime of the .ha files before file_no"""
+        finger = []
+        for curfile in self.ha_files[:file_no]:
+            stat = curfile.stat()
+            finger.append((curfile.name, stat.st_size, stat.st_mtime_ns))
+        return finger
+
+    def _current(self, file_no, offset):
+        """Name and size of file_no if any of it has been processed"""
+        if offset == -1 or file_no >= len(self.ha_files):
+            return None
+        curfile = self.ha_files[file_no]
+        return (curfile.name, curfile.stat().st_size)
+
+    def _current_valid(self, file_no, current):
+        """Returns True if file_no is the same file, unchanged or appended to"""
+        if current is None:
+            return True
+        if file_no >= len(self.ha_files):
+            return False
+        curfile = self.ha_files[file_no]
+        return (curfile.name == current[0]) \
+            and (curfile.stat().st_size >= current[1])
+
+
+def HaScan(ROV_DIR, max_buffer=MAX_BUFFER_BYTES, workers=None, resume=True,
+           live=False):
     """Searches for .ha Rover files and creates raw binary files
-    for each image found"""
-    logger.info("Processing Rover .ha Files")
+    for each image found.
+
+    With more than one worker the .ha files are first scanned for LDT parts
+    in a process pool, then the parts are reassembled in file order so the
+    output is identical to a serial scan.
+
+    In live mode the checkpoint is kept once the scan completes, so the next
+    scan continues from the last packet processed. Only new or appended .ha
+    data is then read and only images completed by it are written.
 
-    global Found_IDS
-    global RMSW_VER
+    Arguments:
+        ROV_DIR {Path} -- Directory containing the Rover .ha files.
+
+    Keyword Arguments:
+        max_buffer {int} -- Memory cap for out of sequence LDT parts (default: {MAX_BUFFER_BYTES})
+        workers {int} -- Number of scan processes, None for the CPU count (default: {None})
+        resume {bool} -- Resume from the checkpoint of an unfinished scan (default: {True})
+        live {bool} -- Keep the checkpoint for a later scan of more data (default: {False})
+    """
+    logger.info("Processing Rover .ha Files")
 
     # Find Files
     ROVER_HA = pancam_fns.Find_Files(ROV_DIR, "*.ha")
@@ -273,20 +817,22 @@ def HaScan(ROV_DIR):
         logger.error("No files found - ABORTING")
         return
 
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(ROVER_HA))
+
     # Determine RMSW Version
+    rmsw_ver = RMSW_VER
     config_files = pancam_fns.Find_Files(
         ROV_DIR, "config.json", SingleFile=True)
     if not config_files:
         logger.error(
-            f"No config.json file found. Assuming RMSW Version is {RMSW_VER}")
+            f"No config.json file found. Assuming RMSW Version is {rmsw_ver}")
     else:
         with open(config_files[0], 'r') as curfile:
             config = json.load(curfile)
-            RMSW_VER = config['Source Details']['RMSW Ver']
-            status.info(f"Using structure for RMSW_Ver {RMSW_VER}")
-
-    # Update Processing info
-    ProcInfo.update({'RMSW Version': RMSW_VER})
+            rmsw_ver = config['Source Details']['RMSW Ver']
+            status.info(f"Using structure for RMSW_Ver {rmsw_ver}")
 
     # Create directories
     dir_proc = ROV_DIR / "PROC"
@@ -309,64 +855,45 @@ def HaScan(ROV_DIR):
         logger.info("Generating 'NAVCAM' directory")
         dir_nav.mkdir()
 
-    # Search through .ha files
-    PKT_HD = [None] * 4
-
-    for file in ROVER_HA:
-        with open(file, 'r') as curFile:
-            logger.info("Reading %s", file.name)
-            # Read ha header and perform basic check
-            HA_HEADER = [next(curFile) for x in range(5)]
-            if HA_HEADER[4] != "<BEGIN_DATA_BLOCK>\n":
-                raise HaReadError("<BEGIN_DATA_BLOCK>: Line not found")
-
-            # Read first packet header and determine packet type
-            PKT_HD[0] = next(curFile)
-            while PKT_HD[0] != "<END_DATA_BLOCK>\n":
-                PKT_HD[1:3] = [next(curFile) for x in range(3)]
-
-                if PKT_HD[3][0:8] != "<LENGTH>":
-                    raise HaReadError("<LENGTH>: Line not found")
-
-                # Look for LDT Packets
-                PKT_ID = PKT_HD[2][12:-1]
-                # Determine number of lines in data entry
-                PKT_LINES = math.ceil(pkt_Len(PKT_HD)/32)
-                if PKT_ID in LDT_IDs:
-                    # Read ha file using repeating pattern a packet head is 4 lines
-                    HaPacketDecode(PKT_HD, PKT_ID, PKT_LINES,
-                                   curFile, dir_proc)
-                else:
-                    for _ in range(PKT_LINES):
-                        next(curFile)
-
-                PKT_HD[0] = next(curFile)
-
-    # Final buffer check
-    # Merge buffers
-    FinalBuf = {**Buffer, **EndBuffer}
-    if len(FinalBuf) > 0:
-        logger.error("Items remaining in buffers")
-        for item in FinalBuf:
-            logger.info(item)
-            if item[0] in Found_IDS:
-                Cur_LDT = Found_IDS.get(item[0])
-                checkBuffers(Cur_LDT)
-            else:
-                logger.error(
-                    "Initial LDT part not found for UnitID: %d", item[0])
+    checkpoint = HaCheckpoint(dir_proc, ROVER_HA, rmsw_ver)
 
-    if len(Buffer) + len(EndBuffer) > 0:
-        logger.info("Still %d items in buffer", len(Buffer)+len(EndBuffer))
-    else:
-        logger.info("LDT Buffer Empty")
-        status.info("LDT Buffer Now Empty")
+    with pancam_fns.WriterPool() as pool, \
+            LdtReassembler(dir_proc, pool, rmsw_ver, max_buffer) as ldt:
+        if resume:
+            start_file, start_offset = checkpoint.load(ldt)
+        else:
+            start_file, start_offset = 0, -1
+
+        if workers > 1:
+            logger.info("Scanning .ha files with %d processes", workers)
+            ha_parallel(ldt, ROVER_HA, workers,
+                        checkpoint, start_file, start_offset)
+        else:
+            # Search through .ha files using the packet index
+            for file_no, file in enumerate(ROVER_HA):
+                if file_no < start_file:
+                    continue
 
-    if len(Found_IDS) > 0:
-        msg = (f"Found the following PanCam LDT files: \n")
-        for _, value in Found_IDS.items():
-            msg += f"\t\t{value.FILE_ID}\n"
-        status.info(msg)
+                logger.info("Reading %s", file.name)
+                offset = start_offset if file_no == start_file else -1
+                with ha_index.HaIndex(file, index_dir=dir_proc) as idx:
+                    for pkt in idx.select(LDT_IDs):
+                        if pkt.Offset <= offset:
+                            continue
+                        ldt.add_packet(pkt.PKT_ID, idx.read(pkt))
+                        offset = pkt.Offset
+                        checkpoint.update(ldt, file_no, offset)
+
+                checkpoint.update(ldt, file_no, offset, force=True)
+
+        # Final buffer check
+        ldt.finish()
+
+        if live:
+            checkpoint.update(ldt, *checkpoint.position, force=True)
+
+    if not live:
+        checkpoint.clear()
 
     # Clean up directories if empty
     if not (any(IMG_RAW_DIR.iterdir())):
@@ -384,262 +911,363 @@ def HaScan(ROV_DIR):
     logger.info("Processing Rover .ha Files - Completed")
 
 
-def HaPacketDecode(PKT_HD, PKT_ID, PKT_LINES, curFile, dir_proc):
-    """Decodes the first packet"""
+def ha_parallel(ldt, ha_files, workers, checkpoint=None,
+                start_file=0, start_offset=-1):
+    """Scans .ha files in a process pool and merges the LDT parts in order.
+
+    Phase one runs ha_scan_parts for each file in a separate process, giving
+    a list of LdtPart records and a spool file of the part payloads. Phase two
+    feeds the records to the reassembler in file order as each scan finishes.
+
+    Arguments:
+        ldt {LdtReassembler} -- Reassembler receiving the LDT parts.
+        ha_files {list} -- .ha files in processing order.
+        workers {int} -- Number of scan processes.
+
+    Keyword Arguments:
+        checkpoint {HaCheckpoint} -- Checkpoint updated as parts are merged (default: {None})
+        start_file {int} -- Index of the first file to process (default: {0})
+        start_offset {int} -- Packets up to this offset in the first file are skipped (default: {-1})
+    """
+
+    # Worker log records are passed back through a queue
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, pancam_fns.LogDispatch())
+    listener.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='.ha_scan_', dir=ldt.dir_proc) as spool_dir, \
+                ProcessPoolExecutor(max_workers=workers,
+                                    initializer=pancam_fns.worker_logging,
+                                    initargs=(log_queue,)) as pool:
+            file_nos = range(start_file, len(ha_files))
+            spools = [Path(spool_dir) / (str(i) + '.ldt_parts') for i in file_nos]
+
+            results = pool.map(ha_scan_parts,
+                               [ha_files[i] for i in file_nos], spools,
+                               [ldt.dir_proc] * len(spools))
+
+            for file_no, spool, parts in zip(file_nos, spools, results):
+                logger.info("Merging LDT parts from %s", ha_files[file_no].name)
+                offset = start_offset if file_no == start_file else -1
+                with open(spool, 'rb') as sp:
+                    for part in parts:
+                        if part.Ha_Offset <= offset:
+                            continue
+                        offset = part.Ha_Offset
+
+                        sp.seek(part.Offset)
+                        Data = sp.read(part.Length)
+
+                        if part.Part == 0:
+                            ldt.add_first(LDT_Properties(part.Header, ldt.rmsw_ver),
+                                          Data)
+                        elif part.Part == 1:
+                            ldt.add_intermediate(part.Unit_ID, part.SEQ_No, Data)
+                        else:
+                            ldt.add_end(part.Unit_ID, part.SEQ_No)
+
+                        if checkpoint:
+                            checkpoint.update(ldt, file_no, part.Ha_Offset)
+                spool.unlink()
+
+                if checkpoint:
+                    checkpoint.update(ldt, file_no, offset, force=True)
+    finally:
+        listener.stop()
+
+
+def ha_scan_parts(ha_file, spool, dir_proc):
+    """Phase one of a parallel scan, finds the LDT parts within a .ha file.
+
+    Arguments:
+        ha_file {Path} -- .ha file to be scanned.
+        spool {Path} -- File to write the LDT part payloads to.
+        dir_proc {Path} -- Processing folder holding the .ha index sidecar.
+
+    Returns:
+        list -- LdtPart record for each LDT packet in file order.
+    """
+
+    parts = []
+    with ha_index.HaIndex(ha_file, index_dir=dir_proc) as idx, \
+            open(spool, 'wb') as sp:
+        for pkt in idx.select(LDT_IDs):
+            PKT_Bin = idx.read(pkt)
+            unit_id, seq_no = bitstruct.unpack('u16u16', PKT_Bin[16:20])
+
+            if pkt.PKT_ID == LDT_IDs[0]:
+                Part, Header, Data = 0, PKT_Bin[:30], PKT_Bin[29:-2]
+            elif pkt.PKT_ID == LDT_IDs[1]:
+                Part, Header, Data = 1, None, PKT_Bin[20:-2]
+            else:
+                Part, Header, Data = 2, None, b''
+
+            parts.append(LdtPart(Part, unit_id, seq_no,
+                                 Header, sp.tell(), len(Data), pkt.Offset))
+            sp.write(Data)
 
-    global Found_IDS
+    return parts
 
-    TXT_Data = [next(curFile)[:-1] for x in range(PKT_LINES)]
-    PKT_Bin = bytes.fromhex(''.join(TXT_Data))
 
-    # First LDT Part
-    if PKT_ID == LDT_IDs[0]:
-        LDT_Cur_Pkt = LDT_Properties(PKT_Bin)
+def RestructureHK(ROV_DIR):
+    """Searches for .HKNE_raw and .HKES_raw generated from HaScan, produces the a single Unrpoc_HKTM pickle file"""
+    logger.info("Processing any .ha HK that has been created")
 
-        if LDT_Cur_Pkt.PanCam:
-            log_message = 'New PanCam LDT part'
+    # Find Files
+    RAW_ES = pancam_fns.Find_Files(ROV_DIR, "*.HKES_raw")
+    if not RAW_ES:
+        logger.info("No .ha generated HK files found")
+        return
 
-        else:
-            log_message = '----Other LDT part'
+    RAW_NE = pancam_fns.Find_Files(ROV_DIR, "*.HKNE_raw")
+    if not RAW_NE:
+        logger.info("No .ha generated HK files found")
 
-        logger.info(log_message + ' found with file ID: %s, and unitID %s',
-                    LDT_Cur_Pkt.FILE_ID, LDT_Cur_Pkt.Unit_ID)
+    # Read files into record arrays
+    ES = read_hk_raw(RAW_ES, HKES_DTYPE, '.HKES_raw.ignore')
+    NE = read_hk_raw(RAW_NE, HKNE_DTYPE, '.HKNE_raw.ignore')
 
-        # If write is True, check to see if ID already exists
-        if LDT_Cur_Pkt.write and (LDT_Cur_Pkt.Unit_ID in Found_IDS):
-            status.info(
-                "Multiple initial packets with the same ID found.")
-            prev_count = Found_IDS.get(LDT_Cur_Pkt.Unit_ID).write_occurance
-            LDT_Cur_Pkt.setOccurance(prev_count + 1)
+    # Combine HK data into a single time ordered batch
+    cuc = np.concatenate([hk_cuc(ES['Pkt_CUC']), hk_cuc(NE['Pkt_CUC'])])
+    raw = np.concatenate([hk_packets(ES), hk_packets(NE)])
+    order = np.argsort(cuc, kind='stable')
 
-            # Check to see if previous ID was not already completed
-            if not Found_IDS.get(LDT_Cur_Pkt.Unit_ID).write_completed:
-                logger.error(
-                    "Previous FileID not completed, now adding to second FileID")
+    RTM = pd.DataFrame({'RAW': raw[order]})
+    RTM['Pkt_CUC'] = pd.array(cuc[order].astype(np.int64), dtype='Int64')
+    RTM['Source'] = '.ha'
 
-        # Write packet contents to file
-        if LDT_Cur_Pkt.write:
-            LDT_Cur_Pkt.setWriteFile(dir_proc, PKT_HD)
-            writeBytesToFile(LDT_Cur_Pkt, PKT_Bin[29:-2])
+    # Then save file
+    curName = (RAW_ES + RAW_NE)[0].stem
+    RTM.to_pickle(ROV_DIR / (curName + "_ha_Unproc_HKTM.pickle"))
 
-        Found_IDS.update({LDT_Cur_Pkt.Unit_ID: LDT_Cur_Pkt})
 
-    # Second LDT Part
-    elif PKT_ID == LDT_IDs[1]:
-        IntP = LDT_Intermediate(PKT_Bin)
+def read_hk_raw(files, dtype, ignore_suffix):
+    """Reads .ha generated HK files into a single structured array.
 
-        # Check to see if Unit ID already started if not add to buffer
-        if IntP.Unit_ID not in Found_IDS:
-            logger.info("New Packet without first part - adding to buffer")
-            Buffer.update({(IntP.Unit_ID, IntP.SEQ_No): PKT_Bin[20:-2]})
+    Files that do not contain a whole number of packets are renamed with the
+    ignore_suffix and skipped.
 
-        else:
-            Cur_LDT = Found_IDS.get(IntP.Unit_ID)
-
-            # Check file should be written
-            if Cur_LDT.write:
-                # Verify SEQ number is as expected
-                Expected_SEQ = (Cur_LDT.Unit_ID, Cur_LDT.SEQ_No + 1)
-                if Expected_SEQ == (IntP.Unit_ID, IntP.SEQ_No):
-                    writeBytesToFile(Cur_LDT, PKT_Bin[20:-2])
-                    Cur_LDT.SEQ_No += 1
-                    Found_IDS.update({IntP.Unit_ID: Cur_LDT})
-
-                # Else add to buffer and try to rebuild
-                else:
-                    logger.warning("LDT parts not sequential")
-                    logger.warning("Expected: %d", Expected_SEQ[1])
-                    logger.warning("Got: %d", IntP.SEQ_No)
-                    Buffer.update(
-                        {(IntP.Unit_ID, IntP.SEQ_No): PKT_Bin[20:-2]})
-                    logger.warning(
-                        "Added LDT part to buffer: %d", IntP.SEQ_No)
-                    checkBuffers(Cur_LDT)
-
-    elif PKT_ID == LDT_IDs[2]:
-        # Check end of file and rename properly
-        EndP = LDT_End(PKT_Bin)
-        logger.info("End Packet Received with unitID: %d", EndP.Unit_ID)
+    Arguments:
+        files {list} -- HK raw files to be read.
+        dtype {np.dtype} -- Record structure of a single HK packet.
+        ignore_suffix {str} -- Suffix given to incomplete files.
 
-        # Check to see if Unit ID already started if not add to dict
-        if EndP.Unit_ID not in Found_IDS:
-            logger.error("End Packet without first part - adding to EndBuffer")
-            EndBuffer.update({(EndP.Unit_ID, EndP.SEQ_No): PKT_Bin[20:-2]})
+    Returns:
+        np.ndarray -- Structured array of all HK packets found.
+    """
 
-        else:
-            Cur_LDT = Found_IDS.get(EndP.Unit_ID)
+    records = []
+    for curfile in files:
+        # Ignore if not all packets are complete
+        if curfile.stat().st_size % dtype.itemsize != 0:
+            target = curfile.with_suffix(ignore_suffix)
+            pancam_fns.exist_unlink(target)
+            curfile.rename(target)
+            continue
 
-            # Check file should be written
-            if Cur_LDT.write:
-                # Verify SEQ number is as expected
-                Expected_SEQ = (Cur_LDT.Unit_ID, Cur_LDT.SEQ_No + 1)
-                if Expected_SEQ == (EndP.Unit_ID, EndP.SEQ_No):
-                    Cur_LDT.SEQ_No += 1
-                    Found_IDS.update({EndP.Unit_ID: Cur_LDT})
-                    Cur_LDT.complete_file()
+        logger.info("Reading %s", curfile.name)
+        records.append(np.fromfile(curfile, dtype=dtype))
 
-                else:
-                    logger.warning("END LDT not sequential")
-                    logger.warning("Expected: %d", Expected_SEQ[1])
-                    logger.warning("Got: %d", EndP.SEQ_No)
-                    EndBuffer.update(
-                        {(EndP.Unit_ID, EndP.SEQ_No): PKT_Bin[20:-2]})
-                    logger.warning(
-                        "Added End part to buffer: %d, %d", EndP.Unit_ID, EndP.SEQ_No)
-                    checkBuffers(Cur_LDT)
+    if not records:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(records)
 
 
-def checkBuffers(Cur_LDT):
-    """Function checks the LDT part buffer and end buffer to add parts already found out of sequence"""
+def hk_packets(records):
+    """Returns an object array of the bytes of each record of a structured array"""
+    return records.view(np.dtype((np.void, records.itemsize))).astype(object)
 
-    global Found_IDS
 
-    Expected_SEQ = (Cur_LDT.Unit_ID, Cur_LDT.SEQ_No + 1)
+def hk_cuc(cuc_bytes):
+    """Returns the 6 byte big-endian packet CUC of each row as uint64"""
 
-    # First partial buffer
-    # Check if expected SEQ_No packets already exists in the buffer
-    while Expected_SEQ in Buffer:
-        # Write to file the value in the buffer found
-        writeBytesToFile(Cur_LDT, Buffer[Expected_SEQ])
-        Buffer.pop(Expected_SEQ)
-        logger.warning(
-            "Wrote LDT part from buffer: %d", Expected_SEQ[1])
-        Cur_LDT.SEQ_No += 1
-        Found_IDS.update({Cur_LDT.Unit_ID: Cur_LDT})
-        Expected_SEQ = (Expected_SEQ[0], Expected_SEQ[1] + 1)
-
-    # Then End Buffer
-    # Determine if the end packet has been found
-    if Expected_SEQ in EndBuffer:
-        logger.warning("End LDT now fits: %d", Expected_SEQ[1])
-        Cur_LDT.SEQ_No += 1
-        Found_IDS.update({Cur_LDT.Unit_ID: Cur_LDT})
-        Cur_LDT.complete_file()
-        EndBuffer.pop(Expected_SEQ)
+    cuc = np.zeros(len(cuc_bytes), dtype=np.uint64)
+    for byte in cuc_bytes.T:
+        cuc = (cuc << np.uint64(8)) | byte
+    return cuc
 
 
-def pkt_Len(PKT_HD):
-    return int(PKT_HD[3][8:])
+def compareHaCSV(ProcDir):
+    """Looks for HK generated by .csv and .ha and reconciles the two.
 
+    Each packet is indexed by its CUC time, packet type and a digest of its
+    contents so the two sources can be compared without decoding. Packets
+    with the same CUC and type but different contents are paired as
+    both-differ and only the .ha packet is kept. The union of both
+    sources is written as a single de-duplicated unprocessed HK file and the
+    source files are renamed so downstream decoding only sees the merged set.
+    The majority of the time the .ha files contain more data.
 
-def writeBytesToFile(CurLDT, Bytes):
-    """Funtion for writing to data file"""
-    with open(CurLDT.write_file, 'ab') as wf:
-        wf.write(Bytes)
-        CurLDT.writtenLen += len(Bytes)
-    return
+    When only one source has been extracted again since the last reconcile,
+    it is merged with the renamed .reconciled file of the other source so
+    that neither loses its packets.
 
+    Arguments:
+        ProcDir {Path} -- PROC directory containing the unprocessed HK.
 
-def RestructureHK(ROV_DIR):
-    """Searches for .HKNE_raw and .HKES_raw generated from HaScan, produces the a single Unrpoc_HKTM pickle file"""
-    logger.info("Processing any .ha HK that has been created")
+    Generates:
+        *_merged_Unproc_HKTM.pickle -- Union of the .ha and .csv HK packets.
+        HK_Provenance.pickle -- Source of each packet, one of ha-only,
+                                csv-only, both-identical or both-differ.
+    """
 
-    # Find Files
-    RAW_ES = pancam_fns.Find_Files(ROV_DIR, "*.HKES_raw")
-    if not RAW_ES:
+    logger.info("Comparing .ha generated HK to .csv generated HK")
+    # Find Files, falling back to those of a previous reconcile
+    RAW_ha = hk_source(ProcDir, "_ha_")
+    if not RAW_ha:
         logger.info("No .ha generated HK files found")
         return
 
-    RAW_NE = pancam_fns.Find_Files(ROV_DIR, "*.HKNE_raw")
-    if not RAW_NE:
-        logger.info("No .ha generated HK files found")
+    RAW_csv = hk_source(ProcDir, "_csv_")
+    if not RAW_csv:
+        logger.info("No .csv generated HK files found")
+        return
 
-    ES = pd.DataFrame(columns=['RAW'])
-    NE = pd.DataFrame(columns=['RAW'])
-    raw_data = []
+    if RAW_ha[0].suffix == RAW_csv[0].suffix == ".reconciled":
+        logger.info("HK already reconciled")
+        return
 
-    es_line_len = 72
-    ne_line_len = 88
+    ha = pd.read_pickle(RAW_ha[0])
+    ha_bin = pd.DataFrame({'RAW': ha['RAW'].values,
+                           'Pkt_CUC': ha['Pkt_CUC'].astype('int64').values})
+    csv_bin = hex_to_hk(pd.read_pickle(RAW_csv[0])['RAW'])
+
+    # Index each source by CUC, packet type and packet digest
+    ha_bin['Pkt_Type'] = hk_types(ha_bin['RAW'])
+    csv_bin['Pkt_Type'] = hk_types(csv_bin['RAW'])
+    ha_bin['Digest'] = hk_digests(ha_bin['RAW'])
+    csv_bin['Digest'] = hk_digests(csv_bin['RAW'])
+    pair = ['Pkt_CUC', 'Pkt_Type']
+    key = pair + ['Digest']
+
+    ha_dup = ha_bin.duplicated(key)
+    csv_dup = csv_bin.duplicated(key)
+    if ha_dup.any() or csv_dup.any():
+        logger.warning("Duplicate HK packets removed, .ha: %d, .csv: %d",
+                       ha_dup.sum(), csv_dup.sum())
+
+    prov = pd.merge(ha_bin.loc[~ha_dup, key].reset_index().rename(columns={'index': 'ha_Index'}),
+                    csv_bin.loc[~csv_dup, key].reset_index().rename(columns={'index': 'csv_Index'}),
+                    on=key, how='outer', indicator=True)
+
+    # Unmatched packets of the same CUC and type in each source differ
+    ha_only = prov['_merge'] == 'left_only'
+    csv_only = prov['_merge'] == 'right_only'
+    prov_pair = pd.MultiIndex.from_frame(prov[pair])
+    differ = (ha_only & prov_pair.isin(prov_pair[csv_only])) \
+        | (csv_only & prov_pair.isin(prov_pair[ha_only]))
+    prov['Provenance'] = prov['_merge'].map({'left_only': 'ha-only',
+                                             'right_only': 'csv-only',
+                                             'both': 'both-identical'}).astype(object)
+    prov.loc[differ, 'Provenance'] = 'both-differ'
+    prov = prov[['Pkt_CUC', 'Pkt_Type', 'Digest', 'Provenance', 'ha_Index', 'csv_Index']]
+    prov = prov.sort_values(
+        by='Pkt_CUC', kind='mergesort').reset_index(drop=True)
+
+    counts = prov['Provenance'].value_counts()
+    for name, count in counts.items():
+        logger.info("HK packets %s: %d", name, count)
+
+    if counts.get('csv-only', 0) > 0:
+        logger.warning(
+            "HK Data contained entries within .csv HK not present in .ha HK")
 
-    # Read files
-    for curfile in RAW_ES:
-        # Ignore if not all packets are complete
-        if curfile.stat().st_size % es_line_len != 0:
-            target = curfile.with_suffix('.HKES_raw.ignore')
-            pancam_fns.exist_unlink(target)
-            curfile.rename(target)
+    if counts.get('both-differ', 0) > 0:
+        logger.error(
+            "HK Data in .ha file did not match that of .csv with same CUC times")
+
+    # Union of both sources, preferring .ha where identical or differing.
+    # The .csv half of a differing pair is only kept in the provenance.
+    from_ha = prov['ha_Index'].notna()
+    from_csv = prov['Provenance'] == 'csv-only'
+    merged = pd.concat(
+        [ha_bin.loc[prov.loc[from_ha, 'ha_Index'].astype(int), ['RAW', 'Pkt_CUC']].assign(Source='.ha'),
+         csv_bin.loc[prov.loc[from_csv, 'csv_Index'].astype(int), ['RAW', 'Pkt_CUC']].assign(Source='STDRawOcds.csv')],
+        ignore_index=True)
+    merged = merged.sort_values(
+        by='Pkt_CUC', kind='mergesort').reset_index(drop=True)
+    merged['Pkt_CUC'] = merged['Pkt_CUC'].astype('Int64')
+    status.info("Merged HK contains %d packets", len(merged))
+
+    prov_file = ProcDir / "HK_Provenance.pickle"
+    pancam_fns.exist_unlink(prov_file)
+    prov.to_pickle(prov_file)
+
+    # Replace the merged file of any previous reconcile
+    for curfile in ProcDir.glob("*_merged_Unproc_HKTM.pickle"):
+        pancam_fns.exist_unlink(curfile)
+
+    ha_name = RAW_ha[0].name.replace(".reconciled", "")
+    merged_file = ProcDir / ha_name.replace("_ha_Unproc_HKTM", "_merged_Unproc_HKTM")
+    merged.to_pickle(merged_file)
+
+    # Remove sources from the search path of downstream decoding
+    for kind, curfile in [("_ha_", RAW_ha[0]), ("_csv_", RAW_csv[0])]:
+        if curfile.suffix == ".reconciled":
             continue
+        for prev in ProcDir.glob("*" + kind + "Unproc_HKTM.pickle.reconciled"):
+            pancam_fns.exist_unlink(prev)
+        logger.info("Renaming HK source file: %s", curfile.name)
+        curfile.rename(curfile.with_suffix(".pickle.reconciled"))
 
-        with open(curfile, 'rb') as f:
-            logger.info("Reading %s", f.name)
-            line = f.read(es_line_len)
-            while len(line) == es_line_len:
-                raw_data.append(line)
-                line = f.read(es_line_len)
 
-    ES['RAW'] = raw_data
-    raw_data = []
+def hk_source(ProcDir, kind):
+    """Returns the newly extracted HK file of a source, else its reconciled file.
 
-    for curfile in RAW_NE:
-        # Ignore if not all packets are complete
-        if curfile.stat().st_size % ne_line_len != 0:
-            target = curfile.with_suffix('.HKNE_raw.ignore')
-            pancam_fns.exist_unlink(target)
-            curfile.rename(target)
-            continue
+    Arguments:
+        ProcDir {Path} -- PROC directory containing the unprocessed HK.
+        kind {str} -- Source part of the file name, '_ha_' or '_csv_'.
 
-        with open(curfile, 'rb') as f:
-            logger.info("Reading %s", f.name)
-            line = f.read(ne_line_len)
-            while len(line) == ne_line_len:
-                raw_data.append(line)
-                line = f.read(ne_line_len)
+    Returns:
+        list -- The file found, empty if neither exists.
+    """
 
-    NE['RAW'] = raw_data
+    found = pancam_fns.Find_Files(
+        ProcDir, "*" + kind + "Unproc_HKTM.pickle", SingleFile=True)
+    if not found:
+        found = pancam_fns.Find_Files(
+            ProcDir, "*" + kind + "Unproc_HKTM.pickle.reconciled", SingleFile=True)
+    return found[:1]
 
-    # Combine HK data into a single dataframe
-    RTM = pd.concat([ES, NE], axis=0, join='outer')
-    RTM = pancam_fns.ReturnCUC_RAW(RTM, RTM['RAW'])
-    RTM['Source'] = '.ha'
-    RTM = RTM.sort_values(by='Pkt_CUC').reset_index(drop=True)
 
-    # Then save file
-    curName = (RAW_ES + RAW_NE)[0].stem
-    RTM.to_pickle(ROV_DIR / (curName + "_ha_Unproc_HKTM.pickle"))
+def hex_to_hk(hex_raw):
+    """Decodes a column of hex HK packets in a single pass.
 
+    Arguments:
+        hex_raw {pd.Series} -- HK packets as hex strings.
 
-def compareHaCSV(ProcDir):
-    """Looks for HK generated by .csv and .ha and compares the two.
-    The majority of the time the .ha files contain more data."""
+    Returns:
+        pd.DataFrame -- 'RAW' bytes and 'Pkt_CUC' of each packet with at
+                        least a complete packet header.
+    """
 
-    logger.info("Comparing .ha generated HK to .csv generated HK")
-    # Find Files
-    RAW_ha = pancam_fns.Find_Files(
-        ProcDir, "*_ha_Unproc_HKTM.pickle", SingleFile=True)
-    if not RAW_ha:
-        logger.info("No .ha generated HK files found")
-        return
+    lengths = hex_raw.str.len().values // 2
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    joined = bytes.fromhex(''.join(hex_raw))
 
-    RAW_csv = pancam_fns.Find_Files(
-        ProcDir, "*_csv_Unproc_HKTM.pickle", SingleFile=True)
-    if not RAW_csv:
-        logger.info("No .csv generated HK files found")
-        return
+    valid = lengths >= 8
+    if not valid.all():
+        logger.warning("Ignoring %d HK packets shorter than the header",
+                       (~valid).sum())
+        starts, ends = starts[valid], ends[valid]
 
-    ha_bin = pd.read_pickle(RAW_ha[0])
-    csv = pd.read_pickle(RAW_csv[0])
-    csv_bin = pd.DataFrame()
-    csv_bin['RAW'] = csv['RAW'].apply(lambda x: bytes.fromhex(x))
-    csv_bin = pancam_fns.ReturnCUC_RAW(csv_bin, csv_bin['RAW'])
+    buf = np.frombuffer(joined, dtype=np.uint8)
+    cuc_bytes = buf[starts[:, None] + np.arange(2, 8)]
 
-    result = pd.merge(ha_bin, csv_bin, on=['Pkt_CUC'], how='inner')
-    comp = result['RAW_x'] != result['RAW_y']
-    mismatch = result[comp]
+    return pd.DataFrame({'RAW': [joined[a:b] for a, b in zip(starts, ends)],
+                         'Pkt_CUC': hk_cuc(cuc_bytes).astype(np.int64)})
 
-    if (len(result)-len(csv_bin)) < 0:
-        # First check that all the CUC entries within csv_bin are in ha_bin
-        logger.error(
-            "HK Data contained entries within .csv HK not present in .ha HK")
 
-    elif len(mismatch) > 0:
-        # Next confirm that the RAW is equivalent, if so delete .csv HK
-        logger.error(
-            "HK Data in .ha file did not match that of .csv with same CUC times")
+def hk_types(raw):
+    """Returns the 2 byte packet header of each packet, which separates ES and NE HK"""
+    return np.array([int.from_bytes(pkt[:2], 'big') for pkt in raw], dtype=np.int64)
 
-    else:
-        logger.info("HK Data matches")
-        logger.info("Removing .csv HK file: %s", RAW_csv[0].name)
-        Path.unlink(RAW_csv[0])
+
+def hk_digests(raw):
+    """Returns a 64-bit digest of each packet within a column of bytes"""
+    return pd.util.hash_array(np.asarray(raw, dtype=object), categorize=False)
 
 
 if __name__ == "__main__":
@@ -9,17 +9,24 @@ PanCam Data Processing Tools
 Created 12 Dec 2019.
 """
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import logging
+import logging.handlers
+import multiprocessing
 import csv
+import mmap
+import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
-import filecmp
 from bitstruct import unpack_from as upf
-from shutil import copyfile
 
 import pancam_fns
+import pci_raw
 import hs
 
 logger = logging.getLogger(__name__)
@@ -27,6 +34,19 @@ status = logging.getLogger('status')
 
 # Global parameters
 swisProcVer = {'swisProcVer': 1.0}
+REF_DIGEST_FILE = 'reference_digests.json'
+HS_BLOCK_SIZE = 16*1024*1024
+
+# TC ACTION of each BID, as labview takes from the TC description. The
+# trailing space matches the description so tc_cal decodes the camera TCs.
+TC_ACTIONS = {0: 'STIME ', 1: 'CE ', 2: 'PE ', 6: 'FWL ', 11: 'ICON ',
+              64: 'WACL ', 128: 'WACR ', 192: 'HRC '}
+
+# H&S response line of a SWIS log, groups are the time and content
+HS_PATTERN = re.compile(
+    rb'^(?:Timestamp: )?(.*?) - \[Informative\]HS response message with 45 bytes'
+    rb' and content (\S*)[ \t\r]*$', re.M)
+
 
 
 def hk_extract(swis_dir):
@@ -61,53 +81,59 @@ def hk_extract(swis_dir):
 
         if nsvf:
             logger.info("Type is nsvf")
-            dtab = pd.read_table(curfile, sep=' : ',
-                                 header=None, engine='python')
-            dl['SPW_RAW'] = dtab[1].apply(lambda x: x.replace(' ', ''))
-            dl['RAW'] = dl.SPW_RAW.apply(lambda x: x[24:-7])
+            dtab = pancam_fns.read_split_log(curfile, ' : ', names=[0, 1])
+            dl['SPW_RAW'] = dtab[1].str.replace(' ', '', regex=False)
+            dl['RAW'] = dl['SPW_RAW'].str.slice(24, -7)
             dl['Source'] = 'SWIS'
 
             # Extract epoch from filename
             epoch = int(curfile.stem.split('_')[1][4:])
 
-            # Calculate elapsed time
-            dtab['ElapLi'] = dtab[0].apply(
-                lambda x: x.split(' ')[0][1:-1].split(':'))
+            # Calculate elapsed time from [secs:frac1:frac2:frac3]
+            elap = dtab[0].str.extract(
+                r'^\[(\d+):(\d+):(\d+):(\d+)\]', expand=True)
 
-            # Ensure elapsed list is expected length
-            verify = dtab['ElapLi'].str.len() != 4
+            # Ensure elapsed time is expected format
+            verify = elap[0].isna()
             err_df = dtab[verify]
             if err_df.shape[0] != 0:
                 logger.error("Some elpased times are not in correct format")
                 logger.error(err_df)
 
-            dtab['Elapsed'] = dtab['ElapLi'].apply(
-                lambda x: float(x[0] + '.' + ''.join(x[1:])))
+            elapsed = pd.to_numeric(
+                elap[0] + '.' + elap[1] + elap[2] + elap[3])
 
-            dl['Unix_Time'] = dtab['Elapsed'] + epoch
+            dl['Unix_Time'] = elapsed + epoch
             cur_dir = curfile.parent
 
         else:
             logger.info("Type is standard SWIS")
             dtab = pd.read_table(curfile, sep=']', header=None)
-            dl['SPW_RAW'] = dtab[1].apply(
-                lambda x: x.replace('0x', '').replace(' ', ''))
-            dl['RAW'] = dl.SPW_RAW.apply(lambda x: x[108-84:-2])
+            dl['SPW_RAW'] = dtab[1].str.replace(
+                '0x', '', regex=False).str.replace(' ', '', regex=False)
+            dl['RAW'] = dl['SPW_RAW'].str.slice(108-84, -2)
             dl['Source'] = 'SWIS'
-            dl['Unix_Time'] = dtab[0].apply(lambda x: x[11:-12])
+            dl['Unix_Time'] = dtab[0].str.slice(11, -12)
             cur_dir = swis_dir / "PROC"
 
         dl.to_pickle(cur_dir / "Unproc_HKTM.pickle")
 
 
-def hs_extract(swis_dir):
-    """Extracts the H&S from the SWIS log and puts in a new file
+def hs_extract(swis_dir, write_log=False, workers=None):
+    """Extracts the H&S from the SWIS logs into a single pickle
+
+    Each candidate log is scanned in large blocks for H&S responses, with
+    multiple logs scanned in parallel.
 
     Arguments:
         swis_dir {Path} -- Dir containing .txt files with simulation data
 
+    Keyword Arguments:
+        write_log {bool} -- Also write the extracted lines to HS.log (default: {False})
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+
     Generates:
-        _HS.txt -- Simply contains the extracted relevant H&S lines from the log.
+        HS.log -- Simply contains the extracted relevant H&S lines from the log.
         hs_raw.pickle -- Pickle file in ['Time', 'RAW'] format for hs module.
     """
 
@@ -119,59 +145,144 @@ def hs_extract(swis_dir):
     files_HK = pancam_fns.Find_Files(swis_dir, "*_HK*.txt")
     files_sci = pancam_fns.Find_Files(swis_dir, '*_SC.txt')
     files_typ = pancam_fns.Find_Files(swis_dir, "*_typescript.txt")
-    files_hs = list(set(files_txt) - set(files_HK) -
-                    set(files_sci) - set(files_typ))
+    files_hs = sorted(set(files_txt) - set(files_HK) -
+                      set(files_sci) - set(files_typ))
 
-    proc_dir = swis_dir / "PROC"
+    if not files_hs:
+        return
 
-    # Read text file for H&S
-    for curfile in files_hs:
+    proc_dir = swis_dir / "PROC"
 
-        # New file within new folder
+    # Scan each text log for H&S
+    if (workers == 1) or (len(files_hs) == 1):
+        results = [hs_scan(curfile) for curfile in files_hs]
+    else:
+        # Worker log records are passed back through a queue
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(
+            log_queue, pancam_fns.LogDispatch())
+        listener.start()
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=pancam_fns.worker_logging,
+                                     initargs=(log_queue,)) as pool:
+                results = list(pool.map(hs_scan, files_hs))
+        finally:
+            listener.stop()
+
+    hs_time = []
+    hs_raw = []
+    for curfile, (times, raws, skipped, consec) in zip(files_hs, results):
+        logger.info("Read %s, %d H&S entries", curfile.name, len(raws))
+        if consec > 15:
+            logger.error(
+                'Skipping lots of HS entries, count: %s', consec)
+        elif skipped:
+            logger.warning("Skipped %d HS entries", skipped)
+        hs_time.extend(times)
+        hs_raw.extend(raws)
+
+    if write_log:
         write_file = (proc_dir / "HS.log")
         pancam_fns.exist_unlink(write_file)
         logger.info("Creating HS.log file")
-        wf = open(write_file, 'w')
-
-        # Scan through text log and save H&S lines
-        consec_skipped = 0  # Counter for number of consecutive lines skipped.
-        with open(curfile, 'r') as f:
-            logger.info("Reading %s", curfile.name)
-            line = f.readline()
-            while line != "":
-                if "HS response" in line:
-                    if "message with 45 bytes" in line:
-                        line_red = line.replace("Timestamp: ", "")
-                        line_red = line_red.replace(
-                            " - [Informative]HS response message with 45 bytes and content ", "; ")
-                        line_red = line_red.replace("-0x", " ")
-                        line_red = line_red.replace("0x", "")
-                        line_red = line_red.replace("\n", "").replace("\r", "")
-                        split_line = line_red.split(" ")
-                        new_line = "".join([entry.zfill(2)
-                                            for entry in split_line]) + "\n"
-
-                        if len(new_line) == 129:
-                            wf.write(new_line)
-                            consec_skipped = 0
-                        else:
-                            consec_skipped += 1
-                            if consec_skipped > 15:
-                                logger.error(
-                                    'Skipping lots of HS entries, count: %s', consec_skipped)
-                line = f.readline()
-            wf.close()
-
-        # Convert hs.log to pickle file
-        hs_head = ['Time', 'RAW']
-        hs = pd.read_csv(write_file, sep=';', header=None, names=hs_head)
-        hs.to_pickle(proc_dir / "hs_raw.pickle")
-        logger.info("PanCam H+S pickled.")
+        with open(write_file, 'w') as wf:
+            for time_str, raw in zip(hs_time, hs_raw):
+                wf.write(time_str + ';' + raw + '\n')
+
+    # Convert to pickle file, time is numeric if all entries are
+    hs = pd.DataFrame({'Time': hs_time, 'RAW': hs_raw})
+    try:
+        hs['Time'] = pd.to_numeric(hs['Time'])
+    except (ValueError, TypeError):
+        pass
+    hs.to_pickle(proc_dir / "hs_raw.pickle")
+    logger.info("PanCam H+S pickled.")
+
+
+def hs_scan(curfile, block_size=HS_BLOCK_SIZE):
+    """Scans a SWIS text log for the H&S response messages.
+
+    The log is read as bytes in blocks with the H&S lines found using
+    HS_PATTERN. Each is reduced to the time and the 45 byte content in hex.
+
+    Arguments:
+        curfile {Path} -- SWIS text log.
+
+    Keyword Arguments:
+        block_size {int} -- Bytes to read at a time (default: {HS_BLOCK_SIZE})
+
+    Returns:
+        times {list} -- Time string of each H&S.
+        raws {list} -- 90 character hex string of each H&S.
+        skipped {int} -- Number of H&S lines that were not 45 bytes.
+        consec {int} -- Largest number of consecutive lines skipped.
+    """
+
+    times = []
+    raws = []
+    skipped = 0
+    consec = 0
+    consec_skipped = 0
+
+    with open(curfile, 'rb') as f:
+        for block in _line_blocks(f, block_size):
+            for match in HS_PATTERN.finditer(block):
+                time_str, raw = hs_entry(match.group(1), match.group(2))
+
+                if len(time_str) + len(raw) == 127:
+                    times.append(time_str)
+                    raws.append(raw)
+                    consec_skipped = 0
+                else:
+                    skipped += 1
+                    consec_skipped += 1
+                    consec = max(consec, consec_skipped)
+
+    return times, raws, skipped, consec
+
+
+def hs_entry(time_bytes, content):
+    """Converts the time and content of a H&S line into the hs_raw format.
+
+    Values are written without the leading zero, e.g. 0x5-0xAB, so each is
+    padded to 2 characters. The time is stripped of spaces.
+
+    Arguments:
+        time_bytes {bytes} -- Time before the H&S message.
+        content {bytes} -- Content of the form 0x..-0x..
+
+    Returns:
+        tuple -- Time string and hex string of the content.
+    """
+
+    time_str = time_bytes.decode('ascii', 'replace') + ';'
+    time_str = ''.join(entry.zfill(2) for entry in time_str.split(' '))[:-1]
+    raw = content.replace(b'-0x', b' ').replace(b'0x', b'').decode('ascii')
+    raw = ''.join(entry.zfill(2) for entry in raw.split(' '))
+
+    return time_str, raw
+
+
+def _line_blocks(f, block_size):
+    """Yields blocks of whole lines read from the binary file f"""
+    rem = b''
+    for block in iter(lambda: f.read(block_size), b''):
+        block = rem + block
+        end = block.rfind(b'\n') + 1
+        rem = block[end:]
+        if end:
+            yield block[:end]
+    if rem:
+        yield rem
 
 
 def nsvf_parse(swis_dir):
     """Searches through the NSVF generated packet_log and generates new files from any found PanCam telemetry.
 
+    The packet log is scanned once, while the logbook.log is scanned at the
+    same time in a separate process.
+
     Arguments:
         swis_dir {Path} -- Path of directory to file to search for Router_A_packet.log.
 
@@ -183,19 +294,12 @@ def nsvf_parse(swis_dir):
         nsvfHK.txt  -- ASCII file of the PanCam HK telemetry
         Sci.txt -- ASCII file of the PanCam Sci telemetry.
         TC_Responses.txt  -- ASCII file of the PanCam TC responses.
+        TC_Candidates.txt -- ASCII file of packets that may be PanCam TCs.
+        payloadIf.log -- ASCII txt file of all payload entries in logbook.
 
         hs.pickle -- Pandas pickle file of H+S in the standard format for this tool.
     """
 
-    # Function Constants
-    # Regular expressions for log format
-    in_re = re.compile(r"^\[IN=[0-9]+\]$")
-    sz_re = re.compile(r"^\[SZ=[0-9]+\]$")
-
-    # PanCam logical address
-    pc_log_addr = 0x41
-    pc_hs_rowlen = 45
-
     logger.info("Processing SWIS NSVF log")
 
     logger.info("Searching for Router_A_packet.log file")
@@ -207,104 +311,175 @@ def nsvf_parse(swis_dir):
     else:
         packet_log = packet_log[0]
 
+    logbook = pancam_fns.Find_Files(swis_dir, 'logbook.log', SingleFile=True)
+
     # Create a PROC directory if does not already exist
     proc_dir = packet_log.parent / 'PROC'
     if not proc_dir.is_dir():
         proc_dir.mkdir()
 
-    # Next prepare files to be written
-    file = {}
-    f_acc = {}
-    f_wri = {}
+    # Scan logbook in parallel with the packet log, worker log records are
+    # passed back through a queue
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, pancam_fns.LogDispatch())
+    listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=1,
+                                 initializer=pancam_fns.worker_logging,
+                                 initargs=(log_queue,)) as pool:
+            if logbook:
+                lb_scan = pool.submit(nsvf_lb_scan, logbook[0],
+                                      proc_dir / 'payloadIf.log')
+
+            hk_elapsed = nsvf_scan(packet_log, proc_dir)
+
+            if logbook:
+                lb_scan.result()
+    finally:
+        listener.stop()
+
+    # Create a H&S Pickle File
+    hs_head = ['Time', 'RAW']
+    hs = pd.read_csv(proc_dir / 'H+S.txt', sep=';',
+                     header=None, names=hs_head)
+    hs.to_pickle(proc_dir / "hs_raw.pickle")
+    logger.info("PanCam H+S pickled.")
+
+    # Rename HK file with Unix time
+    if not logbook:
+        logger.error("No logbook.log found, unable to determine HK Unix time")
+    elif hk_elapsed is None:
+        logger.error("No PanCam HK found, unable to determine HK Unix time")
+    else:
+        hk_time = nsvf_epoch_lookup(logbook[0], hk_elapsed)
+        hk_unix = proc_dir / ("nsvfHK_Unix" + hk_time + ".txt")
+        pancam_fns.exist_unlink(hk_unix)
+        logger.info("Renaming HK file to %s", hk_unix.name)
+        (proc_dir / 'nsvfHK.txt').rename(hk_unix)
+
+    logger.info("--Parsing SWIS NSVF log completed.")
+
+    return True
+
+
+def nsvf_scan(packet_log, proc_dir):
+    """Single pass scan of Router_A_packet.log that splits out the PanCam packets.
+
+    Each row is in the format:
+        <time> [IN=..] [SZ=..] <flag> <SZ bytes in hex> [EOP]
 
-    file['hs'] = proc_dir / 'H+S.txt'
-    file['hk'] = proc_dir / 'nsvfHK.txt'
-    file['tc'] = proc_dir / 'TC_Responses.txt'
-    file['sc'] = proc_dir / 'Sci.txt'
+    The file is memory mapped and each row is split once on spaces with the
+    fields checked by position rather than by regular expression.
 
+    Arguments:
+        packet_log {Path} -- Path to Router_A_packet.log.
+        proc_dir {Path} -- Directory where the split files are written.
+
+    Returns:
+        str -- Elapsed time of the first HK packet in seconds, None if no HK.
+
+    Generates:
+        H+S.txt, nsvfHK.txt, Sci.txt, TC_Responses.txt, TC_Candidates.txt
+    """
+
+    # PanCam logical address
+    pc_log_addr = 0x41
+    pc_hs_rowlen = 45
+    pc_tc_minlen = 32  # Minimum PanCam command is Spw header and 5 bytes
+
+    file = {'hs': proc_dir / 'H+S.txt',
+            'hk': proc_dir / 'nsvfHK.txt',
+            'tc': proc_dir / 'TC_Responses.txt',
+            'sc': proc_dir / 'Sci.txt',
+            'cand': proc_dir / 'TC_Candidates.txt'}
+
+    f_acc = {}
     for key, value in file.items():
         pancam_fns.exist_unlink(value)
-        f_acc[key] = open(value, 'w')
-        f_wri[key] = csv.writer(f_acc[key], delimiter=' ',
-                                lineterminator='\r')
+        f_acc[key] = open(value, 'wb', buffering=1024*1024)
+
+    hk_elapsed = None
 
     # Open file and check format is as expcted
     # Contains ..[IN=..].. and ..[SZ=..].., ..[EOP] at the end of each line
+    logger.info("Reading file %s", packet_log.name)
+    with open(packet_log, 'rb') as logfile, \
+            mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b''):
+            row = line.rstrip(b'\r\n').split(b' ')
+            if len(row) < 4:
+                continue
+
+            # Packets sent to PanCam are kept as potential TCs
+            if (row[1] == b'[IN=08]') and (len(row) >= pc_tc_minlen):
+                f_acc['cand'].write(b' '.join(row) + b'\r')
 
-    with open(packet_log, 'r') as logfile:
-        reader = csv.reader(logfile, delimiter=' ')
-        logger.info("Reading file %s", packet_log.name)
-        for row in reader:
             # First check that row ends in [EOP]
-            if row[-1] != '[EOP]':
+            if row[-1] != b'[EOP]':
                 logger.error("Row does not end in '[EOP]': %s", row)
                 continue
 
             # Verify row contains [IN=..] in correct position
-            if not in_re.match(row[1]):
+            if not _nsvf_field(row[1], b'[IN='):
                 logger.error("Row no match for '[IN..]': %s", row)
                 continue
 
             # Verify row contains [SZ=..] in correct position
-            if not sz_re.match(row[2]):
+            if not _nsvf_field(row[2], b'[SZ='):
                 logger.error("Row no match for '[SZ..]': %s", row)
                 continue
 
             # Verify row size matches that stated in [SZ=..]
             row_size = int(row[2][4:-1])
-            if row_size != len(row[4:-1]):
+            if row_size != len(row) - 5:
                 logger.error(
                     "Row row does not match expected length %d bytes: %s", row_size, row)
                 continue
 
             # Filter by Logical address
-            log_addr = int(row[8], 16)
-
-            if log_addr == pc_log_addr:
-                # Assume 45 byte lines are H+S
-                if row_size == pc_hs_rowlen:
-                    row_red = row
-                    row_red[1:4] = []
-                    row_red[-1:] = []
-                    row_red[0] += ';'
-                    f_wri['hs'].writerow(row_red)
-
-                # If 8 byte line assume TC
-                elif row_size == 8:
-                    f_wri['tc'].writerow(row)
-
-                # If 85 or 101 byte line assume HK
-                elif (row_size == 85) | (row_size == 101):
-                    f_wri['hk'].writerow(row)
-
-                # Else assume Sci
-                else:
-                    f_wri['sc'].writerow(row)
+            if int(row[8], 16) != pc_log_addr:
+                continue
 
-    for key, value in f_acc.items():
-        value.close()
+            # Assume 45 byte lines are H+S
+            if row_size == pc_hs_rowlen:
+                f_acc['hs'].write(row[0] + b'; '
+                                  + b' '.join(row[4:-1]) + b'\r')
 
-    # Create a H&S Pickle File
-    hs_head = ['Time', 'RAW']
-    hs = pd.read_csv(file['hs'], sep=';', header=None, names=hs_head)
-    hs.to_pickle(proc_dir / "hs_raw.pickle")
-    logger.info("PanCam H+S pickled.")
+            # If 8 byte line assume TC
+            elif row_size == 8:
+                f_acc['tc'].write(b' '.join(row) + b'\r')
 
-    # Rename HK file with Unix time
-    hk_time = hk_nsvf_epoch(swis_dir)
-    hk_unix = proc_dir / ("nsvfHK_Unix" + hk_time + ".txt")
-    pancam_fns.exist_unlink(hk_unix)
-    logger.info("Renaming HK file to %s", hk_unix.name)
-    file['hk'].rename(hk_unix)
+            # If 85 or 101 byte line assume HK
+            elif (row_size == 85) | (row_size == 101):
+                f_acc['hk'].write(b' '.join(row) + b'\r')
+                if hk_elapsed is None:
+                    hk_first_time = row[0][1:-1].split(b':')
+                    hk_elapsed = (hk_first_time[0] + b'.'
+                                  + hk_first_time[1]).decode('ascii')
 
-    logger.info("--Parsing SWIS NSVF log completed.")
+            # Else assume Sci
+            else:
+                f_acc['sc'].write(b' '.join(row) + b'\r')
+
+    for value in f_acc.values():
+        value.close()
+
+    return hk_elapsed
 
-    return True
+
+def _nsvf_field(field, prefix):
+    """Checks field is of the form prefix followed by digits and ']'"""
+    return field.startswith(prefix) and field.endswith(b']') \
+        and field[len(prefix):-1].isdigit()
 
 
 def nsvf_lb_extract(swis_dir):
     """Extracts all payload lines from the NSVF generated logbook.log.
 
+    Skipped if payloadIf.log is newer than the logbook, as nsvf_parse writes
+    it during its own logbook pass.
+
     Arguments:
         swis_dir {Path} -- Path of directory to file to search for logbook.log
 
@@ -313,12 +488,6 @@ def nsvf_lb_extract(swis_dir):
         payloadIf.log -- ASCII txt file of all payload entries in logbook.
     """
 
-    # Function Constants
-    # Filter value
-    FILT_VAL = 'exo.payloadIf'
-    FILT_IGNORE = ['[INFO] Scheduling method PancamDelayedSpwTx with offset',
-                   'txSpw : Successful spacewire transmission on link']
-
     logger.info('Processing SWIS NSVF logbook.log')
 
     logger.info('Searching for logbook.log file')
@@ -335,39 +504,95 @@ def nsvf_lb_extract(swis_dir):
     if not proc_dir.is_dir():
         proc_dir.mkdir()
 
-    # File to write too
+    # Already written by nsvf_parse, no need to scan the logbook again
     f_pat = proc_dir / 'payloadIf.log'
+    if f_pat.exists() \
+            and f_pat.stat().st_mtime_ns >= logbook.stat().st_mtime_ns:
+        logger.info("payloadIf.log up to date, logbook not rescanned")
+        return
 
-    pancam_fns.exist_unlink(f_pat)
-    f_acc = open(f_pat, 'w')
-    f_wri = csv.writer(f_acc, delimiter='\t',
-                       lineterminator='\r')
+    nsvf_lb_scan(logbook, f_pat)
 
-    # Open file and check format is as expcted
-    # Contains ..[IN=..].. and ..[SZ=..].., ..[EOP] at the end of each line
+    return
 
-    with open(logbook, 'r') as log:
-        reader = csv.reader(log, delimiter='\t')
-        logger.info("Reading file %s", log.name)
-        for row in reader:
-            if len(row) < 6:
-                continue
 
-            if row[4] == FILT_VAL:
-                if row[5].startswith(FILT_IGNORE[0]):
-                    continue
+def nsvf_lb_scan(logbook, f_pat):
+    """Writes the payload entries of logbook.log to f_pat.
 
-                elif row[5].startswith(FILT_IGNORE[1]):
-                    continue
+    Rather than splitting every row the memory mapped logbook is searched for
+    the payload filter value and only those rows are checked.
 
-                else:
-                    f_wri.writerow(row)
+    Arguments:
+        logbook {Path} -- Path to the logbook.log.
+        f_pat {Path} -- File to write the payload entries to.
+    """
 
-    f_acc.close()
+    # Function Constants
+    # Filter value
+    FILT_VAL = b'exo.payloadIf'
+    FILT_IGNORE = (b'[INFO] Scheduling method PancamDelayedSpwTx with offset',
+                   b'txSpw : Successful spacewire transmission on link')
+
+    pancam_fns.exist_unlink(f_pat)
+
+    logger.info("Reading file %s", logbook.name)
+    with open(logbook, 'rb') as log, open(f_pat, 'wb') as f_acc:
+        if os.fstat(log.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.find(FILT_VAL)
+            while pos >= 0:
+                start = mm.rfind(b'\n', 0, pos) + 1
+                end = mm.find(b'\n', pos)
+                if end < 0:
+                    end = len(mm)
+
+                row = mm[start:end].rstrip(b'\r').split(b'\t')
+                if (len(row) >= 6) and (row[4] == FILT_VAL) \
+                        and not row[5].startswith(FILT_IGNORE):
+                    f_acc.write(b'\t'.join(row) + b'\r')
+
+                pos = mm.find(FILT_VAL, end)
 
     logger.info("--Parsing SWIS NSVF logbook completed.")
 
-    return
+
+def nsvf_epoch_lookup(logbook, elapsed):
+    """Returns the Unix time from the first logbook row at the given elapsed time.
+
+    Arguments:
+        logbook {Path} -- Path to the logbook.log.
+        elapsed {str} -- Elapsed time to search for.
+
+    Returns:
+        epoch_str {str} -- The UNIX time in seconds, None if not found.
+    """
+
+    target = elapsed.encode('ascii')
+
+    with open(logbook, 'rb') as log:
+        if os.fstat(log.fileno()).st_size == 0:
+            return None
+
+        with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.find(target)
+            while pos >= 0:
+                start = mm.rfind(b'\n', 0, pos) + 1
+                end = mm.find(b'\n', pos)
+                if end < 0:
+                    end = len(mm)
+
+                # Only a match if within the first field of the row
+                row = mm[start:end].rstrip(b'\r').split(b' ')
+                if target in row[0]:
+                    if len(row) > 3:
+                        return row[3][6:].split(b'.')[0].decode('ascii')
+
+                pos = mm.find(target, end)
+
+    logger.error("No corresponding UNIX time found")
+    return None
 
 
 def nsvf_tc_extract(swis_dir):
@@ -378,9 +603,11 @@ def nsvf_tc_extract(swis_dir):
 
     Requires:
         TC_Responses.txt -- File generated by nsvf_parse of PanCam responses.
+        TC_Candidates.txt -- File generated by nsvf_parse of potential TCs.
 
     Generates:
         TC.txt -- ASCII txt file of all TCs sent to PanCam.
+        Unproc_TC.pickle -- Pandas pickle of the matched TCs for tc_cal.
     """
 
     logger.info('Extracting SWIS NSVF TCs')
@@ -394,32 +621,25 @@ def nsvf_tc_extract(swis_dir):
     else:
         file_responses = file_responses[0]
 
-    logger.info('Searching for Router_A_packet.log')
-    file_logbook = pancam_fns.Find_Files(
-        swis_dir, 'Router_A_packet.log', SingleFile=True)
+    logger.info('Searching for TC_Candidates.txt')
+    file_cand = pancam_fns.Find_Files(
+        swis_dir, 'TC_Candidates.txt', SingleFile=True)
 
-    if file_logbook == []:
+    if file_cand == []:
+        logger.error("No TC_Candidates.txt, rerun nsvf_parse")
         return
     else:
-        file_logbook = file_logbook[0]
+        file_cand = file_cand[0]
 
-    # Create a PROC directory if does not already exist
-    proc_dir = file_logbook.parent / 'PROC'
-    if not proc_dir.is_dir():
-        proc_dir.mkdir()
+    proc_dir = file_cand.parent
 
-    # Create a list of all relevant packets from packet.log
-    tc_list = []
-    with open(file_logbook, 'r') as packets:
+    # Index the potential TCs by transaction ID and time prefix
+    tc_index = {}
+    with open(file_cand, 'r', newline='') as packets:
         log_reader = csv.reader(packets, delimiter=' ')
-        logger.info("Extracting potential TCs from packet log %s",
-                    file_logbook.name)
+        logger.info("Reading potential TCs from %s", file_cand.name)
         for row in log_reader:
-            if row[1] != '[IN=08]':
-                continue
-            if len(row) < 32:  # Minimum PanCam command is Spw header and 5 bytes
-                continue
-            tc_list.append(row)
+            tc_index.setdefault((row[10], row[0][:2]), []).append(row)
 
     # File to write too
     f_tc = proc_dir / 'TC.txt'
@@ -429,76 +649,87 @@ def nsvf_tc_extract(swis_dir):
     f_wri = csv.writer(f_acc, delimiter=' ',
                        lineterminator='\r')
 
+    tc_list = []
+    unmatched = 0
     with open(file_responses, 'r') as resp:
         reader = csv.reader(resp, delimiter=' ')
         for tc_resp in reader:
-            trans_id = tc_resp[10]
-            trans_time = tc_resp[0][:2]
-            count = 0
-            for tc in tc_list:
-                if tc[10] != trans_id:
-                    continue
-                if tc[0][:2] != trans_time:
-                    continue
-                count += 1
-                f_wri.writerow(tc)
-
-                if count != 1:
-                    logger.error("Multiple potential TC matches found!")
+            matches = tc_index.get((tc_resp[10], tc_resp[0][:2]), [])
+
+            if not matches:
+                unmatched += 1
+                continue
+
+            if len(matches) != 1:
+                logger.error("Multiple potential TC matches found! "
+                             "%d TCs for response: %s", len(matches), tc_resp)
+
+            f_wri.writerows(matches)
+            tc_list.extend(matches)
 
     f_acc.close()
 
+    if unmatched:
+        logger.warning("%d TC responses without a matching TC", unmatched)
+
+    logger.info("Number of PanCam TCs found: %d", len(tc_list))
+
+    if tc_list:
+        tc = nsvf_tc_table(tc_list)
+        tc.to_pickle(proc_dir / "Unproc_TC.pickle")
+        logger.info("PanCam TC pickled.")
+
     logger.info("--Extracting SWIS NSVF TCs completed.")
 
     return
 
 
-def hk_nsvf_epoch(swis_dir):
-    """Determines the elsapsed time of the first nsvf hk packet and returns the Unix time.
+def nsvf_tc_table(tc_list):
+    """Converts router log TC rows into the same table as labview.tc_extract.
+
+    The PanCam command sits in the data field of the RMAP write, between the
+    RMAP header and the data CRC. Each command byte is given its own integer
+    column so that the table matches that of the other sources.
 
     Arguments:
-        swis_dir {swis_dir} -- Parent to the PROC dir where the nsvf logs are.
+        tc_list {list} -- Router log rows of the matched TCs.
 
     Returns:
-        epoch_str {str} -- The UNIX time of the first HK packet in seconds.
+        tc {pd.DataFrame()} -- Table with a column per command byte along
+            with the elapsed time, RMAP transaction ID, BID and ACTION.
     """
 
-    logger.info("Renaming HK file with Unix Epoch from logger file")
+    # Router log tokens before the RMAP data field
+    data_start = 4 + 16
 
-    nsvf_hk = pancam_fns.Find_Files(swis_dir, "nsvfHK.txt", SingleFile=True)[0]
-    log_file = pancam_fns.Find_Files(
-        swis_dir, "logbook.log", SingleFile=True)[0]
+    elapsed = []
+    trans_id = []
+    cmd = []
+    for row in tc_list:
+        tc_time = row[0][1:-1].split(':')
+        elapsed.append(float(tc_time[0] + '.' + tc_time[1]))
+        trans_id.append(int(row[9] + row[10], 16))
+        cmd.append([int(x, 16) for x in row[data_start:-2]])
 
-    # Determine relative time elapsed for first HK packet
-    logger.info("Extracting Elapsed time from first HK")
-    with open(nsvf_hk, 'r') as hk:
-        reader = csv.reader(hk, delimiter=' ')
-        hk_first = next(reader)
-        hk_first_time = hk_first[0][1:-1].split(':')
-        elapsed = hk_first_time[0] + '.' + hk_first_time[1]
+    tc = pd.DataFrame(cmd)
+    tc.insert(0, 'Elapsed_s', elapsed)
+    tc.insert(1, 'TRANS_ID', trans_id)
+    tc['BID'] = ((tc[0]*256 + tc[1]) & 0x7F8).values >> 3
 
-    # Search through logfile for the same elapsed time and get Unix time
-    epoch_str = None
-    with open(log_file, 'r') as log:
-        reader = csv.reader(log, delimiter=' ')
-        for row in reader:
-            # Some rows are just blank LF
-            try:
-                if elapsed in row[0]:
-                    epoch_str = row[3][6:].split('.')[0]
-                    break
-            except:
-                None
+    # No description is available in the router log so found from the BID
+    tc['ACTION'] = tc['BID'].map(TC_ACTIONS).fillna('')
+    tc['Source'] = 'Router_A_packet.log'
 
-    if epoch_str == None:
-        logger.error("No corresponding UNIX time found")
-
-    return epoch_str
+    return tc
 
 
 def sci_extract(swis_dir, nsvf=False):
     """Creates pci_raw files from the generated Sci.txt file. HS must be decoded and verified first
 
+    The text file is streamed a packet at a time with each image written in
+    turn. For standard SWIS the decoded packets are also hashed and compared
+    to the digest of the *SC.bin written by SWIS.
+
     Arguments:
         swis_dir {Path} -- If using NSVF path is within the Proc directory. Otherwise the source path is used.
         nsvf {bool} -- Set to true if from nsvf log (default: {False})
@@ -528,63 +759,38 @@ def sci_extract(swis_dir, nsvf=False):
     else:
         cur_dir = swis_dir / "PROC"
 
-    # Calculate number of lines in text file and ensure matches expected
-    num_pkts = sum(1 for line in open(sci_file))
-    num_imgs = num_pkts // 7
-    num_expt = hs.sci_cnt(cur_dir)
-    if num_imgs != num_expt:
-        logger.error("Missing Sci Parts Detected! %s", sci_file.name)
-
     # Create directory for binary image files
     img_raw_dir = cur_dir / "IMG_RAW"
     if not img_raw_dir.is_dir():
         logger.info("Generating 'IMG_RAW' directory %s", sci_file.name)
         img_raw_dir.mkdir()
 
-    # Create empty files for each image
-    img_lst = list(range(num_imgs))
-    f = img_lst
-    for item in img_lst:
-        write_file = img_raw_dir / (str(item).zfill(2) + ".pci_raw")
-        logger.info("Creating binary file %s", write_file.name)
-        f[item] = open(write_file, 'w+b')
-        create_json(write_file)
-
     # Read txt file and write to each binary file
     pkts = 7
     cur_img = 0
     cur_pkt = 1
+    img = None
     blank_file = False
+    buf = np.empty(0, dtype=np.uint8)
+    stream = hashlib.sha256()
+
     with open(sci_file) as sci:
-        if nsvf:
-            reader = csv.reader(sci, delimiter=' ')
-            for row in reader:
-                data = row[16:-2]
-                binary_format = bytes.fromhex(''.join(data))
-                f[cur_img].write(binary_format)
-                # Limit to writing 7 packets to each binary file
-                if cur_pkt == pkts:
-                    cur_img += 1
-                    cur_pkt = 1
-                else:
-                    cur_pkt += 1
+        for line in sci:
+            if not line.strip():
+                continue
 
-        else:
-            # Create temporary file to compare to *SC.bin
-            tmp_file = img_raw_dir / "sc_bin_comp.bin"
-            f_tmp = open(tmp_file, 'w+b')
+            if nsvf:
+                # Data follows the RMAP reply header, ignore CRC and [EOP]
+                data = bytes.fromhex(line.split(' ', 16)[16].rsplit(' ', 2)[0])
 
-            line = sci.readline()
-            while line != "":
+            else:
                 # Remove TimeStamp and [Informative]
-                line_red = line.replace("Timestamp: ", "")
-                line_red = line_red[26:]
-                line_red = line_red.replace("0x", "")
-                line_red = line_red.replace("\n", "").replace("\r", "")
-                binary_format = bytes.fromhex(line_red)
+                line_red = line.replace("Timestamp: ", "", 1)[26:]
+                buf = sc_decode(line_red, buf)
+                binary_format = memoryview(buf)
 
-                # Write binary_format to tmp file
-                f_tmp.write(binary_format)
+                # Running digest to compare to *SC.bin
+                stream.update(binary_format)
 
                 # Remove spacewire 12 byte header and 1 byte footer
                 data = binary_format[12:-1]
@@ -605,43 +811,93 @@ def sci_extract(swis_dir, nsvf=False):
                 if (cur_pkt == 1):
                     blank_file = (data[:49] == bytes(49))
 
-                f[cur_img].write(data)
+            # Start a new binary file for the first packet of each image
+            if cur_pkt == 1:
+                write_file = img_raw_dir / (str(cur_img).zfill(2) + ".pci_raw")
+                logger.info("Creating binary file %s", write_file.name)
+                pancam_fns.exist_unlink(write_file)
+                create_json(write_file)
+                img = open(write_file, 'wb')
+
+            img.write(data)
+
+            # Limit to writing 7 packets to each binary file
+            if cur_pkt == pkts:
+                img.close()
+                img = None
+                if blank_file:
+                    sci_blank(write_file, cur_img)
+                cur_img += 1
+                cur_pkt = 1
 
-                # Limit to writing 7 packets to each binary file
-                if cur_pkt == pkts:
-                    f[cur_img].close()
+            else:
+                cur_pkt += 1
 
-                    if blank_file:
-                        logger.error(
-                            'Image #%d is a blank image, ignoring', cur_img)
-                        filename = Path(f[cur_img].name)
-                        filename.rename(filename.with_suffix('.pci_blank'))
-                        logger.info(
-                            'Deleting blank image json: %s', filename.stem)
-                        filename.with_suffix('.json').unlink()
+    if img is not None:
+        img.close()
+        logger.error("Incomplete final image: %d, %d packets",
+                     cur_img, cur_pkt - 1)
+        cur_img += 1
 
-                    cur_img += 1
-                    cur_pkt = 1
+    num_expt = hs.sci_cnt(cur_dir)
+    if cur_img != num_expt:
+        logger.error("Missing Sci Parts Detected! %s", sci_file.name)
 
-                else:
-                    cur_pkt += 1
+    if not nsvf:
+        # Compare streamed digest to original bin file
+        ref = sci_file.with_suffix(".bin")
+        if not ref.exists():
+            logger.error("No .bin file found for %s", sci_file.name)
+        elif stream.hexdigest() == pancam_fns.file_digest(ref):
+            logger.info(
+                "Decoded packets match output .bin %s", sci_file.name)
+        else:
+            logger.error(
+                "Decoded packets do not match output .bin %s", sci_file.name)
 
-                line = sci.readline()
+    logger.info("--Extracting Science Images completed.")
 
-            f_tmp.close()
 
-            # Compare temp file to original bin file
-            ref = sci_file.with_suffix(".bin")
-            if filecmp.cmp(tmp_file, ref, shallow=False):
-                logger.info(
-                    "Temporary file matches output .bin %s", sci_file.name)
-            else:
-                logger.error(
-                    "Temporary file does not match output .bin %s", sci_file.name)
+def sc_decode(line, buf):
+    """Decodes a row of '0x..' hex values into a reusable buffer.
 
-            tmp_file.unlink()
+    Arguments:
+        line {str} -- Row of hex values each prefixed with '0x'.
+        buf {np.array} -- uint8 buffer from the previous call, grown if too small.
+
+    Returns:
+        np.array -- Buffer view of the decoded bytes.
+    """
+
+    raw = np.frombuffer(line.encode('ascii'), dtype=np.uint8)
+
+    # Each value follows an 'x', which can not be a hex digit
+    pos = np.flatnonzero(raw[:-2] == ord('x'))
+    hi = pancam_fns.HEX_LUT[raw[pos + 1]]
+    lo = pancam_fns.HEX_LUT[raw[pos + 2]]
+    if (hi | lo).max(initial=0) > 0xF:
+        raise ValueError("Non-hex value found in science packet")
+
+    if buf.base is not None:
+        buf = buf.base
+    if buf.size < pos.size:
+        buf = np.empty(pos.size, dtype=np.uint8)
+
+    out = buf[:pos.size]
+    np.left_shift(hi, 4, out=out)
+    np.bitwise_or(out, lo, out=out)
+
+    return out
 
-    logger.info("--Extracting Science Images completed.")
+
+def sci_blank(filename, img_no):
+    """Renames a blank image to .pci_blank and removes its json"""
+
+    logger.error('Image #%d is a blank image, ignoring', img_no)
+    pancam_fns.exist_unlink(filename.with_suffix('.pci_blank'))
+    filename.rename(filename.with_suffix('.pci_blank'))
+    logger.info('Deleting blank image json: %s', filename.stem)
+    filename.with_suffix('.json').unlink()
 
 
 def create_json(img_file):
@@ -670,58 +926,150 @@ def sci_compare(proc_dir):
     header. Function requires SWIS Reference images to be available. With
     relative path "../resources/SWIS_Reference"
 
+    The image data after the 48 byte header is hashed and compared to the
+    cached digest of the reference. Only on a mismatch are the two files
+    compared byte for byte to summarise the differences.
+
     Arguments:
         proc_dir {Path} -- Path to .pci_raw file generated by nsvf_parse
-
-    Generates:
-        .tmp -- This file is the .pci_raw without the header but is removed when compared.
     """
 
     logger.info("Comparing science images")
 
     # Constants
     ref_dir = Path().parent.absolute() / "resources" / "swis_reference_images"
+    ref_names = {1: "pfm_wacl.raw",   # WACL
+                 2: "pfm_wacr.raw",   # WACR
+                 3: "pfm_hrc.raw"}    # HRC
 
     # Find PanCam images
     sci_files = pancam_fns.Find_Files(proc_dir, '*.pci_raw')
+    if not sci_files:
+        return
+
+    ref_digest = ref_digests(ref_dir, ref_names.values())
 
     for sci in sci_files:
         # First read header and determine cam
-        gen = open(sci, 'rb')
-        header = gen.read(48)
+        with open(sci, 'rb') as gen:
+            header = gen.read(48)
         cam = upf('u2', header, offset=130)[0]
 
-        if cam == 1:
-            # WACL
-            ref = ref_dir / "pfm_wacl.raw"
-        elif cam == 2:
-            # WACR
-            ref = ref_dir / "pfm_wacr.raw"
-        elif cam == 3:
-            # HRC
-            ref = ref_dir / "pfm_hrc.raw"
-        else:
+        if cam not in ref_names:
             # Invalid
             logger.error("Invalid cam type for %s", sci.name)
             continue
 
-        # Store rest of data in a temporary file
-        tmp_file = sci.with_suffix(".tmp")
-        tmp = open(tmp_file, 'wb')
-        tmp.write(gen.read())
-        tmp.close()
-        logger.info("Generated img tmp file %s", tmp_file.name)
+        ref = ref_dir / ref_names[cam]
 
         # Compare files
         logger.info("Comparing: %s", sci.name)
-        if filecmp.cmp(tmp_file, ref, shallow=False):
+        if pancam_fns.file_digest(sci, offset=48) == ref_digest.get(ref.name):
             status.info("Science Files match")
         else:
             logger.error("Science Files do not match!")
+            sci_diff(sci, ref)
+
+
+def ref_digests(ref_dir, ref_names):
+    """Returns the digests of the reference images, using the cache where valid.
+
+    The digests are cached in ref_dir and recalculated for any reference whose
+    size or modification time has changed.
+
+    Arguments:
+        ref_dir {Path} -- Directory of the reference images.
+        ref_names {iterable} -- File names of the reference images.
+
+    Returns:
+        dict -- Digest of each reference image found keyed by file name.
+    """
+
+    cache_file = ref_dir / REF_DIGEST_FILE
+
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    digests = {}
+    updated = False
+    for name in ref_names:
+        ref = ref_dir / name
+        try:
+            stat = ref.stat()
+        except OSError:
+            logger.error("Reference image not found: %s", ref)
+            continue
+
+        entry = cache.get(name, {})
+        if (entry.get('Size') != stat.st_size) \
+                or (entry.get('MTime_ns') != stat.st_mtime_ns):
+            logger.info("Hashing reference image %s", name)
+            entry = {'Size': stat.st_size,
+                     'MTime_ns': stat.st_mtime_ns,
+                     'Digest': pancam_fns.file_digest(ref)}
+            cache[name] = entry
+            updated = True
+
+        digests[name] = entry['Digest']
+
+    if updated:
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f, indent=4)
+        except OSError:
+            logger.warning("Unable to write reference digests %s", cache_file)
+
+    return digests
 
-        # Clean up tmp file and close read file
-        tmp_file.unlink()
-        gen.close()
+
+def sci_diff(sci, ref, max_ranges=10):
+    """Logs a summary of where a generated image differs from the reference.
+
+    Arguments:
+        sci {Path} -- Generated .pci_raw image.
+        ref {Path} -- Reference image without a header.
+
+    Keyword Arguments:
+        max_ranges {int} -- Maximum number of byte ranges to list (default: {10})
+    """
+
+    # A truncated image without a whole header is reported as a size mismatch
+    if sci.stat().st_size > pci_raw.HDR_BYTES:
+        with pci_raw.PciRaw(sci) as img:
+            gen = img.data
+    else:
+        gen = np.empty(0, dtype=np.uint8)
+    ref_img = np.memmap(ref, dtype=np.uint8, mode='r')
+
+    if gen.size != ref_img.size:
+        logger.error("Image data is %d bytes, reference is %d bytes",
+                     gen.size, ref_img.size)
+
+    length = min(gen.size, ref_img.size)
+    diff = gen[:length] != ref_img[:length]
+
+    # Start and end of each run of mismatching bytes
+    edges = np.flatnonzero(np.diff(np.concatenate(
+        ([False], diff, [False])).astype(np.int8)))
+    starts = edges[0::2]
+    ends = edges[1::2]
+
+    # Pixels are 2 bytes so any mismatching byte gives a mismatching pixel
+    pixels = diff[:length - length % 2].reshape(-1, 2).any(axis=1)
+
+    logger.error("%d bytes differ in %d ranges, %d of %d pixels differ",
+                 np.count_nonzero(diff), starts.size,
+                 np.count_nonzero(pixels), pixels.size)
+    for start, end in zip(starts[:max_ranges], ends[:max_ranges]):
+        logger.error("Bytes differ: 0x%06X - 0x%06X", start, end - 1)
+    if starts.size > max_ranges:
+        logger.error("... %d further ranges not listed",
+                     starts.size - max_ranges)
+
+    del gen, ref_img
 
 
 def create_instances(swis_dir):
@@ -781,12 +1129,153 @@ def create_instances(swis_dir):
             ref = (instance_name + suffix)
             orig = swis_dir / ref
             if orig.exists():
-                copyfile(orig, inst_dir / ref)
-                orig.unlink()
+                os.replace(orig, inst_dir / ref)
 
     return instances
 
 
+def process_instances(swis_dir, instances, workers=None):
+    """Processes each SWIS TB instance, in parallel where more than one.
+
+    Instances share no state so each is given to a separate process. Log
+    records from the workers are passed back through a queue and handled by
+    the loggers of this process, so they end up in the same processing.log.
+    The CPUs are shared between the instance workers, so the pools started
+    within each instance are limited to their share.
+
+    Arguments:
+        swis_dir {Path} -- Source path to TB output, usual "Bin" folder.
+        instances {List of Paths} -- Instance folders from create_instances.
+
+    Keyword Arguments:
+        workers {int} -- Number of processes, None for the CPU count (default: {None})
+
+    Returns:
+        summary {pd.DataFrame()} -- Result of each instance.
+
+    Generates:
+        SWIS_Instance_Summary.csv -- The summary within the top level PROC folder.
+    """
+
+    if not instances:
+        return pd.DataFrame()
+
+    cpus = os.cpu_count() or 1
+    if workers is None:
+        workers = cpus
+    workers = min(workers, len(instances))
+
+    if workers == 1:
+        results = [process_instance(inst) for inst in instances]
+
+    else:
+        status.info("Processing %d SWIS instances with %d workers",
+                    len(instances), workers)
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(
+            log_queue, pancam_fns.LogDispatch())
+        listener.start()
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=pancam_fns.worker_logging,
+                                     initargs=(log_queue,)) as pool:
+                inst_workers = max(1, cpus // workers)
+                results = list(pool.map(process_instance, instances,
+                                        [inst_workers] * len(instances)))
+        finally:
+            listener.stop()
+
+    summary = pd.DataFrame(results)
+    status.info("SWIS instance summary:\n%s", summary.to_string(index=False))
+
+    failed = summary[summary['Result'] != 'Completed']
+    if not failed.empty:
+        logger.error("%d of %d SWIS instances failed",
+                     failed.shape[0], summary.shape[0])
+
+    proc_dir = swis_dir / "PROC"
+    if proc_dir.is_dir():
+        summary.to_csv(proc_dir / "SWIS_Instance_Summary.csv", index=False)
+
+    return summary
+
+
+def process_instance(inst, workers=None):
+    """Runs the full processing chain for a single SWIS TB instance.
+
+    Arguments:
+        inst {Path} -- Instance folder.
+
+    Keyword Arguments:
+        workers {int} -- Processes for the pools within the instance, None for the CPU count (default: {None})
+
+    Returns:
+        dict -- Instance name, result, time taken, log counts and images.
+    """
+
+    # Imported here to avoid loading plotting for the parsers alone
+    import hk_cal
+    import hk_raw
+    import image_browse
+    import plotter
+    import tc_cal
+
+    proc_dir = inst / "PROC"
+    counter = _LogCounter(inst.name)
+    handlers = logging.getLogger().handlers[:]
+    for handler in handlers:
+        handler.addFilter(counter)
+
+    start = time.monotonic()
+    status.info("Analysing %s", inst.name)
+    try:
+        hk_extract(inst)
+        hs_extract(inst, workers=workers)
+        hs.decode(proc_dir, True)
+        hs.verify(inst)
+        hk_raw.decode(proc_dir, 'SWIS')
+        hk_cal.cal_HK(proc_dir)
+        tc_cal.decode_all(proc_dir)
+        plotter.all_plots(proc_dir)
+        sci_extract(inst)
+        sci_compare(inst)
+        image_browse.Img_RAW_Browse(proc_dir, workers=workers)
+        result = 'Completed'
+    except Exception:
+        logger.exception("Processing of instance %s failed", inst.name)
+        result = 'Failed'
+    finally:
+        for handler in handlers:
+            handler.removeFilter(counter)
+
+    return {'Instance': inst.name,
+            'Result': result,
+            'Time_s': round(time.monotonic() - start, 1),
+            'Errors': counter.counts['ERROR'] + counter.counts['CRITICAL'],
+            'Warnings': counter.counts['WARNING'],
+            'Images': len(list((proc_dir / "IMG_RAW").glob('*.pci_raw')))}
+
+
+class _LogCounter(logging.Filter):
+    """Counts records by level and tags the message with the instance name.
+
+    Added to each root handler so a record is only counted the first time.
+    """
+
+    def __init__(self, inst_name):
+        super().__init__()
+        self.inst_name = inst_name
+        self.counts = {'WARNING': 0, 'ERROR': 0, 'CRITICAL': 0}
+
+    def filter(self, record):
+        if not getattr(record, 'swis_instance', None):
+            record.swis_instance = self.inst_name
+            record.msg = "[" + self.inst_name + "] " + str(record.msg)
+            if record.levelname in self.counts:
+                self.counts[record.levelname] += 1
+        return True
+
+
 if __name__ == "__main__":
     dir = Path(
         input("Type the path to the folder where the SWIS files are stored: "))
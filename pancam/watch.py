@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Follows a session folder and refreshes the processed products as data lands.
+
+During tests new Rover .ha and STDRawOcds*.csv files or LabView RMAP_* files
+are continuously added to the session folder. Rather than re-running main.py
+by hand, watch() follows the folder using inotify where available, or by
+polling the file sizes and modification times otherwise. Once new or appended
+data has settled only the extractors for the types of file changed are re-run,
+followed by the products depending on them.
+
+The extractors keep the files already read in a cache, so only new or changed
+files are parsed again. The .ha scan is resumed from where the last refresh
+finished and image browse products are only made for new images.
+
+:copyright: (c) 2020 by Barry J Whiteside. Mullard Space Science Laboratory - UCL
+
+:license: GPLv3, see LICENSE for more details.
+"""
+
+from pathlib import Path
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+import pancam_fns
+
+logger = logging.getLogger(__name__)
+status = logging.getLogger('status')
+
+# Global parameters
+WATCH_PATTERNS = ['*.ha',
+                  'STDRawOcds*.csv',
+                  'STDChrono*.csv',
+                  'RMAP_*.txt',
+                  'PSU_Log_*.txt',
+                  '*.bin']
+WATCH_IGNORE_DIRS = {'PROC', 'ARCHIVE'}
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_EVENT = struct.Struct('iIII')
+
+
+class WatchError(Exception):
+    """error for unexpected things"""
+    pass
+
+
+def watched(path):
+    """Returns True if the file is one that the extractors read"""
+    if WATCH_IGNORE_DIRS.intersection(path.parts):
+        return False
+    return any(fnmatch.fnmatch(path.name, pat) for pat in WATCH_PATTERNS)
+
+
+class PollWatcher(object):
+    """Detects new and appended files by comparing directory snapshots.
+
+    Arguments:
+        top_dir {Path} -- Session folder to watch.
+    """
+
+    def __init__(self, top_dir):
+        self.top_dir = top_dir
+        self._snapshot = self._scan()
+
+    def close(self):
+        pass
+
+    def wait(self, timeout):
+        """Blocks for up to timeout seconds and returns the changed files"""
+        time.sleep(timeout)
+        snapshot = self._scan()
+        changed = {path for path, stat in snapshot.items()
+                   if self._snapshot.get(path) != stat}
+        self._snapshot = snapshot
+        return changed
+
+    def _scan(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self.top_dir):
+            dirs[:] = [d for d in dirs if d not in WATCH_IGNORE_DIRS]
+            for name in files:
+                path = Path(root) / name
+                if not watched(path):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+
+class InotifyWatcher(object):
+    """Detects new and appended files using Linux inotify.
+
+    Every sub folder of top_dir is watched, along with any created later.
+
+    Arguments:
+        top_dir {Path} -- Session folder to watch.
+    """
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, top_dir):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise WatchError("inotify not available")
+
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError("inotify_init1 failed: "
+                             + os.strerror(ctypes.get_errno()))
+
+        self._dirs = {}
+        for root, dirs, _ in os.walk(top_dir):
+            dirs[:] = [d for d in dirs if d not in WATCH_IGNORE_DIRS]
+            self._add_watch(Path(root))
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def wait(self, timeout):
+        """Blocks for up to timeout seconds and returns the changed files"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_len = IN_EVENT.unpack_from(data, pos)
+            name = data[pos + IN_EVENT.size:pos + IN_EVENT.size + name_len]
+            pos += IN_EVENT.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflow, events lost")
+                continue
+
+            if wd not in self._dirs:
+                continue
+            path = self._dirs[wd] / os.fsdecode(name.rstrip(b'\0'))
+
+            if mask & IN_ISDIR:
+                if (mask & (IN_CREATE | IN_MOVED_TO)) \
+                        and path.name not in WATCH_IGNORE_DIRS:
+                    self._add_watch(path)
+            elif watched(path):
+                changed.add(path)
+
+        return changed
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(str(path)), self.mask)
+        if wd < 0:
+            logger.warning("Unable to watch %s: %s", path,
+                           os.strerror(ctypes.get_errno()))
+            return
+        self._dirs[wd] = path
+
+
+def create_watcher(top_dir):
+    """Returns an InotifyWatcher if supported otherwise a PollWatcher"""
+    try:
+        watcher = InotifyWatcher(top_dir)
+        logger.info("Watching %s using inotify", top_dir)
+    except (WatchError, AttributeError, OSError):
+        watcher = PollWatcher(top_dir)
+        logger.info("Watching %s by polling", top_dir)
+    return watcher
+
+
+def touched(changed, *patterns):
+    """Returns True if any of the changed files match one of the patterns.
+
+    Arguments:
+        changed {set} -- Changed files, None if unknown so all are assumed changed.
+    """
+    if changed is None:
+        return True
+    return any(fnmatch.fnmatch(path.name, pat)
+               for path in changed for pat in patterns)
+
+
+def refresh(top_dir, source, model=None, changed=None, cache=None):
+    """Re-runs the extractors and products affected by the changed files.
+
+    Arguments:
+        top_dir {Path} -- Session folder.
+        source {str} -- Source type from config.json, 'Rover' or 'LabView'.
+
+    Keyword Arguments:
+        model {str} -- Rover model used for the CUC epoch (default: {None})
+        changed {set} -- Files changed since the last refresh, None for all (default: {None})
+        cache {dict} -- Files already read by the extractors, kept between refreshes (default: {None})
+    """
+
+    # Imported here to avoid loading plotting for the watcher alone
+    import hk_cal
+    import hk_raw
+    import hs
+    import image_browse
+    import labview
+    import plotter
+    import rover
+    import rover_ha
+    import tc_cal
+
+    proc_dir = top_dir / 'PROC'
+
+    if source == 'Rover':
+        new_tc = touched(changed, 'STDChrono*.csv')
+        new_tm = touched(changed, 'STDRawOcds*.csv')
+        new_ha = touched(changed, '*.ha')
+
+        if new_tc:
+            rover.TC_extract(top_dir, cache=cache)
+        if new_tm:
+            rover.TM_extract(top_dir, cache=cache)
+        if new_ha:
+            rover_ha.HaScan(top_dir, live=True)
+            rover_ha.RestructureHK(proc_dir)
+            rover.NavCamBrowse(top_dir)
+        if new_tm or new_ha:
+            rover_ha.compareHaCSV(proc_dir)
+
+        new_hk = new_tm or new_ha
+        new_img = new_ha
+        new_plot = new_tc or new_tm or new_ha
+
+    elif source == 'LabView':
+        new_hk = touched(changed, 'RMAP_HK*.txt')
+        new_hs = touched(changed, 'RMAP_H&S*.txt')
+        new_tc = touched(changed, 'RMAP_CMD_*.txt')
+        new_psu = touched(changed, 'PSU_Log_*.txt')
+        new_img = new_hs or touched(changed, 'RMAP_Sci*.txt', '*.bin')
+
+        if new_hk:
+            labview.hk_extract(top_dir, cache=cache)
+        if new_hs:
+            labview.hs_extract(top_dir, cache=cache)
+            hs.decode(proc_dir)
+            hs.verify(proc_dir)
+        if new_tc:
+            labview.tc_extract(top_dir, cache=cache)
+        if new_img:
+            if hs.all_default_image_dim(proc_dir):
+                labview.sci_extract(top_dir)
+                labview.bin_move(top_dir)
+            else:
+                labview.bin_move(top_dir, comp_spw=False)
+            labview.create_spw_images(proc_dir)
+        if new_psu:
+            labview.psu_extract(top_dir, cache=cache)
+
+        new_plot = new_hk or new_tc or new_psu
+
+    else:
+        raise WatchError("Watch mode not supported for source: " + str(source))
+
+    if new_hk:
+        hk_raw.decode(proc_dir, source, model)
+        hk_cal.cal_HK(proc_dir)
+    if new_tc:
+        tc_cal.decode_all(proc_dir)
+    if new_img:
+        image_browse.Img_RAW_Browse(proc_dir)
+    if new_plot:
+        plotter.all_plots(proc_dir)
+
+
+def watch(top_dir, source, model=None, settle=2.0, poll=1.0):
+    """Follows top_dir and refreshes the products whenever new data lands.
+
+    Changes are collected until no new events have been seen for settle
+    seconds so that a burst of appends causes a single refresh. Runs until
+    interrupted with Ctrl+C.
+
+    Arguments:
+        top_dir {Path} -- Session folder.
+        source {str} -- Source type from config.json, 'Rover' or 'LabView'.
+
+    Keyword Arguments:
+        model {str} -- Rover model used for the CUC epoch (default: {None})
+        settle {float} -- Seconds without changes before refreshing (default: {2.0})
+        poll {float} -- Seconds between checks for changes (default: {1.0})
+    """
+
+    if source not in ('Rover', 'LabView'):
+        logger.error("Watch mode not supported for source: %s", source)
+        return
+
+    watcher = create_watcher(top_dir)
+    status.info("Watching %s for new data, Ctrl+C to stop", top_dir)
+
+    cache = {}
+    pending = set()
+    failed = set()
+    last_change = None
+    try:
+        while True:
+            changed = watcher.wait(poll)
+            if changed:
+                pending |= changed
+                last_change = time.monotonic()
+                continue
+
+            if pending and (time.monotonic() - last_change >= settle):
+                status.info("New data in %d files, refreshing", len(pending))
+                for path in sorted(pending):
+                    logger.info("Changed: %s", path)
+                changed, pending = pending | failed, set()
+
+                start = time.monotonic()
+                try:
+                    refresh(top_dir, source, model, changed, cache)
+                    failed = set()
+                except Exception:
+                    # Retried along with the next data to arrive
+                    failed = changed
+                    logger.exception("Refresh failed, waiting for more data")
+                status.info("Refresh completed in %.1f s",
+                            time.monotonic() - start)
+
+    except KeyboardInterrupt:
+        status.info("Stopped watching %s", top_dir)
+
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    top_dir = Path(
+        input("Type the path to the session folder to watch: "))
+
+    proc_dir = top_dir / "PROC"
+    if not proc_dir.is_dir():
+        proc_dir.mkdir()
+
+    logger, status = pancam_fns.setup_logging()
+    pancam_fns.setup_proc_logging(logger, proc_dir)
+
+    logger.info('\n\n\n\n')
+    logger.info("Running watch.py as main")
+    logger.info("Watching directory: %s", top_dir)
+
+    source = input("Source type [Rover (Default) / LabView]: ") or 'Rover'
+    watch(top_dir, source)
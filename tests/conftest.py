@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The pancam modules are imported by name, as when run from pancam/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'pancam'))
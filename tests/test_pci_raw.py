@@ -0,0 +1,44 @@
+import bitstruct
+import numpy as np
+import pytest
+
+import pci_raw
+
+
+def bitstruct_unpack(data):
+    """Unpacks non-padded data as image_browse did before unpack_10bit"""
+    pixels = []
+    for i in range(0, len(data) - 4, 5):
+        pixels.extend(bitstruct.unpack('u10u10u10u10', data[i:i+5]))
+    return np.asarray(pixels)
+
+
+@pytest.mark.parametrize('res', pci_raw.BIN_RES)
+def test_round_trip(res):
+    rng = np.random.default_rng(res)
+    pixels = rng.integers(0, 1024, size=(res, res), dtype=np.uint16)
+
+    data = pci_raw.pack_10bit(pixels)
+
+    assert len(data) == res * res * 5 // 4
+    np.testing.assert_array_equal(pci_raw.unpack_10bit(data, res), pixels)
+
+
+def test_matches_bitstruct():
+    res = 256
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, size=res * res * 5 // 4, dtype=np.uint8).tobytes()
+
+    np.testing.assert_array_equal(pci_raw.unpack_10bit(data, res),
+                                  bitstruct_unpack(data).reshape(res, res))
+
+
+def test_incomplete_group_ignored():
+    data = pci_raw.pack_10bit(np.arange(8)) + b'\xff\xff'
+
+    np.testing.assert_array_equal(pci_raw.unpack_10bit(data), np.arange(8))
+
+
+def test_short_frame():
+    with pytest.raises(pci_raw.PciRawError):
+        pci_raw.unpack_10bit(bytes(100), 128)
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+import hk_cal
+import hk_raw
+import image_browse
+import pancam_fns
+import plotter
+import rover
+import rover_ha
+import watch
+
+
+def hk_packet(cuc, payload=b''):
+    """ES HK packet with the given CUC"""
+    return bytes([0x0C, 0x01]) + cuc.to_bytes(6, 'big') + payload
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """Rover session where the extractors write the given HK packets"""
+
+    top_dir = tmp_path
+    proc_dir = top_dir / 'PROC'
+    proc_dir.mkdir()
+    data = {'ha': [], 'csv': []}
+    decoded = []
+
+    def tm_extract(ROV_DIR, cache=None):
+        pd.DataFrame({'RAW': [pkt.hex() for pkt in data['csv']],
+                      'DT': pd.Timestamp('2020-01-01')}).to_pickle(
+            proc_dir / '200101_000000_csv_Unproc_HKTM.pickle')
+        return True
+
+    def restructure_hk(ROV_DIR):
+        pd.DataFrame({'RAW': data['ha'],
+                      'Pkt_CUC': pd.array([int.from_bytes(pkt[2:8], 'big') for pkt in data['ha']],
+                                          dtype='Int64'),
+                      'Source': '.ha'}).to_pickle(
+            proc_dir / 'PanCam_1_00_ha_Unproc_HKTM.pickle')
+
+    def decode(PROC_DIR, source, rov_type=None):
+        found = pancam_fns.Find_Files(
+            PROC_DIR, "*Unproc_HKTM.pickle", SingleFile=True)
+        decoded.append(set(pd.read_pickle(found[0])['RAW'].map(bytes)))
+
+    def nothing(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(rover, 'TM_extract', tm_extract)
+    monkeypatch.setattr(rover, 'NavCamBrowse', nothing)
+    monkeypatch.setattr(rover_ha, 'HaScan', nothing)
+    monkeypatch.setattr(rover_ha, 'RestructureHK', restructure_hk)
+    monkeypatch.setattr(hk_raw, 'decode', decode)
+    monkeypatch.setattr(hk_cal, 'cal_HK', nothing)
+    monkeypatch.setattr(image_browse, 'Img_RAW_Browse', nothing)
+    monkeypatch.setattr(plotter, 'all_plots', nothing)
+
+    return top_dir, data, decoded
+
+
+def test_refresh_keeps_hk_when_one_source_changes(session):
+    top_dir, data, decoded = session
+    ha_file = {top_dir / 'a.ha'}
+    csv_file = {top_dir / 'STDRawOcds1.csv'}
+
+    a, b, c, d, e = (hk_packet(cuc) for cuc in (1 << 16, 2 << 16, 3 << 16, 4 << 16, 5 << 16))
+
+    data['ha'] = [a, b]
+    data['csv'] = [b, c]
+    watch.refresh(top_dir, 'Rover', changed=ha_file | csv_file)
+    assert decoded[-1] == {a, b, c}
+
+    # Only the .csv changes
+    data['csv'] = [b, c, d]
+    watch.refresh(top_dir, 'Rover', changed=csv_file)
+    assert decoded[-1] == {a, b, c, d}
+
+    # Only the .ha changes
+    data['ha'] = [a, b, e]
+    watch.refresh(top_dir, 'Rover', changed=ha_file)
+    assert decoded[-1] == {a, b, c, d, e}
+
+    proc_dir = top_dir / 'PROC'
+    assert len(list(proc_dir.glob('*Unproc_HKTM.pickle'))) == 1
+    assert len(list(proc_dir.glob('*.reconciled'))) == 2